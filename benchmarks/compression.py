@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import zmq
+
+# Checkpoint codec benchmark.
+#
+# Each kind of checkpoint-like payload is compressed chunk by chunk with
+# every available codec, as transfers do, measuring the ratio and the
+# compress and decompress throughput. The streaming model CodecSelector uses
+# (checkpoint_codecs.py) then gives each codec's transfer time across a
+# range of link throughputs, which shows where the codecs cross over:
+#
+#   best        which codec is fastest over which range of link throughputs
+#   beats none  the link throughput below which a codec is faster than
+#               sending raw
+#   selector    what CodecSelector picks at each link throughput from its
+#               few sampled chunks, and how much slower than the best that is
+#
+# --live also sends every payload through a TransferServer on loopback with
+# each codec forced and once in auto mode, to check the model against real
+# transfers on this machine's (fast) loopback link.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shared'))
+
+from checkpoint_codecs import CODECS, BY_NAME, CodecSelector, profile_codec, estimate_seconds  # noqa: E402
+from checkpoint_store import STORE_CHUNK_SIZE  # noqa: E402
+from transfer import TransferServer, CheckpointSender, CheckpointReceiver  # noqa: E402
+
+PAGE_SIZE = 4096
+# Link throughputs the crossovers are searched over, in MB/s
+GRID_MIN_MBPS = 0.1
+GRID_MAX_MBPS = 100000.0
+GRID_POINTS = 400
+
+
+def zero_pages(size, rng):
+    """Memory-image-like: mostly zero pages, some sparse and some random ones"""
+    pages = []
+    for _ in range(size // PAGE_SIZE):
+        kind = rng.random()
+        if kind < 0.6:
+            pages.append(bytes(PAGE_SIZE))
+        elif kind < 0.9:
+            page = bytearray(PAGE_SIZE)
+            for offset in range(0, PAGE_SIZE, 64):
+                page[offset:offset + 8] = rng.getrandbits(32).to_bytes(8, 'little')
+            pages.append(bytes(page))
+        else:
+            pages.append(rng.randbytes(PAGE_SIZE))
+    return b''.join(pages)
+
+
+def json_state(size, rng):
+    """Service state and journal records"""
+    records = []
+    total = 0
+    seq = 0
+    while total < size:
+        record = json.dumps({'seq': seq, 'task': f"task-{rng.randrange(1000)}", 'result': rng.random(),
+                             'status': rng.choice(('done', 'retry', 'failed')), 'ts': 1.7e9 + seq * 0.01})
+        records.append(record)
+        total += len(record) + 1
+        seq += 1
+    return '\n'.join(records).encode()[:size]
+
+
+def mixed(size, rng):
+    """A process image: code-like pages, heap, zero pages and JSON in equal parts"""
+    quarter = size // 4
+    return (zero_pages(quarter, rng) + json_state(quarter, rng) + rng.randbytes(quarter)
+            + bytes(size - 3 * quarter))
+
+
+def incompressible(size, rng):
+    return rng.randbytes(size)
+
+
+PAYLOADS = {
+    'zero_pages': zero_pages,
+    'json_state': json_state,
+    'mixed': mixed,
+    'random': incompressible
+}
+
+
+def chunked(data, chunk_size):
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)]
+
+
+def profile_all(chunks):
+    return {codec.name: profile_codec(codec, chunks) for codec in CODECS.values()}
+
+
+def _grid():
+    step = (math.log10(GRID_MAX_MBPS) - math.log10(GRID_MIN_MBPS)) / (GRID_POINTS - 1)
+    return [10 ** (math.log10(GRID_MIN_MBPS) + i * step) for i in range(GRID_POINTS)]
+
+
+def _seconds(profiles, name, size, link_rate):
+    return estimate_seconds(profiles[name] if name != 'none' else None, size, link_rate)
+
+
+def best_codec(profiles, size, link_rate):
+    return min(profiles, key=lambda name: _seconds(profiles, name, size, link_rate))
+
+
+def crossovers(profiles, size):
+    """Ranges of link throughput (MB/s) over which each codec is the fastest"""
+    ranges = []
+    for mbps in _grid():
+        name = best_codec(profiles, size, mbps * 1e6)
+        if ranges and ranges[-1]['codec'] == name:
+            ranges[-1]['to_mbps'] = mbps
+        else:
+            ranges.append({'codec': name, 'from_mbps': mbps, 'to_mbps': mbps})
+    return ranges
+
+
+def beats_none_below(profile):
+    """Link throughput (MB/s) below which a codec is faster than sending raw"""
+    if profile['ratio'] >= 1.0:
+        return None
+    # max(S/c, S*r/L, S/d) < S/L holds while L stays under both codec rates
+    return min(profile['compress_rate'], profile['decompress_rate']) / 1e6
+
+
+def selector_choices(profiles, chunks, size, links):
+    results = []
+    for mbps in links:
+        selector = CodecSelector(mode='auto', link_rate=mbps * 1e6)
+        started = time.perf_counter()
+        chosen = selector.choose('benchmark', list(BY_NAME), 0, len(chunks), lambda seq: chunks[seq]).name
+        choose_ms = (time.perf_counter() - started) * 1000
+        best = best_codec(profiles, size, mbps * 1e6)
+        results.append({
+            'link_mbps': mbps,
+            'chosen': chosen,
+            'best': best,
+            'choose_ms': choose_ms,
+            # Modelled transfer time of the choice relative to the best codec's
+            'slowdown': _seconds(profiles, chosen, size, mbps * 1e6) / _seconds(profiles, best, size, mbps * 1e6)
+        })
+    return results
+
+
+class LoopbackReceiver:
+    """A TransferServer on loopback that keeps received archives only long enough to check them"""
+
+    def __init__(self, context, endpoint, workdir):
+        self.workdir = workdir
+        self.received = {}
+        self.server = TransferServer(context, endpoint, self._make_receiver, self._on_received)
+
+    def _make_receiver(self, socket):
+        return CheckpointReceiver(socket, os.path.join(self.workdir, 'spool'), self._extract)
+
+    def _extract(self, archive_path, offer):
+        with open(archive_path, 'rb') as f:
+            self.received[offer['transfer_id']] = hashlib.sha256(f.read()).hexdigest()
+        return archive_path
+
+    def _on_received(self, checkpoint_dir, offer):
+        pass
+
+    def close(self):
+        self.server.close()
+
+
+def live_transfers(data, workdir, context, endpoint):
+    """Send `data` over loopback with every codec forced, then in auto mode"""
+    path = os.path.join(workdir, 'payload.bin')
+    with open(path, 'wb') as f:
+        f.write(data)
+    digest = hashlib.sha256(data).hexdigest()
+    receiver = LoopbackReceiver(context, endpoint, workdir)
+    results = []
+    try:
+        for mode in [codec.name for codec in CODECS.values()] + ['auto']:
+            sender = CheckpointSender(context, selector=CodecSelector(mode=mode))
+            # Names differ per run so no transfer resumes another's .part file
+            meta = {'source_node': 'benchmark', 'checkpoint_name': f"{mode}-{time.monotonic_ns()}"}
+            started = time.perf_counter()
+            reply = sender.send_file(endpoint, path, meta)
+            elapsed = time.perf_counter() - started
+            results.append({
+                'mode': mode,
+                'codec': reply.get('codec'),
+                'seconds': elapsed,
+                'bytes_sent': reply.get('bytes_sent'),
+                'intact': reply.get('success', False) and digest in receiver.received.values()
+            })
+            receiver.received.clear()
+    finally:
+        receiver.close()
+    return results
+
+
+def run(payloads, size, chunk_size, links, seed, live, endpoint):
+    results = []
+    context = zmq.Context() if live else None
+    workdir = tempfile.mkdtemp(prefix='compression_bench_')
+    try:
+        for index, name in enumerate(payloads):
+            data = PAYLOADS[name](size, random.Random(seed + index))
+            chunks = chunked(data, chunk_size)
+            profiles = profile_all(chunks)
+            result = {
+                'payload': name,
+                'bytes': len(data),
+                'codecs': {codec: {
+                    'ratio': profile['ratio'],
+                    'compress_mbps': profile['compress_rate'] / 1e6,
+                    'decompress_mbps': profile['decompress_rate'] / 1e6,
+                    'beats_none_below_mbps': beats_none_below(profile) if codec != 'none' else None
+                } for codec, profile in profiles.items()},
+                'best': crossovers(profiles, len(data)),
+                'selector': selector_choices(profiles, chunks, len(data), links)
+            }
+            if live:
+                result['live'] = live_transfers(data, workdir, context, endpoint)
+            results.append(result)
+            _print_result(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if context is not None:
+            context.term()
+    return results
+
+
+def _print_result(result):
+    print(f"\n{result['payload']} ({result['bytes'] >> 20} MB)", file=sys.stderr)
+    for codec, stats in result['codecs'].items():
+        beats = stats['beats_none_below_mbps']
+        print(f"  {codec:<8} ratio {stats['ratio']:6.3f}  compress {stats['compress_mbps']:9.1f} MB/s  "
+              f"decompress {stats['decompress_mbps']:9.1f} MB/s  "
+              f"beats none below {f'{beats:.1f} MB/s' if beats else '-'}", file=sys.stderr)
+    print("  best by link throughput:", file=sys.stderr)
+    for span in result['best']:
+        print(f"    {span['from_mbps']:10.1f} - {span['to_mbps']:10.1f} MB/s  {span['codec']}", file=sys.stderr)
+    for choice in result['selector']:
+        print(f"  selector at {choice['link_mbps']:8.1f} MB/s: {choice['chosen']:<8} (best {choice['best']}, "
+              f"{choice['slowdown']:.2f}x, chosen in {choice['choose_ms']:.1f}ms)", file=sys.stderr)
+    for transfer in result.get('live', []):
+        print(f"  live {transfer['mode']:<8} -> {transfer['codec']:<8} {transfer['seconds'] * 1000:8.1f}ms  "
+              f"{transfer['bytes_sent']} bytes  {'ok' if transfer['intact'] else 'CORRUPT'}", file=sys.stderr)
+
+
+def _floats(value):
+    return [float(item) for item in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Checkpoint codec crossover benchmark')
+    parser.add_argument('--payloads', nargs='+', choices=list(PAYLOADS), default=list(PAYLOADS))
+    parser.add_argument('--size-mb', type=float, default=16.0, help='Payload size per kind')
+    parser.add_argument('--chunk-kb', type=int, default=STORE_CHUNK_SIZE // 1024,
+                        help='Chunk size (default: the checkpoint store chunk)')
+    parser.add_argument('--links', type=_floats, default=[1, 10, 100, 1000, 10000],
+                        help='Comma-separated link throughputs (MB/s) to check the selector at')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--live', action='store_true', help='Also run real transfers over loopback')
+    parser.add_argument('--endpoint', default='tcp://127.0.0.1:18660', help='Loopback endpoint for --live')
+    parser.add_argument('--output', type=str, help='Write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    results = run(args.payloads, int(args.size_mb * (1 << 20)), args.chunk_kb * 1024, args.links, args.seed,
+                  args.live, args.endpoint)
+    report = {
+        'timestamp': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'codecs': list(BY_NAME)
+        },
+        'settings': {'size_mb': args.size_mb, 'chunk_kb': args.chunk_kb, 'links_mbps': args.links, 'seed': args.seed},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+# End-to-end failover benchmark on one host.
+#
+# Starts N recovery managers as local processes (no Docker) on loopback with
+# their own port ranges, injects faults through FaultSimulator, and times
+# every stage from the RECOVERY messages the nodes broadcast:
+#
+#   kill     fault -> service_exited -> service_restarted
+#   migrate  fault -> migration_started -> checkpoint_created
+#                  -> checkpoint_transferred -> service_restored
+#
+# Results are reported as p50/p95/p99 per stage and compared with a stored
+# baseline; the run fails when a tracked percentile regresses past tolerance.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED = os.path.join(ROOT, 'shared')
+sys.path.insert(0, SHARED)
+
+from comm import NodeCommunicator, node_name  # noqa: E402
+from registry import find_service_pids  # noqa: E402
+from simulate_faults import FaultSimulator  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'failover_baseline.json')
+HARNESS_ID = '0'
+SCENARIOS = ('kill', 'migrate')
+STAGES = {
+    'kill': ('service_exited', 'service_restarted'),
+    'migrate': ('migration_started', 'checkpoint_created', 'checkpoint_transferred', 'service_restored')
+}
+PERCENTILES = (50, 95, 99)
+
+
+class LocalCluster:
+    """N recovery managers on one host, each in its own process group"""
+
+    def __init__(self, nodes, host='127.0.0.1', pub_port_base=15550, transfer_port_base=16660,
+                 workdir=None, manager='recovery.py'):
+        self.node_ids = [str(i) for i in range(1, nodes + 1)]
+        self.workdir = workdir or tempfile.mkdtemp(prefix='failover_bench_')
+        self.manager = manager
+        self.processes = {}
+        self.env = {
+            'CLUSTER_NODES': ','.join(self.node_ids),
+            'OBSERVER_NODES': HARNESS_ID,
+            'NODE_HOST_TEMPLATE': host,
+            'PUB_PORT_BASE': str(pub_port_base),
+            'TRANSFER_PORT_BASE': str(transfer_port_base),
+            'SERVICES_CONFIG': self._write_services_config(),
+            'FAULT_DETECTOR': '0',
+            'EVENT_SINK': '0',
+            'MONITOR_INTERVAL': '0.2',
+            'PYTHONUNBUFFERED': '1'
+        }
+
+    def _write_services_config(self):
+        path = os.path.join(self.workdir, 'services.json')
+        with open(path, 'w') as f:
+            json.dump([{
+                'name': 'dummy_service',
+                'cmd': [sys.executable, os.path.join(SHARED, 'dummy_service.py')],
+                'standby': 1,
+                'state_file': '/tmp/dummy_service_state_{pid}.json',
+                # Only the injected faults should move services during a run
+                'cpu_threshold': 1000,
+                'mem_threshold': 1000
+            }], f)
+        return path
+
+    def start(self):
+        for node_id in self.node_ids:
+            env = dict(os.environ, **self.env, NODE_ID=node_id)
+            log = open(os.path.join(self.workdir, f"node{node_id}.log"), 'w')
+            self.processes[node_id] = subprocess.Popen(
+                [sys.executable, os.path.join(SHARED, self.manager)], env=env, cwd=SHARED,
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def service_pids(self, node_id):
+        return find_service_pids(node_id, 'dummy_service')
+
+    def wait_ready(self, timeout=30.0):
+        """Wait until every node supervises at least one service instance"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for node_id, process in self.processes.items():
+                if process.poll() is not None:
+                    raise RuntimeError(f"node{node_id} exited with code {process.returncode}, "
+                                       f"see {self.workdir}/node{node_id}.log")
+            if all(self.service_pids(node_id) for node_id in self.node_ids):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def stop(self):
+        for process in self.processes.values():
+            try:
+                os.killpg(process.pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        # Services restarted while their manager was shutting down outlive it
+        for process in self.processes.values():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+class StageRecorder:
+    """Collects the RECOVERY messages every node broadcasts"""
+
+    def __init__(self, node_ids):
+        self.messages = []
+        self.condition = threading.Condition()
+        self.communicator = NodeCommunicator(HARNESS_ID, peers=[node_name(i) for i in node_ids])
+        self.communicator.register_callback('RECOVERY', self._on_recovery)
+
+    def _on_recovery(self, message):
+        with self.condition:
+            self.messages.append(message)
+            self.condition.notify_all()
+
+    def wait_for(self, predicate, since, timeout):
+        """Return the first message after `since` matching predicate(source, data), or None"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for message in self.messages:
+                    if message['timestamp'] >= since and predicate(message['source'], message['data']):
+                        return message
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def close(self):
+        self.communicator.close()
+
+
+def _kill_trial(cluster, recorder, node_id, timeout):
+    pid = cluster.service_pids(node_id)[0]
+    simulator = FaultSimulator(node_id=node_id, communicator=recorder.communicator)
+    injected = time.time()
+    simulator.kill_dummy_service()
+
+    exited = recorder.wait_for(lambda source, data: data.get('action') == 'service_exited'
+                               and data.get('pid') == pid, injected, timeout)
+    restarted = exited and recorder.wait_for(lambda source, data: source == node_id
+                                             and data.get('action') == 'service_restarted',
+                                             exited['timestamp'], timeout)
+    if not restarted:
+        return None
+    return {
+        'service_exited': exited['timestamp'] - injected,
+        'service_restarted': restarted['timestamp'] - exited['timestamp'],
+        'mttr': restarted['timestamp'] - injected,
+        'bytes': 0
+    }
+
+
+def _migrate_trial(cluster, recorder, node_id, timeout):
+    simulator = FaultSimulator(node_id=node_id, communicator=recorder.communicator)
+    pid = cluster.service_pids(node_id)[0]
+    injected = time.time()
+    simulator.force_service_migration()
+
+    started = recorder.wait_for(lambda source, data: data.get('action') == 'migration_started'
+                                and data.get('pid') == pid, injected, timeout)
+    created = started and recorder.wait_for(lambda source, data: data.get('action') == 'checkpoint_created'
+                                            and data.get('pid') == pid, injected, timeout)
+    transferred = created and recorder.wait_for(lambda source, data: data.get('action') == 'checkpoint_transferred'
+                                                and str(data.get('source_node')) == node_id,
+                                                created['timestamp'], timeout)
+    if not transferred or not transferred['data'].get('success'):
+        return None
+    target = transferred['data']['target_node']
+    restored = recorder.wait_for(lambda source, data: node_name(source) == target
+                                 and data.get('action') == 'service_restored',
+                                 created['timestamp'], timeout)
+    if not restored:
+        return None
+    return {
+        'migration_started': started['timestamp'] - injected,
+        'checkpoint_created': created['timestamp'] - started['timestamp'],
+        'checkpoint_transferred': transferred['timestamp'] - created['timestamp'],
+        'service_restored': restored['timestamp'] - transferred['timestamp'],
+        'mttr': restored['timestamp'] - injected,
+        'bytes': transferred['data'].get('bytes_sent', 0)
+    }
+
+
+TRIALS = {'kill': _kill_trial, 'migrate': _migrate_trial}
+
+
+def run_scenario(cluster, recorder, scenario, trials, timeout=30.0, settle=0.5):
+    results = []
+    failures = 0
+    for trial in range(trials):
+        node_id = cluster.node_ids[trial % len(cluster.node_ids)]
+        if not cluster.wait_ready():
+            raise RuntimeError("Cluster did not recover between trials")
+        time.sleep(settle)
+        result = TRIALS[scenario](cluster, recorder, node_id, timeout)
+        if result is None:
+            failures += 1
+            print(f"{scenario} trial {trial + 1} on node{node_id} did not complete")
+        else:
+            results.append(result)
+    return results, failures
+
+
+def summarize(results, failures, scenario):
+    summary = {'trials': len(results), 'failures': failures}
+    if not results:
+        return summary
+    for stage in STAGES[scenario] + ('mttr',):
+        values = np.array([result[stage] for result in results]) * 1000
+        for p in PERCENTILES:
+            summary[f"{stage}_p{p}_ms"] = round(float(np.percentile(values, p)), 3)
+    sizes = np.array([result['bytes'] for result in results])
+    summary['bytes_mean'] = int(sizes.mean())
+    summary['bytes_total'] = int(sizes.sum())
+    return summary
+
+
+def check_baseline(report, baseline, tolerance):
+    """Return the regressions of report against baseline, as messages"""
+    regressions = []
+    for scenario, expected in baseline.items():
+        current = report.get(scenario)
+        if current is None:
+            continue
+        if current.get('failures', 0) > expected.get('failures', 0):
+            regressions.append(f"{scenario}: {current['failures']} failed trials (baseline {expected.get('failures', 0)})")
+        for metric, value in expected.items():
+            if not metric.startswith('mttr_') or metric not in current:
+                continue
+            if current[metric] > value * (1 + tolerance):
+                regressions.append(f"{scenario}: {metric} {current[metric]:.1f} > {value:.1f} (+{tolerance:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='End-to-end failover latency benchmark')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--pub-port-base', type=int, default=15550)
+    parser.add_argument('--transfer-port-base', type=int, default=16660)
+    parser.add_argument('--manager', choices=('recovery.py', 'async_recovery.py'), default='recovery.py')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for each stage')
+    parser.add_argument('--output', type=str, help='Write the report as JSON')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed MTTR regression')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    cluster = LocalCluster(args.nodes, args.host, args.pub_port_base, args.transfer_port_base,
+                           manager=args.manager)
+    # The harness joins the cluster as an observer with the same addressing
+    os.environ.update({key: cluster.env[key] for key in
+                       ('NODE_HOST_TEMPLATE', 'PUB_PORT_BASE', 'TRANSFER_PORT_BASE', 'EVENT_SINK')})
+    cluster.start()
+    recorder = StageRecorder(cluster.node_ids)
+    report = {'nodes': args.nodes, 'manager': args.manager}
+    try:
+        if not cluster.wait_ready():
+            raise SystemExit(f"Cluster did not start, logs in {cluster.workdir}")
+        # Give the PUB/SUB connections time to join before the first fault
+        time.sleep(1.0)
+        for scenario in args.scenarios:
+            results, failures = run_scenario(cluster, recorder, scenario, args.trials, args.timeout)
+            report[scenario] = summarize(results, failures, scenario)
+    finally:
+        recorder.close()
+        cluster.stop()
+
+    for scenario in args.scenarios:
+        summary = report[scenario]
+        print(f"\n{scenario}: {summary['trials']} trials, {summary['failures']} failed")
+        for stage in STAGES[scenario] + ('mttr',):
+            if f"{stage}_p50_ms" in summary:
+                print(f"  {stage:<24}" + "  ".join(f"p{p} {summary[f'{stage}_p{p}_ms']:8.1f}ms" for p in PERCENTILES))
+        if summary.get('bytes_total'):
+            print(f"  bytes transferred        mean {summary['bytes_mean']}  total {summary['bytes_total']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({scenario: report[scenario] for scenario in args.scenarios}, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            regressions = check_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
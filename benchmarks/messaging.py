@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import tempfile
+import multiprocessing
+import numpy as np
+import zmq
+
+# NodeCommunicator microbenchmarks.
+#
+# One publisher (this process) broadcasts FAULT messages to N subscribing
+# NodeCommunicators, each in its own process so its CPU time is its own.
+# Every combination of payload size, peer count and callback count runs two
+# phases:
+#
+#   throughput  send `count` messages as fast as possible; delivered rate per
+#               peer and messages lost at the high-water mark
+#   latency     send `count` messages at a fixed rate; one-way latency from
+#               broadcast to the first callback
+#
+# Subscriber CPU per message covers the listener, decoding and dispatch.
+# Results are written as JSON so runs can be compared over time.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shared'))
+
+from comm import NodeCommunicator, node_name, DEFAULT_HWM  # noqa: E402
+from broker import Broker  # noqa: E402
+
+MESSAGE_TYPE = 'FAULT'
+PUBLISHER_ID = '1'
+WARMUP_INTERVAL = 0.01
+# A phase is over once no subscriber has received anything for this long
+DRAIN_IDLE = 1.0
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Subscriber:
+    """Counts and timestamps benchmark messages inside a peer process"""
+
+    def __init__(self, count):
+        self.phase = None
+        self.received = 0
+        self.first = None
+        self.last = None
+        self.latencies = np.zeros(count, dtype=np.float64)
+        self.warm = False
+
+    def begin(self, phase):
+        self.phase = phase
+        self.received = 0
+        self.first = self.last = None
+
+    def on_message(self, message):
+        now = time.time()
+        data = message['data']
+        if data['phase'] != self.phase:
+            self.warm = True
+            return
+        if self.first is None:
+            self.first = now
+        self.last = now
+        if self.received < len(self.latencies):
+            self.latencies[self.received] = now - message['timestamp']
+        self.received += 1
+
+
+def _ignore(message):
+    pass
+
+
+def run_subscriber(node_id, count, callbacks, hwm, connection):
+    """Peer process: serve begin/progress/end requests from the harness over a pipe"""
+    # The communicator logs every message it handles; the cost stays, the output goes
+    sys.stdout = open(os.devnull, 'w')
+    communicator = NodeCommunicator(node_id, peers=[node_name(PUBLISHER_ID)], hwm=hwm)
+    subscriber = Subscriber(count)
+    communicator.register_callback(MESSAGE_TYPE, subscriber.on_message)
+    for _ in range(callbacks - 1):
+        communicator.register_callback(MESSAGE_TYPE, _ignore)
+    connection.send('ready')
+
+    cpu_started = 0.0
+    while True:
+        command, argument = connection.recv()
+        if command == 'warm':
+            connection.send(subscriber.warm)
+        elif command == 'begin':
+            subscriber.begin(argument)
+            cpu_started = time.process_time()
+            connection.send('ok')
+        elif command == 'progress':
+            connection.send(subscriber.received)
+        elif command == 'end':
+            cpu = time.process_time() - cpu_started
+            received = subscriber.received
+            latencies = subscriber.latencies[:min(received, len(subscriber.latencies))] * 1000
+            result = {
+                'received': received,
+                'cpu_seconds': cpu,
+                'first': subscriber.first,
+                'last': subscriber.last
+            }
+            if received:
+                result['latency_ms'] = {f"p{p:g}": float(np.percentile(latencies, p)) for p in PERCENTILES}
+                result['latency_ms']['max'] = float(latencies.max())
+            connection.send(result)
+        elif command == 'stop':
+            communicator.close()
+            connection.send('stopped')
+            return
+
+
+class Benchmark:
+    """A publisher and `peers` subscriber processes for one configuration"""
+
+    def __init__(self, peers, callbacks, count, hwm, context):
+        self.peer_ids = [str(int(PUBLISHER_ID) + i) for i in range(1, peers + 1)]
+        self.publisher = NodeCommunicator(PUBLISHER_ID, peers=[node_name(i) for i in self.peer_ids], hwm=hwm)
+        self.connections = []
+        self.processes = []
+        for node_id in self.peer_ids:
+            parent, child = context.Pipe()
+            process = context.Process(target=run_subscriber, args=(node_id, count, callbacks, hwm, child),
+                                      daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self._request_all(None)
+
+    def _request_all(self, command, argument=None):
+        if command is not None:
+            for connection in self.connections:
+                connection.send((command, argument))
+        return [connection.recv() for connection in self.connections]
+
+    def warm_up(self, payload, timeout=10.0):
+        """Broadcast until every subscriber has joined; PUB drops messages sent before that"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.publisher.broadcast_message(MESSAGE_TYPE, {'phase': 'warmup', 'blob': payload})
+            time.sleep(WARMUP_INTERVAL)
+            if all(self._request_all('warm')):
+                # Let the warm-up messages still in flight drain
+                time.sleep(DRAIN_IDLE)
+                return
+        raise RuntimeError("Subscribers did not join in time")
+
+    def run_phase(self, phase, payload, count, rate=None):
+        self._request_all('begin', phase)
+        interval = 1.0 / rate if rate else 0.0
+        started = time.time()
+        cpu_started = time.process_time()
+        next_send = time.perf_counter()
+        for seq in range(count):
+            self.publisher.broadcast_message(MESSAGE_TYPE, {'phase': phase, 'seq': seq, 'blob': payload})
+            if interval:
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        self.publisher.flush()
+        sent_elapsed = time.time() - started
+        publisher_cpu = time.process_time() - cpu_started
+
+        # Wait until every message arrived or deliveries stop
+        received = self._request_all('progress')
+        idle_since = time.monotonic()
+        while min(received) < count and time.monotonic() - idle_since < DRAIN_IDLE:
+            time.sleep(0.05)
+            current = self._request_all('progress')
+            if current != received:
+                received = current
+                idle_since = time.monotonic()
+
+        peers = self._request_all('end')
+        return self._summarize(peers, count, started, sent_elapsed, publisher_cpu)
+
+    @staticmethod
+    def _summarize(peers, count, started, sent_elapsed, publisher_cpu):
+        delivered = [peer['received'] for peer in peers]
+        rates = [peer['received'] / (peer['last'] - started) for peer in peers if peer['received'] > 1]
+        result = {
+            'sent': count,
+            'send_rate': count / sent_elapsed,
+            'publisher_cpu_us_per_message': publisher_cpu / count * 1e6,
+            'delivered_min': min(delivered),
+            'dropped_total': sum(count - received for received in delivered),
+            'drop_rate': sum(count - received for received in delivered) / (count * len(peers)),
+            'delivery_rate_min': min(rates) if rates else 0.0,
+            'subscriber_cpu_us_per_message': max(peer['cpu_seconds'] / peer['received'] * 1e6
+                                                 for peer in peers if peer['received']) if any(delivered) else None
+        }
+        # Latency is reported for the slowest peer at each percentile
+        latencies = [peer['latency_ms'] for peer in peers if 'latency_ms' in peer]
+        if latencies:
+            result['latency_ms'] = {key: max(latency[key] for latency in latencies) for key in latencies[0]}
+        return result
+
+    def close(self):
+        self._request_all('stop')
+        for process in self.processes:
+            process.join(timeout=5)
+        self.publisher.close()
+
+
+def _broker_endpoints(index, port_base, ipc_dir):
+    if ipc_dir:
+        return f"ipc://{ipc_dir}/{index}/broker-in", f"ipc://{ipc_dir}/{index}/broker-out"
+    return f"tcp://127.0.0.1:{port_base - 2 * index - 2}", f"tcp://127.0.0.1:{port_base - 2 * index - 1}"
+
+
+def run(payload_sizes, peer_counts, callback_counts, count, rate, hwm, port_base, ipc_dir=None, use_broker=False):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    configurations = list(itertools.product(payload_sizes, peer_counts, callback_counts))
+    for index, (size, peers, callbacks) in enumerate(configurations):
+        # Fresh ports (or socket files) per configuration so lingering connections never cross over
+        os.environ['PUB_PORT_BASE'] = str(port_base + index * (max(peer_counts) + 2))
+        if ipc_dir:
+            os.environ['IPC_DIR'] = os.path.join(ipc_dir, str(index))
+        broker = None
+        if use_broker:
+            frontend, backend = _broker_endpoints(index, port_base, ipc_dir)
+            broker = Broker(frontend, backend)
+            os.environ.update({'BROKER_FRONTEND': frontend, 'BROKER_BACKEND': backend})
+        payload = 'x' * size
+        benchmark = Benchmark(peers, callbacks, count, hwm, context)
+        try:
+            benchmark.warm_up(payload)
+            result = {
+                'payload_bytes': size,
+                'peers': peers,
+                'callbacks': callbacks,
+                'throughput': benchmark.run_phase('throughput', payload, count),
+                'latency': benchmark.run_phase('latency', payload, count, rate)
+            }
+        finally:
+            benchmark.close()
+            if broker is not None:
+                broker.close()
+        results.append(result)
+        _print_result(result)
+    return results
+
+
+def _print_result(result):
+    throughput, latency = result['throughput'], result['latency']
+    percentiles = latency.get('latency_ms', {})
+    print(f"{result['payload_bytes']:>7}B  peers {result['peers']}  callbacks {result['callbacks']}  "
+          f"send {throughput['send_rate']:>8.0f}/s  deliver {throughput['delivery_rate_min']:>8.0f}/s  "
+          f"dropped {throughput['dropped_total']:>6}  "
+          f"p50 {percentiles.get('p50', float('nan')):7.3f}ms  p99 {percentiles.get('p99', float('nan')):7.3f}ms  "
+          f"cpu {throughput['subscriber_cpu_us_per_message'] or 0:6.1f}us/msg", file=sys.stderr)
+
+
+def _sizes(value):
+    return [int(item) for item in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NodeCommunicator throughput and latency microbenchmarks')
+    parser.add_argument('--payload-sizes', type=_sizes, default=[64, 1024, 16384], help='Comma-separated bytes')
+    parser.add_argument('--peers', type=_sizes, default=[1, 2, 4], help='Comma-separated subscriber counts')
+    parser.add_argument('--callbacks', type=_sizes, default=[1, 4], help='Comma-separated callback counts')
+    parser.add_argument('--count', type=int, default=20000, help='Messages per phase')
+    parser.add_argument('--rate', type=float, default=1000.0, help='Messages/s in the latency phase')
+    parser.add_argument('--hwm', type=int, default=DEFAULT_HWM, help='Send/receive high-water mark')
+    parser.add_argument('--codec', choices=('json', 'msgpack'), help='Message codec (default: msgpack if installed)')
+    parser.add_argument('--batching', action='store_true', help='Enable outbound batching')
+    parser.add_argument('--transport', choices=('tcp', 'ipc'), default='tcp', help='Transport between processes')
+    parser.add_argument('--broker', action='store_true', help='Route messages through an XSUB/XPUB broker')
+    parser.add_argument('--port-base', type=int, default=17550)
+    parser.add_argument('--output', type=str, help='Write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    # Subscribers are spawned after this and inherit the settings
+    # Heartbeats would add traffic the benchmark does not count
+    os.environ.update({'NODE_HOST_TEMPLATE': '127.0.0.1', 'EVENT_SINK': '0', 'HEARTBEAT_INTERVAL': '0',
+                       'MESSAGE_BATCHING': '1' if args.batching else '0', 'MESSAGE_TRANSPORT': args.transport})
+    if args.codec:
+        os.environ['MESSAGE_CODEC'] = args.codec
+    ipc_dir = tempfile.mkdtemp(prefix='messaging_bench_') if args.transport == 'ipc' else None
+
+    results = run(args.payload_sizes, args.peers, args.callbacks, args.count, args.rate, args.hwm, args.port_base,
+                  ipc_dir, args.broker)
+    report = {
+        'timestamp': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'pyzmq': zmq.pyzmq_version(),
+            'libzmq': zmq.zmq_version(),
+            'cpus': os.cpu_count(),
+            'codec': os.environ.get('MESSAGE_CODEC', 'default'),
+            'batching': args.batching,
+            'transport': args.transport,
+            'broker': args.broker
+        },
+        'settings': {'count': args.count, 'rate': args.rate, 'hwm': args.hwm},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
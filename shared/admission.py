@@ -0,0 +1,208 @@
+import os
+import time
+import uuid
+import threading
+
+# Migration admission control.
+#
+# A migration is expensive: the service is stopped from its checkpoint until
+# it is restored on the target, and the target takes on its load. Before the
+# recovery manager starts one, the source side checks, in order:
+#
+#   sustained   the service has been over its threshold for at least
+#               `sustain` seconds. Hysteresis: once breached, the breach only
+#               ends when usage falls HYSTERESIS points below the threshold,
+#               so a service hovering at the threshold does not restart the
+#               clock every sample.
+#   cooldown    the service has not arrived on or left this node in the last
+#               `cooldown` seconds, which stops a service bouncing between two
+#               busy nodes
+#   node cap    fewer than MAX_NODE_MIGRATIONS migrations leave this node at once
+#   cluster cap fewer than MAX_CLUSTER_MIGRATIONS are in flight cluster-wide,
+#               counting the 'outbound' migrations peers gossip in their LOAD
+#               summaries (approximate, as gossip lags; the target
+#               reservations below are exact)
+#   worth it    the work the overload is expected to cost exceeds the cost of
+#               migrating. Overload cost is the share of the service's demand
+#               above its threshold times how long the breach has lasted (a
+#               breach that has lasted t seconds is taken to last about t
+#               more). A predicted fault costs its probability times
+#               FAULT_COST seconds. The migration cost is the p90 of the
+#               recent migration times this node has traced, its own and its
+#               peers' (DEFAULT_MIGRATION_COST until there are some).
+#
+# Forced migrations (FAULT force_migration) skip these checks.
+#
+# The target side then has to grant a reservation before the checkpoint is
+# taken: it admits the service only if its own CPU and memory plus everything
+# already reserved plus the service stay under TARGET_LIMIT percent. The
+# reservation is held until the checkpoint arrives, the source releases it
+# because the migration is not going ahead, or RESERVATION_TTL passes.
+
+SUSTAIN_SECONDS = 3.0
+HYSTERESIS = 10.0
+COOLDOWN_SECONDS = 60.0
+MAX_NODE_MIGRATIONS = 1
+MAX_CLUSTER_MIGRATIONS = 2
+TARGET_LIMIT = 80.0
+RESERVATION_TTL = 60.0
+FAULT_COST = 10.0
+DEFAULT_MIGRATION_COST = 1.0
+# Longest breach credited to the overload side of the comparison
+MAX_HORIZON = 60.0
+# The same rejection is logged again only after this long
+LOG_INTERVAL = 30.0
+
+
+class AdmissionController:
+    """Decides whether a migration may start, and which migrations this node will take in"""
+
+    def __init__(self, node_id, sustain=SUSTAIN_SECONDS, hysteresis=HYSTERESIS, cooldown=COOLDOWN_SECONDS,
+                 max_node=MAX_NODE_MIGRATIONS, max_cluster=MAX_CLUSTER_MIGRATIONS, target_limit=TARGET_LIMIT,
+                 reservation_ttl=RESERVATION_TTL, fault_cost=FAULT_COST):
+        self.node_id = str(node_id)
+        self.sustain = sustain
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.max_node = max_node
+        self.max_cluster = max_cluster
+        self.target_limit = target_limit
+        self.reservation_ttl = reservation_ttl
+        self.fault_cost = fault_cost
+        self.breaches = {}
+        self.last_moved = {}
+        self.active = set()
+        self.reservations = {}
+        self.logged = {}
+        self.lock = threading.Lock()
+
+    # Source side
+
+    def observe(self, pid, usage, policy, now=None):
+        """Track a PID's breach; returns how long it has lasted, or None if it is not in breach"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            started = self.breaches.get(pid)
+            if policy.is_overloaded(usage):
+                if started is None:
+                    started = self.breaches[pid] = now
+            elif started is not None and (usage['cpu'] < policy.cpu_threshold - self.hysteresis
+                                          and usage['mem'] < policy.mem_threshold - self.hysteresis):
+                del self.breaches[pid]
+                started = None
+            return now - started if started is not None else None
+
+    def outbound(self):
+        """Migrations admitted here and not yet finished, for the LOAD summary"""
+        with self.lock:
+            return len(self.active)
+
+    def forget(self, pid):
+        with self.lock:
+            self.breaches.pop(pid, None)
+            self.logged.pop(pid, None)
+
+    def admit(self, pid, service, cluster_inflight, migration_cost=None, breach=None, usage=None, policy=None,
+              prediction=None, forced=False):
+        """Reserve a migration slot for `pid`; returns (admitted, reason)"""
+        now = time.monotonic()
+        cost = migration_cost if migration_cost is not None else DEFAULT_MIGRATION_COST
+        with self.lock:
+            if pid in self.active:
+                return False, 'already migrating'
+            if not forced:
+                sustain = policy.sustain_seconds if policy and policy.sustain_seconds is not None else self.sustain
+                cooldown = policy.cooldown_seconds if policy and policy.cooldown_seconds is not None else self.cooldown
+                moved = self.last_moved.get(service)
+                if prediction is None and (breach is None or breach < sustain):
+                    return False, 'not sustained'
+                if moved is not None and now - moved < cooldown:
+                    return False, f"cooling down ({cooldown - (now - moved):.0f}s left)"
+                if len(self.active) >= self.max_node:
+                    return False, f"node limit ({self.max_node} in flight)"
+                if cluster_inflight + len(self.active) >= self.max_cluster:
+                    return False, f"cluster limit ({self.max_cluster} in flight)"
+                benefit = self._benefit(breach, usage, policy, prediction)
+                if benefit < cost:
+                    return False, f"not worth it (overload costs {benefit:.2f}s of work, migrating {cost:.2f}s)"
+            self.active.add(pid)
+            self.breaches.pop(pid, None)
+            self.logged.pop(pid, None)
+            return True, 'forced' if forced else 'admitted'
+
+    def _benefit(self, breach, usage, policy, prediction):
+        if prediction is not None:
+            return prediction * self.fault_cost
+        # Share of the service's demand that the threshold cannot meet
+        excess = max((usage['cpu'] - policy.cpu_threshold) / max(usage['cpu'], 1.0),
+                     (usage['mem'] - policy.mem_threshold) / max(usage['mem'], 1.0))
+        return max(excess, 0.0) * min(breach, MAX_HORIZON)
+
+    def should_log(self, pid, reason):
+        """True the first time a PID is held back for a reason, and every LOG_INTERVAL after"""
+        now = time.monotonic()
+        # Details in parentheses change every check; the reason itself does not
+        reason = reason.split(' (')[0]
+        with self.lock:
+            last = self.logged.get(pid)
+            if last is not None and last[0] == reason and now - last[1] < LOG_INTERVAL:
+                return False
+            self.logged[pid] = (reason, now)
+            return True
+
+    def finish(self, pid, service, moved):
+        """Release a migration slot; a service that moved starts its cooldown"""
+        with self.lock:
+            self.active.discard(pid)
+            if moved:
+                self.last_moved[service] = time.monotonic()
+
+    # Target side
+
+    def note_arrival(self, reservation_id):
+        """The checkpoint a reservation was made for arrived: release it and start the service's cooldown"""
+        with self.lock:
+            reservation = self.reservations.pop(reservation_id, None)
+            if reservation is not None:
+                self.last_moved[reservation[0]['service']] = time.monotonic()
+
+    def release(self, reservation_id):
+        """The source will not send the checkpoint a reservation was made for"""
+        with self.lock:
+            self.reservations.pop(reservation_id, None)
+
+    def reserve(self, request, load, cpu_count, total_mb):
+        """Grant or deny a reservation request against this node's latest load summary"""
+        now = time.monotonic()
+        with self.lock:
+            for reservation_id in [key for key, (_, expires) in self.reservations.items() if expires < now]:
+                del self.reservations[reservation_id]
+            reserved_cpu = sum(entry['cpu'] for entry, _ in self.reservations.values())
+            reserved_mb = sum(entry['mem_mb'] for entry, _ in self.reservations.values())
+            # A process's CPU is in percent of one core; the node's in percent of all of them
+            cpu = load.get('cpu', 0.0) + (reserved_cpu + request.get('cpu', 0.0)) / cpu_count
+            mem = load.get('mem', 0.0) + (reserved_mb + request.get('mem_mb', 0.0)) / total_mb * 100
+            if cpu > self.target_limit or mem > self.target_limit:
+                return {'granted': False,
+                        'reason': f"would reach CPU {cpu:.0f}% / MEM {mem:.0f}% (limit {self.target_limit:.0f}%)"}
+            self.reservations[request['reservation_id']] = (
+                {'service': request.get('service'), 'cpu': request.get('cpu', 0.0), 'mem_mb': request.get('mem_mb', 0.0)},
+                now + self.reservation_ttl)
+            return {'granted': True, 'cpu': round(cpu, 1), 'mem': round(mem, 1)}
+
+
+def new_reservation_id():
+    return uuid.uuid4().hex[:16]
+
+
+def create_admission_controller(node_id):
+    """AdmissionController tuned by the ADMISSION_* and *_MIGRATIONS variables"""
+    return AdmissionController(
+        node_id,
+        sustain=float(os.environ.get('ADMISSION_SUSTAIN', SUSTAIN_SECONDS)),
+        hysteresis=float(os.environ.get('ADMISSION_HYSTERESIS', HYSTERESIS)),
+        cooldown=float(os.environ.get('ADMISSION_COOLDOWN', COOLDOWN_SECONDS)),
+        max_node=int(os.environ.get('MAX_NODE_MIGRATIONS', MAX_NODE_MIGRATIONS)),
+        max_cluster=int(os.environ.get('MAX_CLUSTER_MIGRATIONS', MAX_CLUSTER_MIGRATIONS)),
+        target_limit=float(os.environ.get('ADMISSION_TARGET_LIMIT', TARGET_LIMIT)),
+        fault_cost=float(os.environ.get('ADMISSION_FAULT_COST', FAULT_COST)))
@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import zmq.asyncio
+from recovery import RecoveryManager, MIN_SAMPLES
+from transfer import AsyncCheckpointSender, TransferCancelled
+from tracing import span, record
+
+# Migrations (checkpoint + transfer + restore) allowed to run at the same time
+MAX_CONCURRENT_MIGRATIONS = int(os.environ.get('MAX_CONCURRENT_MIGRATIONS', '4'))
+
+
+class AsyncRecoveryManager(RecoveryManager):
+    """RecoveryManager that supervises every declared service concurrently on asyncio.
+
+    Each service gets its own supervisor task driven by its ServicePolicy.
+    Checkpoints and restores run in worker threads and transfers on zmq.asyncio
+    sockets, each bounded by the policy's timeouts, so a slow migration of one
+    service never delays monitoring or migrating the others.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.async_context = zmq.asyncio.Context.shadow(self.context.underlying)
+        self.async_sender = AsyncCheckpointSender(self.async_context)
+        self.loop = None
+        self.migration_slots = None
+        self.migrations = {}
+        self.restarts = set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.migration_slots = asyncio.Semaphore(MAX_CONCURRENT_MIGRATIONS)
+
+        self._adopt_running_services()
+        for policy in self.services.values():
+            self.replace_instances(policy.name)
+
+        await asyncio.gather(*(self.supervise(policy) for policy in self.services.values()))
+
+    async def supervise(self, policy):
+        """Watch the instances of one service and start a migration for each overloaded one"""
+        while True:
+            try:
+                for pid in self.registry.pids(policy.name):
+                    usage = self.sampler.get(pid)
+                    if usage is None or usage['samples'] < MIN_SAMPLES or pid in self.migrations:
+                        continue
+                    breach = self.admission.observe(pid, usage, policy)
+                    if breach is not None and self._admit(pid, policy.name, breach=breach, usage=usage, policy=policy):
+                        print(f"High resource usage detected for {policy.name} PID {pid} for {breach:.1f}s: "
+                              f"CPU={usage['cpu']:.1f}%, MEM={usage['mem']:.1f}%")
+                        self.migrations[pid] = asyncio.create_task(self.migrate(pid, policy))
+            except Exception as e:
+                print(f"Error supervising {policy.name}: {e}")
+
+            await asyncio.sleep(policy.check_interval)
+
+    async def migrate(self, pid, policy):
+        """Checkpoint, transfer and (on failure) locally restore one service instance"""
+        trace = self.tracer.start('migration')
+        started = time.monotonic()
+        moved = False
+        try:
+            moved = await self._migrate(pid, policy, trace)
+            return moved
+        finally:
+            self.admission.finish(pid, policy.name, moved)
+            record(trace, 'migration', started)
+            self.tracer.finish(trace)
+
+    async def _migrate(self, pid, policy, trace):
+        checkpoint_dir = None
+        killed = False
+        moved = False
+        target_node = reservation_id = None
+        self._track_migration(1)
+        try:
+            async with self.migration_slots:
+                # Reserve room on a target first, so a busy cluster leaves the service running
+                with span(trace, 'placement'):
+                    target_node, reservation_id = await asyncio.to_thread(self._reserve_target, pid, policy.name)
+                if not target_node:
+                    print(f"No node can take {policy.name} PID {pid} without overloading, leaving it in place")
+                    return False
+
+                checkpoint = asyncio.ensure_future(asyncio.to_thread(self.simulate_checkpoint, pid, trace))
+                try:
+                    checkpoint_dir = await asyncio.wait_for(asyncio.shield(checkpoint), policy.checkpoint_timeout)
+                except asyncio.TimeoutError:
+                    # The checkpoint thread cannot be cancelled; the service it paused goes on once it is done
+                    checkpoint.add_done_callback(lambda _: self.resume_service(pid))
+                    raise
+                if not checkpoint_dir:
+                    return False
+
+                print(f"Transferring {policy.name} PID {pid} to {target_node}...")
+                with span(trace, 'stop'):
+                    self.registry.kill(pid)
+                killed = True
+
+                success = await asyncio.wait_for(
+                    self.transfer_checkpoint_async(checkpoint_dir, target_node, trace, reservation_id),
+                    policy.transfer_timeout)
+                if success:
+                    print(f"Successfully transferred {policy.name} PID {pid} to {target_node}")
+                    moved = True
+                    return True
+                print(f"Failed to transfer {policy.name} PID {pid}, restoring locally")
+        except TransferCancelled as e:
+            # The transfer timed out and was aborted; restoring here too would run the service twice
+            if e.committed:
+                print(f"Transfer of {policy.name} PID {pid} timed out after {target_node} completed it")
+                moved = True
+                return True
+            if e.committed is None:
+                print(f"Transfer of {policy.name} PID {pid} timed out and {target_node} did not answer the abort, "
+                      f"taking it to be down")
+            else:
+                print(f"Transfer of {policy.name} PID {pid} timed out, {target_node} dropped it")
+        except asyncio.TimeoutError:
+            print(f"Migration of {policy.name} PID {pid} timed out")
+        except Exception as e:
+            print(f"Error migrating {policy.name} PID {pid}: {e}")
+        finally:
+            self.migrations.pop(pid, None)
+            self._track_migration(-1)
+            if reservation_id and not moved:
+                self._release_target(target_node, reservation_id)
+
+        if killed and checkpoint_dir:
+            await self._restore_locally(checkpoint_dir, policy, trace)
+        return False
+
+    async def _restore_locally(self, checkpoint_dir, policy, trace=None):
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.simulate_restore, checkpoint_dir, trace),
+                                   policy.restore_timeout)
+        except asyncio.TimeoutError:
+            print(f"Restore of {policy.name} from {checkpoint_dir} timed out")
+
+    async def transfer_checkpoint_async(self, checkpoint_dir, target_node, trace=None, reservation_id=None):
+        """Transfer a checkpoint to another node without blocking the event loop"""
+        archive_path = None
+        try:
+            endpoint, meta, manifest = await asyncio.to_thread(
+                self._prepare_transfer, checkpoint_dir, target_node, trace, reservation_id)
+            if manifest:
+                with span(trace, 'transfer'):
+                    response = await self.async_sender.send_manifest(endpoint, self.store, manifest, meta)
+            else:
+                # The manifest was garbage collected; see transfer_checkpoint_to_node
+                with span(trace, 'archive'):
+                    archive_path = await asyncio.to_thread(self._spool_archive, checkpoint_dir)
+                with span(trace, 'transfer'):
+                    response = await self.async_sender.send_file(endpoint, archive_path, meta)
+            return self._report_transfer(checkpoint_dir, target_node, response, trace)
+        finally:
+            if archive_path and os.path.exists(archive_path):
+                os.remove(archive_path)
+
+    def _on_service_exit(self, handle, returncode):
+        """Called on the registry watcher thread; restarts are scheduled on the event loop"""
+        if self.loop is None or self.standby.owns(handle):
+            return super()._on_service_exit(handle, returncode)
+        self.admission.forget(handle.pid)
+        if handle.expected_exit or not self.registry.running:
+            return
+        self._report_exit(handle, returncode)
+        self.loop.call_soon_threadsafe(self._schedule_restart, handle, returncode)
+
+    def _schedule_restart(self, handle, returncode):
+        policy = self.services.get(handle.name)
+        if policy is None or not policy.restart_on_exit:
+            return
+        print(f"Service {handle.name} (PID {handle.pid}) exited with code {returncode}, restarting...")
+        task = asyncio.create_task(self._restart(policy, handle.pid))
+        self.restarts.add(task)
+        task.add_done_callback(self.restarts.discard)
+
+    async def _restart(self, policy, replaces=None):
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.replace_instances, policy.name, replaces),
+                                   policy.restore_timeout)
+        except asyncio.TimeoutError:
+            print(f"Restart of {policy.name} timed out")
+
+
+if __name__ == "__main__":
+    recovery_manager = AsyncRecoveryManager()
+    try:
+        asyncio.run(recovery_manager.run())
+    except KeyboardInterrupt:
+        print("Shutting down Recovery Manager...")
+    finally:
+        recovery_manager.cleanup()
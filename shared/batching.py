@@ -0,0 +1,103 @@
+import time
+import itertools
+import threading
+from collections import OrderedDict
+
+# Outbound batching for NodeCommunicator.
+#
+# Messages are buffered per message type (so topic filtering still works on
+# the receiving side) and flushed as one frame when a type's buffer reaches
+# max_batch messages or when its oldest message has waited max_delay seconds.
+# Messages given a coalesce key replace a buffered message with the same key,
+# so only the latest of a run of superseded state updates is sent.
+
+MAX_BATCH = 64
+MAX_DELAY = 0.005
+
+
+class OutboundBatcher:
+    """Buffers messages and hands them to send_batch(message_type, messages)"""
+
+    def __init__(self, send_batch, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.send_batch = send_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.buffers = {}
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.batches_sent = 0
+        self.messages_sent = 0
+        self.coalesced = 0
+        self.running = True
+        self.flush_thread = threading.Thread(target=self._run)
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def add(self, message, coalesce_key=None):
+        message_type = message['type']
+        with self.lock:
+            buffer = self.buffers.get(message_type)
+            if buffer is None:
+                buffer = self.buffers[message_type] = OrderedDict()
+                self.deadlines[message_type] = time.monotonic() + self.max_delay
+                self.wakeup.notify()
+
+            if coalesce_key is not None and ('key', coalesce_key) in buffer:
+                buffer[('key', coalesce_key)] = message
+                self.coalesced += 1
+                return
+            key = ('key', coalesce_key) if coalesce_key is not None else ('seq', next(self.counter))
+            buffer[key] = message
+
+            if len(buffer) >= self.max_batch:
+                self._flush_type(message_type)
+
+    def _flush_type(self, message_type):
+        # Called with the lock held, which keeps batches of one type in order
+        buffer = self.buffers.pop(message_type, None)
+        self.deadlines.pop(message_type, None)
+        if not buffer:
+            return
+        messages = list(buffer.values())
+        try:
+            self.send_batch(message_type, messages)
+            self.batches_sent += 1
+            self.messages_sent += len(messages)
+        except Exception as e:
+            print(f"Error sending batch of {len(messages)} {message_type} messages: {e}")
+
+    def flush(self):
+        with self.lock:
+            for message_type in list(self.buffers):
+                self._flush_type(message_type)
+
+    def _run(self):
+        with self.lock:
+            while self.running:
+                if not self.deadlines:
+                    self.wakeup.wait()
+                    continue
+                now = time.monotonic()
+                for message_type, deadline in list(self.deadlines.items()):
+                    if deadline <= now:
+                        self._flush_type(message_type)
+                if self.deadlines:
+                    self.wakeup.wait(max(0.0, min(self.deadlines.values()) - time.monotonic()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'batches_sent': self.batches_sent,
+                'messages_sent': self.messages_sent,
+                'coalesced': self.coalesced,
+                'buffered': sum(len(buffer) for buffer in self.buffers.values())
+            }
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify_all()
+        self.flush_thread.join(timeout=1)
+        self.flush()
@@ -0,0 +1,89 @@
+import os
+import argparse
+import threading
+import zmq
+from membership import bind_endpoint
+
+# XSUB/XPUB forwarder for clusters too large for a full mesh.
+#
+# By default every node binds a PUB socket and connects its SUB socket to
+# every other node, so a cluster of N nodes holds N*(N-1) connections and a
+# node joining means every other node connecting to it. With BROKER_FRONTEND
+# and BROKER_BACKEND set, each node instead connects its PUB to the broker's
+# XSUB frontend and its SUB to the broker's XPUB backend: two connections per
+# node whatever the cluster size, and a node that joins is heard by everyone
+# at once. Subscriptions travel upstream through the broker, so each
+# publisher still only sends the message types someone subscribes to.
+#
+# The broker is a single hop and a single point of failure: every message
+# crosses it, and while it is down no node hears any other (and the failure
+# detector suspects them all). Run it next to the nodes, e.g.
+#
+#   python3 broker.py --frontend tcp://*:5540 --backend tcp://*:5541
+#
+# with BROKER_FRONTEND=tcp://broker:5540 and BROKER_BACKEND=tcp://broker:5541
+# on every node.
+
+FRONTEND = 'tcp://*:5540'
+BACKEND = 'tcp://*:5541'
+
+
+def broker_endpoints():
+    """(frontend, backend) the nodes connect to, or None for the full mesh"""
+    frontend, backend = os.environ.get('BROKER_FRONTEND'), os.environ.get('BROKER_BACKEND')
+    if not frontend and not backend:
+        return None
+    if not (frontend and backend):
+        raise ValueError("BROKER_FRONTEND and BROKER_BACKEND must be set together")
+    return frontend, backend
+
+
+class Broker:
+    """Forwards every node's messages to every subscriber, on a background thread"""
+
+    def __init__(self, frontend=FRONTEND, backend=BACKEND, context=None):
+        self.context = context or zmq.Context.instance()
+        self.frontend = self.context.socket(zmq.XSUB)
+        self.frontend.bind(bind_endpoint(frontend))
+        self.backend = self.context.socket(zmq.XPUB)
+        self.backend.bind(bind_endpoint(backend))
+        # Lets close() stop the proxy from another thread
+        self.control_endpoint = f"inproc://broker-control-{id(self)}"
+        self.control = self.context.socket(zmq.PAIR)
+        self.control.bind(self.control_endpoint)
+        self.thread = threading.Thread(target=self._run, name='broker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        control = self.context.socket(zmq.PAIR)
+        control.connect(self.control_endpoint)
+        try:
+            zmq.proxy_steerable(self.frontend, self.backend, None, control)
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            control.close(linger=0)
+
+    def close(self):
+        self.control.send(b'TERMINATE')
+        self.thread.join(timeout=1)
+        self.control.close(linger=0)
+        self.frontend.close(linger=0)
+        self.backend.close(linger=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Message broker for the broker topology')
+    parser.add_argument('--frontend', default=os.environ.get('BROKER_BIND_FRONTEND', FRONTEND),
+                        help='XSUB endpoint the nodes publish to')
+    parser.add_argument('--backend', default=os.environ.get('BROKER_BIND_BACKEND', BACKEND),
+                        help='XPUB endpoint the nodes subscribe to')
+    args = parser.parse_args()
+
+    broker = Broker(args.frontend, args.backend)
+    print(f"Forwarding {args.frontend} -> {args.backend}")
+    try:
+        broker.thread.join()
+    except KeyboardInterrupt:
+        broker.close()
@@ -0,0 +1,312 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from comm import NodeCommunicator, node_name, cluster_node_ids
+from simulate_faults import INJECTABLE_FAULTS
+
+# Fault-injection campaigns.
+#
+# A scenario is a JSON file describing a timeline of faults:
+#
+#   {
+#     "name": "soak",
+#     "seed": 42,
+#     "nodes": ["1", "2", "3"],
+#     "recovery_timeout": 30,
+#     "faults": [
+#       {"at": 5, "node": "1", "kind": "kill"},
+#       {"at": 10, "node": "all", "kind": "cpu", "params": {"duration": 20}}
+#     ],
+#     "random": {
+#       "count": 10, "start": 0, "end": 120,
+#       "mix": {"kill": 3, "migration": 1, "cpu": 1, "memory": 1},
+#       "params": {"memory": {"size_mb": [100, 400], "duration": [10, 30]}}
+#     }
+#   }
+#
+# "faults" are placed explicitly ("node": "all" means one fault per node);
+# "random" adds `count` faults at uniformly drawn times, on drawn nodes, with
+# kinds drawn by weight from "mix" and each [low, high] parameter drawn from
+# its range. The seed makes the expanded timeline identical on every run.
+#
+# The campaign joins the cluster as node 0 (nodes list it in OBSERVER_NODES
+# and run with FAULT_INJECTION=1, as docker-compose.campaign.yml sets up) and
+# sends each fault to its node's FaultAgent as an INJECT_FAULT message when it
+# falls due, so faults on different nodes, and slow ones like CPU stress and
+# memory leaks, overlap.
+# Every FAULT and RECOVERY message is recorded, and each fault's time to
+# recover is measured from injection to:
+#
+#   kill        the service_restarted replacing the killed PID
+#   migration   the service_restored that ends the migration's trace
+#   cpu/memory  the service_restored of the first migration the node starts
+#               while stressed; none within the window counts as tolerated
+
+CAMPAIGN_ID = '0'
+RECOVERY_TIMEOUT = 30.0
+READY_TIMEOUT = 30.0
+PING_INTERVAL = 0.5
+POLL_INTERVAL = 0.5
+MIGRATION_ACTIONS = ('migration_started', 'preventive_migration')
+
+
+def _draw(rng, value):
+    """A [low, high] range drawn uniformly (integers stay integers), anything else as is"""
+    if isinstance(value, list) and len(value) == 2:
+        low, high = value
+        if isinstance(low, int) and isinstance(high, int):
+            return rng.randint(low, high)
+        return round(rng.uniform(low, high), 3)
+    return value
+
+
+def expand_timeline(scenario):
+    """The scenario's faults in injection order, each with a fault ID"""
+    rng = random.Random(scenario.get('seed', 0))
+    nodes = [str(node) for node in scenario.get('nodes') or cluster_node_ids()]
+    faults = []
+
+    for fault in scenario.get('faults', []):
+        targets = nodes if fault.get('node', 'all') == 'all' else [str(fault['node'])]
+        for node in targets:
+            faults.append({'at': float(fault['at']), 'node': node, 'kind': fault['kind'],
+                           'params': {key: _draw(rng, value) for key, value in fault.get('params', {}).items()}})
+
+    generated = scenario.get('random')
+    if generated:
+        mix = generated.get('mix') or {kind: 1 for kind in INJECTABLE_FAULTS}
+        kinds = sorted(mix)
+        ranges = generated.get('params', {})
+        for _ in range(generated.get('count', 0)):
+            kind = rng.choices(kinds, weights=[mix[kind] for kind in kinds])[0]
+            faults.append({'at': round(rng.uniform(generated.get('start', 0), generated['end']), 3),
+                           'node': rng.choice(nodes), 'kind': kind,
+                           'params': {key: _draw(rng, value) for key, value in sorted(ranges.get(kind, {}).items())}})
+
+    for fault in faults:
+        if fault['kind'] not in INJECTABLE_FAULTS:
+            raise ValueError(f"Unknown fault {fault['kind']!r}, expected one of {INJECTABLE_FAULTS}")
+        if fault['node'] not in nodes:
+            raise ValueError(f"Fault targets node {fault['node']}, which is not in {nodes}")
+
+    faults.sort(key=lambda fault: (fault['at'], fault['node'], fault['kind']))
+    for index, fault in enumerate(faults, 1):
+        fault['id'] = f"f{index:03d}"
+    return faults
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+class Campaign:
+    """Injects a scenario's faults across the cluster and measures recovery"""
+
+    def __init__(self, scenario, communicator=None):
+        self.scenario = scenario
+        self.name = scenario.get('name', 'campaign')
+        self.nodes = [str(node) for node in scenario.get('nodes') or cluster_node_ids()]
+        self.recovery_timeout = float(scenario.get('recovery_timeout', RECOVERY_TIMEOUT))
+        self.timeline = expand_timeline(scenario)
+        self.injected = {}
+        # (monotonic receive time, message) for every FAULT, RECOVERY and INJECT_FAULT reply
+        self.messages = []
+        self.lock = threading.Lock()
+        self.communicator = communicator or NodeCommunicator(CAMPAIGN_ID, peers=[node_name(i) for i in self.nodes])
+        for message_type in ('FAULT', 'RECOVERY', 'INJECT_FAULT'):
+            self.communicator.register_callback(message_type, self._on_message)
+
+    def _on_message(self, message):
+        with self.lock:
+            self.messages.append((time.monotonic(), message))
+
+    def _recorded(self):
+        with self.lock:
+            return list(self.messages)
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        """Ping every node's FaultAgent until all have answered; PUB drops messages sent before a peer joins"""
+        deadline = time.monotonic() + timeout
+        waiting = set(self.nodes)
+        while waiting and time.monotonic() < deadline:
+            for node in sorted(waiting):
+                self.communicator.broadcast_message('INJECT_FAULT', {'node_id': node, 'kind': 'ping'})
+            time.sleep(PING_INTERVAL)
+            waiting -= {message['source'] for _, message in self._recorded()
+                        if message['type'] == 'INJECT_FAULT' and message['data'].get('reply') == 'pong'}
+        if waiting:
+            raise RuntimeError(f"No fault agent answered on node(s) {', '.join(sorted(waiting))}; "
+                               f"are they running with FAULT_INJECTION=1 and OBSERVER_NODES={CAMPAIGN_ID} "
+                               f"(docker compose -f docker-compose.yml -f docker-compose.campaign.yml up)?")
+
+    def run(self):
+        """Inject the timeline, then wait for every fault to resolve or time out"""
+        started = time.monotonic()
+        for fault in self.timeline:
+            delay = started + fault['at'] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.injected[fault['id']] = time.monotonic()
+            self.communicator.broadcast_message('INJECT_FAULT', {
+                'node_id': fault['node'],
+                'kind': fault['kind'],
+                'params': fault['params'],
+                'fault_id': fault['id']
+            })
+            print(f"[{time.monotonic() - started:8.2f}s] {fault['id']} {fault['kind']} on node {fault['node']} "
+                  f"{fault['params'] or ''}", file=sys.stderr)
+
+        deadline = max([self._window_end(fault) for fault in self.timeline] or [time.monotonic()])
+        while time.monotonic() < deadline:
+            if all(outcome['outcome'] != 'pending' for outcome in self.analyze()):
+                break
+            time.sleep(POLL_INTERVAL)
+        return self.report(time.monotonic() - started)
+
+    def _window_end(self, fault):
+        # Stress faults can trigger a migration at any point while they last
+        return self.injected[fault['id']] + fault['params'].get('duration', 0) + self.recovery_timeout
+
+    def analyze(self):
+        """Each injected fault's outcome and timings from the messages recorded so far"""
+        messages = self._recorded()
+        now = time.monotonic()
+        recovery = [(at, message['source'], message['data']) for at, message in messages
+                    if message['type'] == 'RECOVERY']
+        acks = {message['data']['fault_id']: (at, message['data']) for at, message in messages
+                if message['type'] == 'FAULT' and 'fault_id' in message['data']}
+
+        def first(predicate, since, until):
+            for at, source, data in recovery:
+                if since <= at <= until and predicate(source, data):
+                    return at, data
+            return None
+
+        # Migrations the campaign forced itself are not reactions to stress faults
+        forced = {(fault['node'], acks[fault['id']][1].get('pid')) for fault in self.timeline
+                  if fault['kind'] == 'migration' and fault['id'] in acks}
+
+        outcomes = []
+        for fault in self.timeline:
+            outcome = dict(fault)
+            injected = self.injected.get(fault['id'])
+            if injected is None:
+                continue
+            until = self._window_end(fault)
+            finished = now >= until
+            ack = acks.get(fault['id'])
+            reaction = recovered = None
+
+            if ack is None:
+                outcome['outcome'] = 'not_injected' if finished else 'pending'
+                outcomes.append(outcome)
+                continue
+            outcome['ack_ms'] = round((ack[0] - injected) * 1000, 1)
+
+            if fault['kind'] == 'kill':
+                pid = ack[1].get('pid')
+                recovered = first(lambda source, data: source == fault['node']
+                                  and data.get('action') == 'service_restarted' and data.get('replaces') == pid,
+                                  injected, until)
+            else:
+                if fault['kind'] == 'migration':
+                    pid = ack[1].get('pid')
+                    reaction = first(lambda source, data: source == fault['node']
+                                     and data.get('action') == 'migration_started' and data.get('pid') == pid,
+                                     injected, until)
+                else:
+                    reaction = first(lambda source, data: source == fault['node']
+                                     and data.get('action') in MIGRATION_ACTIONS
+                                     and (source, data.get('pid')) not in forced,
+                                     injected, until)
+                trace_id = reaction and reaction[1].get('trace', {}).get('id')
+                if reaction:
+                    outcome['detect_ms'] = round((reaction[0] - injected) * 1000, 1)
+                if trace_id:
+                    recovered = first(lambda source, data: data.get('action') == 'service_restored'
+                                      and data.get('trace', {}).get('id') == trace_id, reaction[0], until)
+
+            if recovered:
+                outcome['outcome'] = 'recovered'
+                outcome['ttr_ms'] = round((recovered[0] - injected) * 1000, 1)
+            elif not finished:
+                outcome['outcome'] = 'pending'
+            elif fault['kind'] in ('cpu', 'memory') and reaction is None:
+                outcome['outcome'] = 'tolerated'
+            else:
+                outcome['outcome'] = 'unrecovered'
+            outcomes.append(outcome)
+        return outcomes
+
+    def report(self, elapsed):
+        outcomes = self.analyze()
+        summary = {}
+        for kind in sorted({outcome['kind'] for outcome in outcomes}):
+            of_kind = [outcome for outcome in outcomes if outcome['kind'] == kind]
+            entry = {'count': len(of_kind)}
+            for result in ('recovered', 'unrecovered', 'tolerated', 'not_injected', 'pending'):
+                entry[result] = sum(1 for outcome in of_kind if outcome['outcome'] == result)
+            ttrs = [outcome['ttr_ms'] for outcome in of_kind if 'ttr_ms' in outcome]
+            if ttrs:
+                entry['ttr_ms'] = {'p50': _percentile(ttrs, 50), 'p95': _percentile(ttrs, 95), 'max': max(ttrs)}
+            summary[kind] = entry
+        return {
+            'scenario': self.name,
+            'seed': self.scenario.get('seed', 0),
+            'nodes': self.nodes,
+            'timestamp': time.time(),
+            'elapsed_seconds': round(elapsed, 3),
+            'recovery_timeout': self.recovery_timeout,
+            'faults': outcomes,
+            'summary': summary
+        }
+
+    def close(self):
+        self.communicator.close()
+
+
+def format_report(report):
+    lines = [f"Campaign {report['scenario']} (seed {report['seed']}) on nodes {', '.join(report['nodes'])}: "
+             f"{len(report['faults'])} faults in {report['elapsed_seconds']:.1f}s",
+             f"  {'kind':<11}{'count':>6}{'recov':>7}{'unrec':>7}{'toler':>7}{'skip':>6}"
+             f"{'p50':>10}{'p95':>10}{'max':>10}"]
+    for kind, entry in report['summary'].items():
+        ttr = entry.get('ttr_ms', {})
+        lines.append(f"  {kind:<11}{entry['count']:>6}{entry['recovered']:>7}{entry['unrecovered']:>7}"
+                     f"{entry['tolerated']:>7}{entry['not_injected']:>6}"
+                     + ''.join(f"{ttr.get(key, float('nan')):>10.1f}" for key in ('p50', 'p95', 'max')))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a fault-injection campaign and report recovery times')
+    parser.add_argument('scenario', help='Scenario JSON file')
+    parser.add_argument('--output', type=str, help='JSON report path (default /tmp/campaign_<name>.json)')
+    parser.add_argument('--ready-timeout', type=float, default=READY_TIMEOUT,
+                        help='Seconds to wait for every fault agent')
+    parser.add_argument('--dry-run', action='store_true', help='Print the expanded timeline and exit')
+    args = parser.parse_args()
+
+    with open(args.scenario, 'r') as f:
+        scenario = json.load(f)
+    if args.dry_run:
+        json.dump(expand_timeline(scenario), sys.stdout, indent=2)
+        print()
+        sys.exit(0)
+
+    campaign = Campaign(scenario)
+    try:
+        campaign.wait_ready(args.ready_timeout)
+        report = campaign.run()
+    finally:
+        campaign.close()
+    # The communicator logs to stdout, so the report always goes to a file
+    output = args.output or f"/tmp/campaign_{report['scenario']}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(format_report(report))
+    print(f"Report written to {output}")
@@ -0,0 +1,305 @@
+import os
+import time
+import lzma
+import zlib
+import threading
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression of checkpoint chunks on the wire.
+#
+# Every CHUNK frame carries the id of the codec its payload was compressed
+# with, and a receiver lists the codecs it can decode in its ACCEPT/WANT
+# reply, so nodes with different optional codecs installed still understand
+# each other. Each chunk is compressed on its own, which keeps resuming and
+# per-chunk integrity checks as they were. A chunk that does not shrink is
+# sent raw.
+#
+# CHECKPOINT_CODEC names a codec to always use, or is 'auto' (the default).
+# In auto mode the sender chooses once per transfer, after the receiver said
+# which chunks it wants:
+#
+#   - payloads under MIN_COMPRESS_BYTES are sent raw
+#   - the first SAMPLE_BYTES of up to SAMPLE_CHUNKS of the chunks to be sent
+#     are compressed with the codecs both sides have, measuring the ratio and
+#     the compress and decompress throughput on this data
+#   - chunks are compressed, sent and decompressed as a pipeline, so a
+#     transfer of `size` bytes takes about as long as its slowest stage:
+#
+#         max(size / compress_rate, size * ratio / link_rate, size / decompress_rate)
+#
+#     where link_rate is the throughput measured on earlier transfers to the
+#     same peer (an EWMA; LINK_THROUGHPUT_MBPS before the first)
+#   - the codec with the lowest estimate is used
+#
+# Sampling stays cheap: each family (zlib, lzma, ...) is tried from its
+# fastest level up and abandoned once a level's compression alone takes
+# longer than the best estimate so far (stronger levels only compress
+# slower). Data the first codec tried cannot shrink ends sampling
+# altogether, and a codec whose last measured rates already rule it out is
+# not sampled at all.
+#
+# A transfer limited by compression says little about the link, so a sender
+# that starts from a too-low LINK_THROUGHPUT_MBPS would keep compressing on a
+# link that is faster than its codec. Instead, a transfer to a peer whose link
+# was not measured in the last LINK_PROBE_INTERVAL seconds sends its first
+# PROBE_BYTES raw and chooses the codec for the rest once they are
+# acknowledged; the chunk header names each chunk's codec, so switching
+# mid-transfer costs nothing but the wait for that acknowledgement.
+#
+# So a fast LAN gets no or light compression and a slow link gets the
+# strongest codec that keeps up with it. benchmarks/compression.py shows
+# where the crossover points lie for different kinds of payload.
+
+MIN_COMPRESS_BYTES = 64 * 1024
+SAMPLE_CHUNKS = 2
+SAMPLE_BYTES = 32 * 1024
+LINK_THROUGHPUT_MBPS = 100.0
+LINK_EWMA_ALPHA = 0.3
+# Transfers smaller than this are dominated by round trips and say little about the link
+MIN_LINK_SAMPLE_BYTES = 1024 * 1024
+PROBE_BYTES = MIN_LINK_SAMPLE_BYTES
+LINK_PROBE_INTERVAL = 600.0
+# A transfer during which either end was compressing or decompressing for at
+# least this share of the time was not limited by the link
+BOTTLENECK_SHARE = 0.5
+# A compressed chunk at least this large a share of the raw one is sent raw
+RAW_RATIO = 0.95
+
+
+class RawCodec:
+    codec_id = 0
+    name = 'none'
+    family = 'none'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class ZlibCodec:
+    def __init__(self, codec_id, level):
+        self.codec_id = codec_id
+        self.level = level
+        self.name = f"zlib-{level}"
+        self.family = 'zlib'
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LzmaCodec:
+    def __init__(self, codec_id, preset):
+        self.codec_id = codec_id
+        self.preset = preset
+        self.name = f"lzma-{preset}"
+        self.family = 'lzma'
+
+    def compress(self, data):
+        # The chunk already has a crc32 on the wire and a sha256 in the store
+        return lzma.compress(data, check=lzma.CHECK_NONE, preset=self.preset)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+
+class Lz4Codec:
+    codec_id = 6
+    name = 'lz4'
+    family = 'lz4'
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+class ZstdCodec:
+    def __init__(self, codec_id, level):
+        self.codec_id = codec_id
+        self.level = level
+        self.name = f"zstd-{level}"
+        self.family = 'zstd'
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+        # zstandard contexts are not thread-safe; transfers run on several threads
+        self.lock = threading.Lock()
+
+    def compress(self, data):
+        with self.lock:
+            return self.compressor.compress(data)
+
+    def decompress(self, data):
+        with self.lock:
+            return self.decompressor.decompress(data)
+
+
+CODECS = {codec.codec_id: codec for codec in (
+    RawCodec(), ZlibCodec(1, 1), ZlibCodec(2, 6), ZlibCodec(3, 9), LzmaCodec(4, 1), LzmaCodec(5, 6))}
+if lz4_frame is not None:
+    CODECS[Lz4Codec.codec_id] = Lz4Codec()
+if zstandard is not None:
+    for codec in (ZstdCodec(7, 1), ZstdCodec(8, 3)):
+        CODECS[codec.codec_id] = codec
+
+BY_NAME = {codec.name: codec for codec in CODECS.values()}
+
+
+def available_codecs():
+    """Names of the codecs this node can decode, for the ACCEPT/WANT reply"""
+    return sorted(BY_NAME)
+
+
+def compress_chunk(codec, chunk):
+    """(payload, codec id) for one chunk; raw when compressing does not pay off"""
+    if codec.codec_id == RawCodec.codec_id:
+        return chunk, RawCodec.codec_id
+    payload = codec.compress(chunk)
+    if len(payload) >= len(chunk) * RAW_RATIO:
+        return chunk, RawCodec.codec_id
+    return payload, codec.codec_id
+
+
+def decompress_chunk(codec_id, payload):
+    codec = CODECS.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Unknown chunk codec {codec_id}")
+    try:
+        return codec.decompress(payload)
+    except Exception as e:
+        raise ValueError(f"Chunk does not decompress with {codec.name}: {e}")
+
+
+def profile_codec(codec, samples):
+    """Ratio and compress/decompress throughput (bytes/s) of a codec on sample chunks"""
+    raw = sum(len(sample) for sample in samples)
+    started = time.perf_counter()
+    payloads = [compress_chunk(codec, sample) for sample in samples]
+    compress_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for payload, codec_id in payloads:
+        decompress_chunk(codec_id, payload)
+    decompress_seconds = time.perf_counter() - started
+    return {
+        'ratio': sum(len(payload) for payload, _ in payloads) / max(raw, 1),
+        'compress_rate': raw / max(compress_seconds, 1e-9),
+        'decompress_rate': raw / max(decompress_seconds, 1e-9)
+    }
+
+
+def estimate_seconds(profile, size, link_rate):
+    """Time to stream `size` bytes through compression, the link and decompression"""
+    if profile is None:
+        return size / link_rate
+    return max(size / profile['compress_rate'], size * profile['ratio'] / link_rate,
+               size / profile['decompress_rate'])
+
+
+class CodecSelector:
+    """Picks the codec for each transfer and learns the throughput to each peer"""
+
+    def __init__(self, mode=None, link_rate=None, min_bytes=MIN_COMPRESS_BYTES, sample_chunks=SAMPLE_CHUNKS):
+        self.mode = mode or os.environ.get('CHECKPOINT_CODEC', 'auto')
+        if self.mode != 'auto' and self.mode not in BY_NAME:
+            print(f"Checkpoint codec {self.mode!r} unavailable, choosing automatically")
+            self.mode = 'auto'
+        self.default_link_rate = link_rate or float(os.environ.get('LINK_THROUGHPUT_MBPS',
+                                                                   LINK_THROUGHPUT_MBPS)) * 1e6
+        self.min_bytes = min_bytes
+        self.sample_chunks = sample_chunks
+        self.link_rates = {}
+        # When each peer's link was last measured rather than only bounded
+        self.link_measured = {}
+        # Last measured (compress, decompress) rates per codec, to skip hopeless ones
+        self.codec_rates = {}
+        self.lock = threading.Lock()
+
+    def link_rate(self, endpoint):
+        with self.lock:
+            return self.link_rates.get(endpoint, self.default_link_rate)
+
+    def needs_probe(self, endpoint):
+        """Whether a transfer to `endpoint` should measure the link before choosing a codec"""
+        if self.mode != 'auto':
+            return False
+        with self.lock:
+            measured = self.link_measured.get(endpoint)
+        return measured is None or time.monotonic() - measured > LINK_PROBE_INTERVAL
+
+    def record_link(self, endpoint, wire_bytes, seconds, busy_seconds=0.0):
+        """Fold a finished transfer's wire throughput into the estimate for its peer.
+
+        `busy_seconds` is the longer of the time the sender spent compressing
+        and the receiver spent decompressing and writing. When it accounts for
+        most of the transfer, the link was not the bottleneck and the sample
+        only shows the link is at least that fast; counting it as the link
+        rate would make every later transfer compress harder still.
+        """
+        if wire_bytes < MIN_LINK_SAMPLE_BYTES or seconds <= 0:
+            return
+        rate = wire_bytes / seconds
+        with self.lock:
+            previous = self.link_rates.get(endpoint)
+            if busy_seconds >= seconds * BOTTLENECK_SHARE:
+                self.link_rates[endpoint] = max(rate, previous or self.default_link_rate)
+                return
+            if previous is None:
+                self.link_rates[endpoint] = rate
+            else:
+                self.link_rates[endpoint] = LINK_EWMA_ALPHA * rate + (1 - LINK_EWMA_ALPHA) * previous
+            self.link_measured[endpoint] = time.monotonic()
+
+    def choose(self, endpoint, accepted, first, total, read_chunk):
+        """Codec for sending chunks first..total-1 to a receiver that accepts `accepted` codec names"""
+        accepted = set(accepted or ())
+        if self.mode != 'auto':
+            return BY_NAME[self.mode] if self.mode in accepted else CODECS[RawCodec.codec_id]
+        candidates = [codec for codec in CODECS.values() if codec.name in accepted and codec.codec_id]
+        count = total - first
+        if not candidates or count <= 0:
+            return CODECS[RawCodec.codec_id]
+        # Chunks spread over the range, read the same way they will be sent
+        step = max(count // self.sample_chunks, 1)
+        chunks = [read_chunk(seq) for seq in range(first, total, step)][:self.sample_chunks]
+        size = sum(len(chunk) for chunk in chunks) / len(chunks) * count
+        if size < self.min_bytes:
+            return CODECS[RawCodec.codec_id]
+        samples = [chunk[:SAMPLE_BYTES] for chunk in chunks]
+        link_rate = self.link_rate(endpoint)
+        best, best_seconds = CODECS[RawCodec.codec_id], estimate_seconds(None, size, link_rate)
+        abandoned = set()
+        # Within a family, codec ids go from the fastest level to the strongest
+        for codec in sorted(candidates, key=lambda codec: codec.codec_id):
+            if codec.family in abandoned:
+                continue
+            with self.lock:
+                known = self.codec_rates.get(codec.name)
+            if known and size / min(known) >= best_seconds:
+                abandoned.add(codec.family)
+                continue
+            profile = profile_codec(codec, samples)
+            with self.lock:
+                self.codec_rates[codec.name] = (profile['compress_rate'], profile['decompress_rate'])
+            seconds = estimate_seconds(profile, size, link_rate)
+            if profile['ratio'] >= RAW_RATIO:
+                # Already compressed or encrypted; stronger codecs will not find much more either
+                break
+            if seconds < best_seconds:
+                best, best_seconds = codec, seconds
+            elif size / profile['compress_rate'] >= best_seconds:
+                abandoned.add(codec.family)
+        return best
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+
+# Checkpoint payloads are split into fixed-size chunks named by their sha256.
+# A manifest lists, per file, the chunk hashes that rebuild it, so two
+# checkpoints of the same service share every chunk that did not change and
+# a peer only needs the chunks it has never seen.
+#
+# Checkpoint names are unique per process, so retention is kept per service
+# (meta['service']): gc() keeps the newest KEEP_MANIFESTS manifests of every
+# service and then drops chunks nothing references any more.
+
+STORE_CHUNK_SIZE = 64 * 1024
+KEEP_MANIFESTS = 3
+# Unreferenced chunks younger than this may belong to a transfer in progress
+GC_GRACE_SECONDS = 600
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class CheckpointStore:
+    """Content-addressed chunk store with per-checkpoint manifests"""
+
+    def __init__(self, root, chunk_size=STORE_CHUNK_SIZE, keep_manifests=KEEP_MANIFESTS):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.keep_manifests = keep_manifests
+        self.chunk_dir = os.path.join(root, 'chunks')
+        self.manifest_dir = os.path.join(root, 'manifests')
+        self.ref_dir = os.path.join(root, 'refs')
+        for path in (self.chunk_dir, self.manifest_dir, self.ref_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def has_chunk(self, digest):
+        return os.path.exists(self._chunk_path(digest))
+
+    def missing_chunks(self, digests):
+        """Return the digests not present in the store, in first-seen order"""
+        missing = []
+        seen = set()
+        for digest in digests:
+            if digest not in seen and not self.has_chunk(digest):
+                missing.append(digest)
+            seen.add(digest)
+        return missing
+
+    def put_chunk(self, digest, data):
+        """Store a chunk after verifying it matches its content address"""
+        if chunk_hash(data) != digest:
+            raise ValueError(f"Chunk content does not match {digest}")
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+    def read_chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as f:
+            return f.read()
+
+    def put_checkpoint(self, checkpoint_dir, name=None, meta=None):
+        """Chunk every file under checkpoint_dir and record a manifest for it"""
+        name = name or os.path.basename(checkpoint_dir.rstrip('/'))
+        files = []
+        new_bytes = 0
+        for dirpath, _, filenames in os.walk(checkpoint_dir):
+            for filename in sorted(filenames):
+                full_path = os.path.join(dirpath, filename)
+                digests = []
+                size = 0
+                with open(full_path, 'rb') as f:
+                    while True:
+                        data = f.read(self.chunk_size)
+                        if not data:
+                            break
+                        digest = chunk_hash(data)
+                        if self.put_chunk(digest, data):
+                            new_bytes += len(data)
+                        digests.append(digest)
+                        size += len(data)
+                files.append({
+                    'path': os.path.relpath(full_path, checkpoint_dir),
+                    'size': size,
+                    'mode': os.stat(full_path).st_mode & 0o777,
+                    'chunks': digests
+                })
+
+        manifest = {
+            'id': f"{name}_{int(time.time() * 1000)}",
+            'name': name,
+            'created': time.time(),
+            'meta': meta or {},
+            'files': files
+        }
+        self.save_manifest(manifest)
+        self.gc()
+        print(f"Stored checkpoint {manifest['id']}: {len(files)} files, {new_bytes} new bytes")
+        return manifest
+
+    def save_manifest(self, manifest):
+        path = os.path.join(self.manifest_dir, f"{manifest['id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+        ref_path = os.path.join(self.ref_dir, manifest['name'])
+        with open(f"{ref_path}.tmp", 'w') as f:
+            f.write(manifest['id'])
+        os.replace(f"{ref_path}.tmp", ref_path)
+
+    def load_manifest(self, manifest_id):
+        with open(os.path.join(self.manifest_dir, f"{manifest_id}.json"), 'r') as f:
+            return json.load(f)
+
+    def latest_manifest(self, name):
+        """Return the newest manifest recorded for a checkpoint name, or None"""
+        try:
+            with open(os.path.join(self.ref_dir, name), 'r') as f:
+                return self.load_manifest(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def materialize(self, manifest, dest_dir):
+        """Rebuild the checkpoint files described by a manifest under dest_dir"""
+        for entry in manifest['files']:
+            path = os.path.normpath(os.path.join(dest_dir, entry['path']))
+            if not path.startswith(os.path.normpath(dest_dir) + os.sep):
+                raise ValueError(f"Manifest path escapes checkpoint: {entry['path']}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                for digest in entry['chunks']:
+                    f.write(self.read_chunk(digest))
+            os.chmod(path, entry.get('mode', 0o644))
+        return dest_dir
+
+    def gc(self):
+        """Drop all but the newest manifests of every service and any chunks no manifest references"""
+        manifests = []
+        for filename in os.listdir(self.manifest_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                manifests.append(self.load_manifest(filename[:-5]))
+            except (OSError, ValueError):
+                continue
+
+        by_service = {}
+        for manifest in manifests:
+            service = manifest.get('meta', {}).get('service') or manifest['name']
+            by_service.setdefault(service, []).append(manifest)
+        expired = set()
+        for own in by_service.values():
+            own.sort(key=lambda m: m['created'], reverse=True)
+            expired.update(m['id'] for m in own[self.keep_manifests:])
+        if not expired:
+            return 0
+
+        for manifest in manifests:
+            if manifest['id'] in expired:
+                self._remove(os.path.join(self.manifest_dir, f"{manifest['id']}.json"))
+                # A ref to a dropped manifest would point at nothing
+                ref_path = os.path.join(self.ref_dir, manifest['name'])
+                try:
+                    with open(ref_path, 'r') as f:
+                        if f.read().strip() == manifest['id']:
+                            self._remove(ref_path)
+                except OSError:
+                    pass
+
+        referenced = set()
+        for manifest in manifests:
+            if manifest['id'] not in expired:
+                for entry in manifest['files']:
+                    referenced.update(entry['chunks'])
+
+        removed = 0
+        cutoff = time.time() - GC_GRACE_SECONDS
+        for dirpath, _, filenames in os.walk(self.chunk_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename in referenced or '.tmp' in filename:
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        # Another worker's gc may have got there first
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,69 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Wire format for NodeCommunicator payloads.
+#
+# Every payload frame starts with a two-byte header: the codec that encoded
+# the body and the frame kind. Receivers pick the codec from the header, so
+# nodes configured with different codecs still understand each other.
+
+FRAME_HEADER = struct.Struct('!BB')
+
+KIND_MESSAGE = 0
+KIND_BATCH = 1
+
+
+class JsonCodec:
+    codec_id = 0
+    name = 'json'
+
+    def encode(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data))
+
+
+class MsgpackCodec:
+    codec_id = 1
+    name = 'msgpack'
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = {JsonCodec.codec_id: JsonCodec()}
+if msgpack is not None:
+    CODECS[MsgpackCodec.codec_id] = MsgpackCodec()
+
+
+def get_codec(name=None):
+    """Return the named codec; by default msgpack when installed, otherwise JSON"""
+    by_name = {codec.name: codec for codec in CODECS.values()}
+    if name is None:
+        return by_name.get('msgpack', by_name['json'])
+    if name not in by_name:
+        print(f"Message codec {name!r} unavailable, falling back to json")
+        return by_name['json']
+    return by_name[name]
+
+
+def encode_frame(codec, obj, kind=KIND_MESSAGE):
+    return FRAME_HEADER.pack(codec.codec_id, kind) + codec.encode(obj)
+
+
+def decode_frame(frame):
+    """Return (kind, object) for a payload frame"""
+    codec_id, kind = FRAME_HEADER.unpack_from(frame)
+    codec = CODECS.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Unsupported message codec id {codec_id}")
+    return kind, codec.decode(memoryview(frame)[FRAME_HEADER.size:])
@@ -1,39 +1,142 @@
 import zmq
-import json
 import threading
 import time
 import os
-from datetime import datetime
+from codec import get_codec, encode_frame, decode_frame, KIND_BATCH
+from dispatch import Dispatcher, DEFAULT_WORKERS
+from batching import OutboundBatcher, MAX_BATCH, MAX_DELAY
+from events import create_event_sink, RECORDED_TYPES
+from failure_detector import create_failure_detector
+from broker import broker_endpoints
+# Addressing lives with membership; the helpers are re-exported for existing callers
+from membership import load_membership, bind_endpoint, node_name, node_id_of, cluster_node_ids  # noqa: F401
+
+# Messages travel as [topic, payload] where the topic is "<TYPE>\0<source>".
+# Subscribers subscribe to "<TYPE>\0" only for the types they handle, so
+# everything else is discarded by ZeroMQ before it is decoded.
+TOPIC_SEPARATOR = b'\0'
+POLL_INTERVAL_MS = 100
+# ZeroMQ's default high-water mark; PUB silently drops messages to a peer past it
+DEFAULT_HWM = 1000
+
+# (maxsize, overflow policy) per message type; other types use drop_oldest.
+# Load reports and heartbeats only matter in their latest form per node.
+DEFAULT_QUEUE_POLICIES = {
+    'FAULT': (10000, 'block'),
+    'RECOVERY': (10000, 'block'),
+    'MIGRATION': (10000, 'block'),
+    'LOAD': (64, 'coalesce'),
+    'HEARTBEAT': (64, 'coalesce'),
+    'NODE_SUSPECT': (1000, 'block'),
+    'NODE_DOWN': (1000, 'block'),
+    'NODE_UP': (1000, 'block'),
+    'MEMBERSHIP': (1000, 'block')
+}
+
+# With batching on, a buffered message of these types is replaced by a newer one
+COALESCED_TYPES = {'LOAD', 'HEARTBEAT'}
+
+# A listed node announces itself this soon after starting (once its
+# connections are likely up) and every MEMBERSHIP_INTERVAL seconds after that,
+# which is also how often MEMBERSHIP_FILE is checked for changes
+FIRST_ANNOUNCE_DELAY = 0.5
+MEMBERSHIP_INTERVAL = 5.0
+
+
+def make_topic(message_type, source=''):
+    return message_type.encode() + TOPIC_SEPARATOR + str(source).encode()
+
 
 class NodeCommunicator:
-    def __init__(self, node_id, peers=None):
+    def __init__(self, node_id, peers=None, codec=None, dispatch_workers=None, queue_policies=None,
+                 batching=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY, event_sink=None, observers=None,
+                 hwm=None, heartbeat_interval=None, membership=None, context=None):
         self.node_id = str(node_id)
-        self.peers = peers or [f"node{i}" for i in range(1, 4) if str(i) != self.node_id]
-        self.context = zmq.Context()
+        self.codec = get_codec(codec or os.environ.get('MESSAGE_CODEC'))
+        # Peers and observers (e.g. a benchmark harness, listened to but never a migration
+        # target) come from the membership, which changes as nodes join and leave
+        self.membership = membership or load_membership(self.node_id, peers, observers)
+        # inproc:// endpoints only reach sockets of the same context
+        self.owns_context = context is None
+        self.context = context or zmq.Context()
+        self.hwm = hwm or int(os.environ.get('MESSAGE_HWM', DEFAULT_HWM))
+        # Full mesh by default; with a broker (broker.py) two connections per node
+        self.broker = broker_endpoints()
         
         # Publisher for broadcasting messages
         self.publisher = self.context.socket(zmq.PUB)
-        self.publisher.bind(f"tcp://*:555{self.node_id}")
+        self.publisher.setsockopt(zmq.SNDHWM, self.hwm)
+        if self.broker:
+            self.publisher.connect(self.broker[0])
+        else:
+            self.publisher.bind(bind_endpoint(self.membership.publish_endpoint(self.node_id)))
+        self.publish_lock = threading.Lock()
+        
+        # Optional outbound batching (MESSAGE_BATCHING=1)
+        if batching is None:
+            batching = os.environ.get('MESSAGE_BATCHING', '0') == '1'
+        self.batcher = OutboundBatcher(self._send_batch, max_batch, max_delay) if batching else None
+        
+        # Fault, recovery and migration events this node sends are also recorded in InfluxDB
+        self.event_sink = event_sink if event_sink is not None else create_event_sink(self.node_id)
         
         # Subscriber for receiving messages
         self.subscriber = self.context.socket(zmq.SUB)
-        for peer in self.peers:
-            peer_id = peer[-1]
-            self.subscriber.connect(f"tcp://{peer}:555{peer_id}")
-        self.subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+        self.subscriber.setsockopt(zmq.RCVHWM, self.hwm)
+        self.connected = set()
+        if self.broker:
+            self.subscriber.connect(self.broker[1])
+        else:
+            for peer in self.peers + self.observers:
+                endpoint = self.membership.publish_endpoint(node_id_of(peer))
+                self.subscriber.connect(endpoint)
+                self.connected.add(endpoint)
         
-        # Callback registry for message handling
+        # Callback registry for message handling; only these types are subscribed
         self.callbacks = {
             'FAULT': [],
             'RECOVERY': [],
             'MIGRATION': []
         }
+        for message_type in self.callbacks:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, make_topic(message_type))
+        
+        # Subscriptions and connections added later are applied by the listener thread,
+        # which owns the socket
+        self.pending_subscriptions = []
+        self.pending_connections = []
+        self.subscription_lock = threading.Lock()
+        
+        # Handlers run on a worker pool so a slow callback never stalls the listener
+        workers = dispatch_workers or int(os.environ.get('DISPATCH_WORKERS', DEFAULT_WORKERS))
+        self.dispatcher = Dispatcher(self._handle_message, workers=workers)
+        policies = dict(DEFAULT_QUEUE_POLICIES)
+        policies.update(queue_policies or {})
+        for message_type, (maxsize, policy) in policies.items():
+            self.dispatcher.configure(message_type, maxsize=maxsize, policy=policy)
         
         # Start listener thread
+        self.next_membership_check = time.monotonic() + FIRST_ANNOUNCE_DELAY
         self.running = True
         self.listener_thread = threading.Thread(target=self._listen)
         self.listener_thread.daemon = True
         self.listener_thread.start()
+        
+        # Heartbeats and peer failure detection (HEARTBEAT_INTERVAL=0 disables both)
+        self.failure_detector = create_failure_detector(self, [node_id_of(peer) for peer in self.peers],
+                                                        heartbeat_interval)
+        
+        # Joins and leaves, announced by nodes and read from MEMBERSHIP_FILE
+        self.membership.on_change(self._on_member_change)
+        self.register_callback('MEMBERSHIP', self._on_membership)
+    
+    @property
+    def peers(self):
+        return self.membership.peers()
+    
+    @property
+    def observers(self):
+        return self.membership.observers()
     
     def register_callback(self, message_type, callback_func):
         """Register a callback function for a specific message type"""
@@ -41,35 +144,171 @@ class NodeCommunicator:
             self.callbacks[message_type].append(callback_func)
         else:
             self.callbacks[message_type] = [callback_func]
+            with self.subscription_lock:
+                self.pending_subscriptions.append(make_topic(message_type))
     
-    def broadcast_message(self, message_type, data):
-        """Broadcast a message to all peers"""
+    def configure_queue(self, message_type, maxsize, policy, key_func=None):
+        """Set the dispatch queue size and overflow policy for a message type"""
+        self.dispatcher.configure(message_type, maxsize=maxsize, policy=policy, key_func=key_func)
+    
+    def dispatch_stats(self):
+        """Queue depth, drop and coalesce counters per message type"""
+        return self.dispatcher.stats()
+    
+    def broadcast_message(self, message_type, data, coalesce_key=None):
+        """Broadcast a message to all peers.
+
+        With batching enabled the message is buffered; a buffered message with
+        the same coalesce_key (by default, any earlier LOAD or HEARTBEAT) is
+        replaced rather than sent.
+        """
         message = {
             'type': message_type,
             'source': self.node_id,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': time.time(),
             'data': data
         }
-        self.publisher.send_json(message)
+        if self.event_sink is not None and message_type in RECORDED_TYPES:
+            self.event_sink.record(message_type, data, message['timestamp'])
+        if self.batcher is not None:
+            if coalesce_key is None and message_type in COALESCED_TYPES:
+                coalesce_key = message_type
+            self.batcher.add(message, coalesce_key)
+            return message
+        
+        self._publish(message_type, encode_frame(self.codec, message))
         return message
     
+    def _send_batch(self, message_type, messages):
+        if len(messages) == 1:
+            self._publish(message_type, encode_frame(self.codec, messages[0]))
+        else:
+            self._publish(message_type, encode_frame(self.codec, messages, KIND_BATCH))
+    
+    def _publish(self, message_type, payload):
+        # Sockets are not thread-safe and several threads broadcast
+        with self.publish_lock:
+            self.publisher.send_multipart([make_topic(message_type, self.node_id), payload])
+    
+    def notify(self, message_type, data):
+        """Deliver a locally raised event (e.g. NODE_DOWN) to this node's callbacks"""
+        self.dispatcher.submit({
+            'type': message_type,
+            'source': self.node_id,
+            'timestamp': time.time(),
+            'data': data,
+            'local': True
+        })
+    
+    def flush(self):
+        """Send any batched messages now"""
+        if self.batcher is not None:
+            self.batcher.flush()
+    
     def _listen(self):
         """Listen for messages from other nodes"""
         while self.running:
             try:
-                message = self.subscriber.recv_json()
-                self._handle_message(message)
+                self._apply_subscriptions()
+                self._check_membership()
+                if not self.subscriber.poll(POLL_INTERVAL_MS, zmq.POLLIN):
+                    continue
+                topic, payload = self.subscriber.recv_multipart()
+                # Stamped here rather than by the handler, so time spent queued for a
+                # dispatch worker does not count as network delay (see failure_detector.py)
+                received = time.monotonic()
+                
+                # Our own messages can be dropped from the topic alone
+                if topic.split(TOPIC_SEPARATOR, 1)[-1] == self.node_id.encode():
+                    continue
+                
+                kind, message = decode_frame(payload)
+                if kind == KIND_BATCH:
+                    for item in message:
+                        item['received'] = received
+                        self.dispatcher.submit(item)
+                else:
+                    message['received'] = received
+                    self.dispatcher.submit(message)
+            except zmq.ContextTerminated:
+                break
             except Exception as e:
                 print(f"Error in listener: {e}")
                 time.sleep(0.1)
     
+    def _apply_subscriptions(self):
+        with self.subscription_lock:
+            pending, self.pending_subscriptions = self.pending_subscriptions, []
+            connections, self.pending_connections = self.pending_connections, []
+        for topic in pending:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, topic)
+        for event, endpoint in connections:
+            if event == 'join' and endpoint not in self.connected:
+                self.subscriber.connect(endpoint)
+                self.connected.add(endpoint)
+            elif event == 'leave' and endpoint in self.connected:
+                self.subscriber.disconnect(endpoint)
+                self.connected.discard(endpoint)
+    
+    def _check_membership(self):
+        """Re-read MEMBERSHIP_FILE and announce this node, every MEMBERSHIP_INTERVAL"""
+        now = time.monotonic()
+        if now < self.next_membership_check:
+            return
+        self.next_membership_check = now + MEMBERSHIP_INTERVAL
+        added = self.membership.reload()
+        # In a mesh, nodes whose own file is stale are not connected to new entries yet
+        self._announce('join', with_members=bool(added) and not self.broker)
+    
+    def _announce(self, action, with_members=False):
+        # Only listed cluster nodes announce; tools with explicit peers just listen
+        local = self.membership.local()
+        if not self.membership.listed or local['observer']:
+            return
+        data = {'action': action, 'member': local}
+        if with_members:
+            data['members'] = [member for member in self.membership.snapshot() if member['id'] != self.node_id]
+        self.broadcast_message('MEMBERSHIP', data)
+    
+    def _on_membership(self, message):
+        """Apply a join or leave announced by another node"""
+        data = message['data']
+        member = data['member']
+        if data['action'] == 'leave':
+            self.membership.remove(member['id'])
+            return
+        # Members the sender knows; they are applied without a reply
+        for known in data.get('members', ()):
+            if known['id'] != self.node_id:
+                self.membership.add(known)
+        if member['id'] == self.node_id or not self.membership.add(member):
+            return
+        # The newcomer may not know this node yet. In a mesh, nodes that are not connected
+        # to the newcomer did not hear it and the newcomer may only be connected to a few
+        # nodes, so the reply carries every member this node knows.
+        self._announce('join', with_members=not self.broker)
+    
+    def _on_member_change(self, event, member):
+        """Connect to members that join and disconnect from members that leave"""
+        node_id = member['id']
+        if node_id == self.node_id:
+            return
+        if not self.broker:
+            with self.subscription_lock:
+                self.pending_connections.append((event, member['publish']))
+        if self.failure_detector is not None and not member['observer']:
+            if event == 'join':
+                self.failure_detector.watch(node_id)
+            else:
+                self.failure_detector.unwatch(node_id)
+        print(f"Node {node_id} {'joined' if event == 'join' else 'left'} the membership of node {self.node_id}")
+    
     def _handle_message(self, message):
         """Handle incoming messages"""
-        if message['source'] == self.node_id:
+        if message['source'] == self.node_id and not message.get('local'):
             return
-            
-        print(f"Node {self.node_id} received message: {message}")
         
+        # FAULT and RECOVERY are logged below; LOAD and HEARTBEAT arrive too often to log
         message_type = message['type']
         
         # Default handlers
@@ -92,6 +331,9 @@ class NodeCommunicator:
             elif action == 'service_restored':
                 print(f"Service restored on node {message['source']} from checkpoint {message['data'].get('checkpoint_dir')}")
         
+        elif message_type in ('NODE_SUSPECT', 'NODE_DOWN', 'NODE_UP'):
+            print(f"Failure detector: {message_type} for node {message['data']['node_id']} (phi {message['data']['phi']})")
+        
         # Execute registered callbacks
         if message_type in self.callbacks:
             for callback in self.callbacks[message_type]:
@@ -108,11 +350,20 @@ class NodeCommunicator:
     
     def close(self):
         """Clean shutdown"""
+        self._announce('leave')
+        if self.failure_detector is not None:
+            self.failure_detector.stop()
+        if self.batcher is not None:
+            self.batcher.close()
         self.running = False
-        time.sleep(0.5)  # Allow time for thread to close
+        self.listener_thread.join(timeout=1)
+        self.dispatcher.close()
+        if self.event_sink is not None:
+            self.event_sink.close()
         self.publisher.close()
         self.subscriber.close()
-        self.context.term()
+        if self.owns_context:
+            self.context.term()
 
 if __name__ == "__main__":
     # Test code
@@ -126,12 +377,17 @@ if __name__ == "__main__":
     def on_recovery(message):
         print(f"RECOVERY CALLBACK: {message}")
     
+    def on_node_event(message):
+        print(f"{message['type']} CALLBACK: {message['data']}")
+    
     comm.register_callback('FAULT', on_fault)
     comm.register_callback('RECOVERY', on_recovery)
+    # Heartbeats are sent by the built-in failure detector
+    for event in ('NODE_SUSPECT', 'NODE_DOWN', 'NODE_UP'):
+        comm.register_callback(event, on_node_event)
     
     try:
         while True:
-            comm.broadcast_message('HEARTBEAT', {'status': 'alive'})
             time.sleep(5)
     except KeyboardInterrupt:
         comm.close() 
\ No newline at end of file
@@ -0,0 +1,176 @@
+import threading
+from collections import deque, OrderedDict
+
+# Callback dispatch for NodeCommunicator.
+#
+# The listener thread only enqueues; a pool of worker threads runs handlers.
+# Each message type has its own bounded queue with an overflow policy:
+#
+#   block        the listener waits for room (nothing is lost, ingest stalls)
+#   drop_oldest  the oldest queued message is discarded to make room
+#   coalesce     a queued message with the same key is replaced by the newer
+#                one; otherwise behaves like drop_oldest
+#
+# A type is handled by at most one worker at a time, so handlers see messages
+# of one type in order while different types run in parallel.
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'coalesce')
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_WORKERS = 4
+
+
+def source_key(message):
+    return message.get('source')
+
+
+class DispatchQueue:
+    def __init__(self, message_type, maxsize=DEFAULT_QUEUE_SIZE, policy='drop_oldest', key_func=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}, expected one of {OVERFLOW_POLICIES}")
+        if policy == 'coalesce' and key_func is None:
+            key_func = source_key
+        self.message_type = message_type
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key_func = key_func
+        self.items = OrderedDict() if policy == 'coalesce' else deque()
+        self.busy = False
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    def put(self, message):
+        """Add a message; the caller has already made room for 'block' queues"""
+        self.enqueued += 1
+        if self.policy == 'coalesce':
+            key = self.key_func(message)
+            if key in self.items:
+                self.items[key] = message
+                self.coalesced += 1
+                return
+            if self.full():
+                self.items.popitem(last=False)
+                self.dropped += 1
+            self.items[key] = message
+        else:
+            if self.full():
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(message)
+        self.max_depth = max(self.max_depth, len(self.items))
+
+    def get(self):
+        if self.policy == 'coalesce':
+            return self.items.popitem(last=False)[1]
+        return self.items.popleft()
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'depth': len(self.items),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced
+        }
+
+
+class Dispatcher:
+    """Runs handler(message) on a worker pool fed by per-type bounded queues"""
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, default_maxsize=DEFAULT_QUEUE_SIZE,
+                 default_policy='drop_oldest'):
+        self.handler = handler
+        self.default_maxsize = default_maxsize
+        self.default_policy = default_policy
+        self.queues = {}
+        self.ready = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.running = True
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f"dispatch-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def configure(self, message_type, maxsize=DEFAULT_QUEUE_SIZE, policy='drop_oldest', key_func=None):
+        """Set the queue size and overflow policy for a message type"""
+        with self.lock:
+            queue = DispatchQueue(message_type, maxsize, policy, key_func)
+            old = self.queues.get(message_type)
+            if old is not None:
+                if old in self.ready:
+                    self.ready.remove(old)
+                while old.items:
+                    queue.put(old.get())
+            self.queues[message_type] = queue
+            if len(queue):
+                self.ready.append(queue)
+                self.not_empty.notify()
+
+    def _queue(self, message_type):
+        queue = self.queues.get(message_type)
+        if queue is None:
+            queue = self.queues[message_type] = DispatchQueue(
+                message_type, self.default_maxsize, self.default_policy)
+        return queue
+
+    def submit(self, message):
+        with self.lock:
+            queue = self._queue(message['type'])
+            if queue.policy == 'block':
+                while queue.full() and self.running:
+                    self.not_full.wait()
+            was_idle = len(queue) == 0
+            queue.put(message)
+            if was_idle and not queue.busy:
+                self.ready.append(queue)
+                self.not_empty.notify()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.ready and self.running:
+                    self.not_empty.wait()
+                if not self.running:
+                    return
+                queue = self.ready.popleft()
+                message = queue.get()
+                queue.busy = True
+                self.not_full.notify_all()
+
+            try:
+                self.handler(message)
+            except Exception as e:
+                print(f"Error in dispatch worker: {e}")
+
+            with self.lock:
+                queue.busy = False
+                queue.processed += 1
+                if len(queue) and self.queues.get(queue.message_type) is queue:
+                    self.ready.append(queue)
+                    self.not_empty.notify()
+
+    def stats(self):
+        with self.lock:
+            return {message_type: queue.stats() for message_type, queue in self.queues.items()}
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        for worker in self.workers:
+            worker.join(timeout=1)
@@ -1,84 +1,180 @@
 import time
 import os
+import sys
+import signal
 import psutil
-import random
 from datetime import datetime
 import socket
 import json
+import argparse
+from collections import deque
+from journal import Journal, read_journal, SEQ_KEY
+from workload import WorkloadEngine, load_profile
+
+# Only the most recent completions and transactions are kept in memory; the
+# journal is the durable record of the work done
+RECENT_COMPLETED = 100
+RECENT_TRANSACTIONS = 100
+MAX_MIGRATION_HISTORY = 100
 
 class DummyService:
-    def __init__(self):
+    def __init__(self, restore_from=None, workload=None):
         self.node_id = os.environ.get('NODE_ID', '0')
         self.pid = os.getpid()
         self.start_time = datetime.now()
         
+        # The recovery manager asks for a fresh state file before checkpointing. The handler
+        # goes in first, as the default SIGUSR1 action would kill us; a request that arrives
+        # before the journal exists is served once it does.
+        self.journal = None
+        self.mutating = False
+        self.flush_requested = False
+        signal.signal(signal.SIGUSR1, self._on_flush_request)
+        
+        # The load each task generates (WORKLOAD selects the profile)
+        self.workload = workload or WorkloadEngine(load_profile())
+        
         # State that should persist across migrations
         self.processed_items = 0
-        self.work_queue = [f"task_{i}" for i in range(100)]
-        self.completed_tasks = []
-        self.transaction_log = []
+        self.work_queue = deque(f"task_{i}" for i in range(100))
+        self.completed_tasks = deque(maxlen=RECENT_COMPLETED)
+        self.transaction_log = deque(maxlen=RECENT_TRANSACTIONS)
         
         # Record migration history
-        self.migration_history = []
+        self.migration_history = deque(maxlen=MAX_MIGRATION_HISTORY)
         self.original_node = self.node_id
         
-        # Create state file to track our existence
+        # Pick up where a checkpointed instance left off
+        seq = self.load_state(restore_from) if restore_from else 0
+        
+        # State file (the compacted snapshot) and its journal track our existence
         self.state_file = f"/tmp/dummy_service_state_{self.pid}.json"
+        self.journal = Journal(self.state_file, seq=seq)
         self.save_state()
+        if self.flush_requested:
+            self.flush_requested = False
+            self._flush_for_checkpoint()
         
-    def save_state(self):
-        """Save state to a file"""
-        state = {
+    def snapshot_state(self):
+        return {
             'pid': self.pid,
             'node_id': self.node_id,
             'original_node': self.original_node,
             'start_time': self.start_time.isoformat(),
             'processed_items': self.processed_items,
             'remaining_tasks': len(self.work_queue),
-            'completed_tasks': len(self.completed_tasks),
-            'migration_history': self.migration_history,
-            'hostname': socket.gethostname()
+            'completed_tasks': self.processed_items,
+            'migration_history': list(self.migration_history),
+            'hostname': socket.gethostname(),
+            'work_queue': list(self.work_queue),
+            'completed_task_ids': list(self.completed_tasks),
+            'workload': self.workload.stats()
         }
+    
+    def save_state(self):
+        """Write a compacted snapshot of the state and truncate the journal"""
+        self.mutating = True
+        try:
+            self.journal.snapshot(self.snapshot_state())
+        finally:
+            self.mutating = False
+    
+    def _on_flush_request(self, signum, frame):
+        # A flush landing mid-update (or before the journal exists) waits for it to finish
+        if self.mutating or self.journal is None:
+            self.flush_requested = True
+        else:
+            self._flush_for_checkpoint()
+    
+    def _flush_for_checkpoint(self):
+        """Save the state for a checkpoint, then stop until the recovery manager kills or resumes us.
+
+        Tasks finished after the snapshot would only reach this instance's
+        journal, which the migration throws away, and the restored instance
+        would run them again.
+        """
+        self.save_state()
+        os.kill(self.pid, signal.SIGSTOP)
+    
+    def _record(self, record):
+        """Apply a state change and journal it, as one step as far as flushes are concerned"""
+        self.mutating = True
+        try:
+            self._apply(record)
+            self.journal.append(record)
+            if self.journal.needs_snapshot():
+                self.journal.snapshot(self.snapshot_state())
+        finally:
+            self.mutating = False
+        if self.flush_requested:
+            self.flush_requested = False
+            self._flush_for_checkpoint()
+    
+    def _apply(self, record):
+        """Change the state by one journal record; used live and on replay"""
+        if record['op'] == 'complete':
+            task = record['task']
+            if self.work_queue and self.work_queue[0] == task:
+                self.work_queue.popleft()
+            self.completed_tasks.append(task)
+            self.processed_items += 1
+            self.transaction_log.append({
+                'task': task,
+                'timestamp': record['timestamp'],
+                'node_id': record['node_id'],
+                'pid': record['pid']
+            })
+        elif record['op'] == 'migrated':
+            self.migration_history.append({key: record[key] for key in
+                                           ('from_node', 'to_node', 'timestamp', 'processed_items_before_migration')})
+            self.node_id = record['to_node']
+    
+    def load_state(self, path):
+        """Restore the work queue and history from a snapshot and the journal after it.
+
+        Returns the sequence number of the last record applied.
+        """
+        state, records = read_journal(path)
+        state = state or {}
         
-        with open(self.state_file, 'w') as f:
-            json.dump(state, f)
+        self.processed_items = state.get('processed_items', 0)
+        self.work_queue = deque(state.get('work_queue', self.work_queue))
+        self.completed_tasks.extend(state.get('completed_task_ids', []))
+        self.migration_history.extend(state.get('migration_history', []))
+        self.original_node = state.get('original_node', self.node_id)
+        # The saved node is where the state came from, so do_work records the migration
+        self.node_id = state.get('node_id', self.node_id)
+        for record in records:
+            self._apply(record)
+        print(f"Restored state from {path}: {self.processed_items} items processed, "
+              f"{len(self.work_queue)} tasks remaining ({len(records)} journal records replayed)")
+        return records[-1]['seq'] if records else state.get(SEQ_KEY, 0)
             
     def process_task(self):
         """Process a task from the queue"""
         if not self.work_queue:
             return "No tasks available"
             
-        task = self.work_queue.pop(0)
+        # Stays queued until done, so a checkpoint taken mid-task still includes it
+        task = self.work_queue[0]
         
-        # Simulate CPU work
-        for _ in range(random.randint(1000000, 2000000)):
-            _ = random.random() ** 2
-            
-        # Simulate memory allocation
-        temp_list = [1] * random.randint(100, 1000)
+        # Generate the profile's load across the worker pool
+        self.workload.run_task()
         
         # Record completion
-        self.completed_tasks.append(task)
-        self.processed_items += 1
-        
-        # Log the transaction
-        transaction = {
+        self._record({
+            'op': 'complete',
             'task': task,
             'timestamp': datetime.now().isoformat(),
             'node_id': self.node_id,
             'pid': self.pid
-        }
-        self.transaction_log.append(transaction)
+        })
         
         return f"Processed {task}"
         
     def do_work(self):
         """Simulates work with varying CPU and memory usage"""
         result = self.process_task()
-        
-        # Update state file periodically
-        if self.processed_items % 10 == 0:
-            self.save_state()
             
         # Detect if we've been migrated
         current_node = os.environ.get('NODE_ID', '0')
@@ -86,16 +182,16 @@ class DummyService:
         
         if current_node != self.node_id:
             print(f"Migration detected! From node {self.node_id} to {current_node}")
-            self.migration_history.append({
+            self._record({
+                'op': 'migrated',
                 'from_node': self.node_id,
                 'to_node': current_node,
                 'timestamp': datetime.now().isoformat(),
                 'processed_items_before_migration': self.processed_items
             })
-            self.node_id = current_node
-            self.save_state()
         
-        time.sleep(0.1)
+        # Wait for the next task slot at the profile's target rate
+        self.workload.pace()
         return result
         
     def run(self):
@@ -109,13 +205,34 @@ class DummyService:
                 # Log some metrics
                 cpu_percent = psutil.Process(self.pid).cpu_percent()
                 mem_info = psutil.Process(self.pid).memory_info()
+                workload = self.workload.stats()
                 
-                print(f"Node {self.node_id} - PID {self.pid} - CPU: {cpu_percent}% MEM: {mem_info.rss / 1024 / 1024:.2f}MB - Tasks: {len(self.completed_tasks)}/{self.processed_items + len(self.work_queue)} - Result: {result}")
+                print(f"Node {self.node_id} - PID {self.pid} - CPU: {cpu_percent}% MEM: {mem_info.rss / 1024 / 1024:.2f}MB - Tasks: {self.processed_items}/{self.processed_items + len(self.work_queue)} - Rate: {workload['achieved_rate']:.2f}/{workload['target_rate']:.2f} tasks/s - Result: {result}")
                 
             except Exception as e:
                 print(f"Error in dummy service: {e}")
                 time.sleep(1)
 
+def wait_for_activation():
+    """Standby mode: block until the recovery manager hands over a checkpoint.
+
+    Returns the state file to restore from (None for a fresh start), or exits
+    when stdin is closed without a handover.
+    """
+    line = sys.stdin.readline()
+    if not line:
+        sys.exit(0)
+    return json.loads(line).get('state_file')
+
 if __name__ == "__main__":
-    service = DummyService()
+    parser = argparse.ArgumentParser(description='Dummy Service')
+    parser.add_argument('--standby', action='store_true', help='Wait warm on stdin for a checkpoint to restore')
+    parser.add_argument('--restore', type=str, help='State file to restore from')
+    args = parser.parse_args()
+    
+    # Standby workers start their pool before waiting, so activation finds it warm
+    workload = WorkloadEngine(load_profile())
+    workload.warm_up()
+    restore_from = wait_for_activation() if args.standby else args.restore
+    service = DummyService(restore_from=restore_from, workload=workload)
     service.run() 
\ No newline at end of file
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import queue
+import threading
+import urllib.parse
+import urllib.request
+
+try:
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+except ImportError:
+    InfluxDBClient = None
+
+# Fault, recovery and migration events recorded in InfluxDB for dashboards
+# and for labelling training data (training_data.py reads them back).
+#
+# record() only appends to a bounded in-memory queue and never blocks: when
+# the queue is full the event is dropped and counted. A background thread
+# turns queued events into line protocol and writes them in batches, retrying
+# failed writes with backoff, so callers on the recovery path never wait on
+# InfluxDB.
+#
+#   events,node=node1,type=FAULT,kind=cpu_stress pid=123i,payload="{...}" <ns>
+
+EVENTS_MEASUREMENT = 'events'
+RECORDED_TYPES = ('FAULT', 'RECOVERY', 'MIGRATION')
+
+INFLUX_URL = os.environ.get('INFLUX_URL', 'http://influxdb:8086')
+INFLUX_DB = os.environ.get('INFLUX_DB', 'telegraf')
+INFLUX_USER = os.environ.get('INFLUX_USER', 'admin')
+INFLUX_PASSWORD = os.environ.get('INFLUX_PASSWORD', 'adminpassword')
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+
+def _escape_tag(value):
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def _escape_string(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def to_line(node, message_type, data, timestamp_ns):
+    """One line-protocol point for an event"""
+    kind = data.get('type') or data.get('action') or 'unknown'
+    tags = f"node={_escape_tag(node)},type={_escape_tag(message_type)},kind={_escape_tag(kind)}"
+    fields = []
+    if isinstance(data.get('pid'), int):
+        fields.append(f"pid={data['pid']}i")
+    if isinstance(data.get('prediction'), (int, float)):
+        fields.append(f"prediction={float(data['prediction'])}")
+    payload = json.dumps(data, separators=(',', ':'), default=str)
+    fields.append(f'payload="{_escape_string(payload)}"')
+    return f"{EVENTS_MEASUREMENT},{tags} {','.join(fields)} {timestamp_ns}"
+
+
+class InfluxClientWriter:
+    """Writes line protocol through influxdb-client's v2 write API (InfluxDB 1.8 compatible)"""
+
+    def __init__(self, url, database, user, password, timeout_ms=5000):
+        self.client = InfluxDBClient(url=url, token=f"{user}:{password}", org='-', timeout=timeout_ms)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.bucket = f"{database}/autogen"
+
+    def write(self, lines):
+        self.write_api.write(bucket=self.bucket, record=lines, write_precision='ns')
+
+    def close(self):
+        self.client.close()
+
+
+class HttpWriter:
+    """Posts line protocol to the InfluxDB 1.x /write endpoint"""
+
+    def __init__(self, url, database, user, password, timeout=5):
+        params = urllib.parse.urlencode({'db': database, 'u': user, 'p': password, 'precision': 'ns'})
+        self.endpoint = f"{url.rstrip('/')}/write?{params}"
+        self.timeout = timeout
+
+    def write(self, lines):
+        request = urllib.request.Request(self.endpoint, data='\n'.join(lines).encode(), method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def close(self):
+        pass
+
+
+def make_writer(url=INFLUX_URL, database=INFLUX_DB, user=INFLUX_USER, password=INFLUX_PASSWORD):
+    """influxdb-client when installed, otherwise plain HTTP"""
+    if InfluxDBClient is not None:
+        return InfluxClientWriter(url, database, user, password)
+    return HttpWriter(url, database, user, password)
+
+
+class EventSink:
+    """Buffers events and writes them to InfluxDB in background batches"""
+
+    def __init__(self, node, writer=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_retries=MAX_RETRIES):
+        self.node = node
+        self.writer = writer or make_writer()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.running = True
+        self.flush_thread = threading.Thread(target=self._run, name='event-sink')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def record(self, message_type, data, timestamp=None):
+        """Queue an event; drops it instead of waiting when the queue is full"""
+        timestamp_ns = int((timestamp or time.time()) * 1e9)
+        try:
+            self.queue.put_nowait((message_type, data, timestamp_ns))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, timeout):
+        """Collect up to batch_size queued events, waiting at most `timeout` for the first"""
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while self.running:
+            batch = self._drain(self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        lines = []
+        for message_type, data, timestamp_ns in batch:
+            try:
+                lines.append(to_line(self.node, message_type, data, timestamp_ns))
+            except (TypeError, ValueError) as e:
+                print(f"Skipping unrecordable {message_type} event: {e}")
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.writer.write(lines)
+                self.written += len(lines)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries or not self.running:
+                    print(f"Dropping {len(lines)} events after failed write: {e}")
+                    break
+                time.sleep(RETRY_BACKOFF * (2 ** attempt))
+        self.failed += len(lines)
+        return False
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queued': self.queue.qsize()
+        }
+
+    def close(self, timeout=2.0):
+        """Stop the flush thread and make one last attempt to write what is queued"""
+        self.running = False
+        self.flush_thread.join(timeout=self.flush_interval + timeout)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = self._drain(0)
+            if not batch:
+                break
+            self._write(batch)
+        self.writer.close()
+
+
+def create_event_sink(node_id):
+    """EventSink for this node unless EVENT_SINK=0"""
+    if os.environ.get('EVENT_SINK', '1') == '0':
+        return None
+    try:
+        return EventSink(f"node{node_id}")
+    except Exception as e:
+        print(f"Could not start event sink: {e}")
+        return None
@@ -0,0 +1,215 @@
+import os
+import math
+import time
+import threading
+
+# Phi-accrual failure detection for NodeCommunicator.
+#
+# Every node broadcasts a HEARTBEAT each HEARTBEAT_INTERVAL seconds. For each
+# peer the detector keeps the last WINDOW inter-arrival times in a fixed-size
+# ring with running sums, so mean and variance cost O(1) per heartbeat. How
+# suspicious the silence since the last heartbeat is, is expressed as
+#
+#   phi = -log10(P(a heartbeat arrives later than now))
+#
+# under a normal distribution with the window's mean (plus an acceptable
+# pause) and standard deviation (at least a floor, so a very regular peer is
+# not declared dead over one late packet). phi 1 means a 10% chance the peer
+# is fine, phi 8 one in 10^8. Crossing PHI_SUSPECT raises NODE_SUSPECT and
+# crossing PHI_DOWN raises NODE_DOWN; a heartbeat from a suspected or down
+# peer raises NODE_UP. A peer that crosses both thresholds between two checks
+# raises only NODE_DOWN. The events are delivered locally through the
+# communicator's callback registry like any received message, with the peer
+# in data['node_id'].
+#
+# A lower interval or threshold detects a dead node sooner; a higher one
+# tolerates more jitter and GC pauses without false positives. With the
+# defaults and steady heartbeats, a node that stops is suspected about 2.6 s
+# after its last heartbeat and down about 0.3 s later; jittery heartbeats
+# widen the distribution and push both out.
+
+HEARTBEAT_INTERVAL = 1.0
+PHI_SUSPECT = 8.0
+PHI_DOWN = 16.0
+WINDOW = 100
+# Standard deviation floor and extra allowed silence, as fractions of the interval
+MIN_STD_FRACTION = 0.1
+ACCEPTABLE_PAUSE_FRACTION = 1.0
+# phi once the probability underflows
+PHI_MAX = 300.0
+
+ALIVE, SUSPECT, DOWN = 'alive', 'suspect', 'down'
+
+
+class ArrivalWindow:
+    """The last `size` heartbeat inter-arrival times of one peer"""
+
+    def __init__(self, size=WINDOW):
+        self.intervals = [0.0] * size
+        self.count = 0
+        self.next = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.last = None
+
+    def add(self, now):
+        if self.last is not None:
+            interval = now - self.last
+            old = self.intervals[self.next]
+            if self.count == len(self.intervals):
+                self.total -= old
+                self.squares -= old * old
+            else:
+                self.count += 1
+            self.intervals[self.next] = interval
+            self.next = (self.next + 1) % len(self.intervals)
+            self.total += interval
+            self.squares += interval * interval
+        self.last = now
+
+    def stats(self):
+        """(mean, standard deviation) of the window"""
+        mean = self.total / self.count
+        return mean, math.sqrt(max(self.squares / self.count - mean * mean, 0.0))
+
+
+def phi(elapsed, mean, std):
+    p_later = 0.5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+    return -math.log10(p_later) if p_later > 0 else PHI_MAX
+
+
+class FailureDetector:
+    """Sends this node's heartbeats and raises NODE_SUSPECT/NODE_DOWN/NODE_UP for peers"""
+
+    def __init__(self, communicator, peers, interval=HEARTBEAT_INTERVAL, suspect_threshold=PHI_SUSPECT,
+                 down_threshold=PHI_DOWN, window=WINDOW):
+        self.communicator = communicator
+        self.interval = interval
+        self.suspect_threshold = suspect_threshold
+        self.down_threshold = down_threshold
+        self.window = window
+        self.min_std = interval * MIN_STD_FRACTION
+        self.acceptable_pause = interval * ACCEPTABLE_PAUSE_FRACTION
+        # Only cluster peers are watched; observers come and go, and members that join or leave
+        # are added with watch() and dropped with unwatch()
+        self.watched = set(peers)
+        self.arrivals = {}
+        self.states = {}
+        self.lock = threading.Lock()
+        communicator.register_callback('HEARTBEAT', self._on_heartbeat)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='failure-detector')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _on_heartbeat(self, message):
+        node_id = message['source']
+        # When the listener took it off the socket; dispatch queueing is not the peer's delay
+        now = message.get('received', time.monotonic())
+        with self.lock:
+            if node_id not in self.watched:
+                return
+            window = self.arrivals.get(node_id)
+            if window is None:
+                window = self.arrivals[node_id] = ArrivalWindow(self.window)
+            # Dispatch workers can hand over an older heartbeat after a newer one
+            if window.last is None or now > window.last:
+                window.add(now)
+            previous = self.states.get(node_id, ALIVE)
+            self.states[node_id] = ALIVE
+        if previous != ALIVE:
+            self._raise('NODE_UP', node_id, 0.0, previous)
+
+    def watch(self, node_id):
+        with self.lock:
+            self.watched.add(node_id)
+
+    def unwatch(self, node_id):
+        """Stop watching a peer that left; it is neither suspected nor declared down"""
+        with self.lock:
+            self.watched.discard(node_id)
+            self.arrivals.pop(node_id, None)
+            self.states.pop(node_id, None)
+
+    def phi(self, node_id, now=None):
+        """Current suspicion level of a peer (0.0 until its second heartbeat)"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            window = self.arrivals.get(node_id)
+            if window is None or window.last is None:
+                return 0.0
+            if window.count:
+                mean, std = window.stats()
+            else:
+                # One heartbeat so far: assume the peer sends at our interval
+                mean, std = self.interval, self.interval / 4
+            elapsed = now - window.last
+        return phi(elapsed, mean + self.acceptable_pause, max(std, self.min_std))
+
+    def state(self, node_id):
+        with self.lock:
+            return self.states.get(node_id, ALIVE)
+
+    def suspected(self):
+        """Peers currently suspected or down"""
+        with self.lock:
+            return {node_id for node_id, state in self.states.items() if state != ALIVE}
+
+    def _check(self):
+        now = time.monotonic()
+        for node_id in list(self.arrivals):
+            level = self.phi(node_id, now)
+            if level >= self.down_threshold:
+                state = DOWN
+            elif level >= self.suspect_threshold:
+                state = SUSPECT
+            else:
+                continue
+            with self.lock:
+                if node_id not in self.watched:
+                    continue
+                previous = self.states.get(node_id, ALIVE)
+                # Only escalations are raised here; recovery comes with the next heartbeat
+                if previous == DOWN or previous == state:
+                    continue
+                self.states[node_id] = state
+            self._raise('NODE_DOWN' if state == DOWN else 'NODE_SUSPECT', node_id, level, previous)
+
+    def _raise(self, event, node_id, level, previous):
+        with self.lock:
+            window = self.arrivals.get(node_id)
+            silent = time.monotonic() - window.last if window and window.last is not None else None
+        self.communicator.notify(event, {
+            'node_id': node_id,
+            'phi': round(min(level, PHI_MAX), 2),
+            'silent_seconds': round(silent, 3) if silent is not None else None,
+            'previous': previous
+        })
+
+    def _run(self):
+        # Peers are checked twice per interval, so detection lags a threshold by at most half of one
+        ticks = 0
+        while self.running:
+            try:
+                if ticks % 2 == 0:
+                    self.communicator.broadcast_message('HEARTBEAT', {'interval': self.interval})
+                self._check()
+            except Exception as e:
+                print(f"Error in failure detector: {e}")
+            ticks += 1
+            time.sleep(self.interval / 2)
+
+    def stop(self):
+        self.running = False
+
+
+def create_failure_detector(communicator, peers, interval=None):
+    """FailureDetector tuned by HEARTBEAT_INTERVAL, PHI_SUSPECT, PHI_DOWN and HEARTBEAT_WINDOW; None if the interval is 0"""
+    interval = float(os.environ.get('HEARTBEAT_INTERVAL', HEARTBEAT_INTERVAL)) if interval is None else interval
+    if interval <= 0:
+        return None
+    return FailureDetector(communicator, peers, interval,
+                           suspect_threshold=float(os.environ.get('PHI_SUSPECT', PHI_SUSPECT)),
+                           down_threshold=float(os.environ.get('PHI_DOWN', PHI_DOWN)),
+                           window=int(os.environ.get('HEARTBEAT_WINDOW', WINDOW)))
@@ -0,0 +1,242 @@
+import os
+import json
+import threading
+
+# Cluster membership and addressing.
+#
+# Nodes are named node<id> with numeric ids. The members are read from
+# MEMBERSHIP_FILE, a JSON list such as
+#
+#   [{"id": "1"}, {"id": "2"}, {"id": "12", "host": "10.0.0.12"},
+#    {"id": "20", "publish": "ipc:///run/ha/node20-pub", "transfer": "ipc:///run/ha/node20-transfer"},
+#    {"id": "0", "observer": true}]
+#
+# or, without one, from CLUSTER_NODES (default 1,2,3) and OBSERVER_NODES.
+# Observers (a campaign or benchmark harness) are listened to but are never
+# migration targets. An entry without its own endpoints gets them from
+# MESSAGE_TRANSPORT:
+#
+#   tcp     tcp://<host>:<PUB_PORT_BASE + id> and :<TRANSFER_PORT_BASE + id>
+#           (bases 5550 and 6660). The host is the entry's "host", else
+#           NODE_HOST_<id>, else NODE_HOST_TEMPLATE (default node{id}), so
+#           several nodes can share a host with NODE_HOST_TEMPLATE=127.0.0.1
+#           and NODE_HOST_0=node1 places a single node
+#   ipc     ipc://<IPC_DIR>/node<id>-pub and -transfer, for nodes on one host
+#   inproc  inproc://node<id>-pub and -transfer, for nodes in one process
+#           sharing a zmq.Context
+#
+# Members can join and leave at runtime. The file is re-read when it changes
+# (only the entries that changed in it are applied), and NodeCommunicator
+# exchanges MEMBERSHIP join and leave announcements with the other nodes.
+# Listeners registered with on_change see every join and leave.
+
+TRANSPORTS = ('tcp', 'ipc', 'inproc')
+IPC_DIR = '/tmp/ha-ipc'
+
+
+def node_name(node_id):
+    return f"node{node_id}"
+
+
+def node_id_of(name):
+    return name[len('node'):] if name.startswith('node') else name
+
+
+def cluster_node_ids():
+    return [node_id for node_id in os.environ.get('CLUSTER_NODES', '1,2,3').split(',') if node_id]
+
+
+def observer_node_ids():
+    return [node_id for node_id in os.environ.get('OBSERVER_NODES', '').split(',') if node_id]
+
+
+def node_host(node_id):
+    host = os.environ.get(f"NODE_HOST_{node_id}")
+    return host or os.environ.get('NODE_HOST_TEMPLATE', 'node{id}').format(id=node_id)
+
+
+def publish_port(node_id):
+    return int(os.environ.get('PUB_PORT_BASE', '5550')) + int(node_id)
+
+
+def transfer_port(node_id):
+    return int(os.environ.get('TRANSFER_PORT_BASE', '6660')) + int(node_id)
+
+
+def _transport():
+    transport = os.environ.get('MESSAGE_TRANSPORT', 'tcp')
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown MESSAGE_TRANSPORT {transport!r}, expected one of {TRANSPORTS}")
+    return transport
+
+
+def _endpoint(node_id, suffix, port, host=None):
+    transport = _transport()
+    if transport == 'ipc':
+        return f"ipc://{os.environ.get('IPC_DIR', IPC_DIR)}/node{node_id}-{suffix}"
+    if transport == 'inproc':
+        return f"inproc://node{node_id}-{suffix}"
+    return f"tcp://{host or node_host(node_id)}:{port}"
+
+
+def publish_endpoint(node_id, host=None):
+    return _endpoint(node_id, 'pub', publish_port(node_id), host)
+
+
+def transfer_endpoint(node_id, host=None):
+    return _endpoint(node_id, 'transfer', transfer_port(node_id), host)
+
+
+def bind_endpoint(endpoint):
+    """Address to bind so others can connect to `endpoint`: every interface for TCP"""
+    if endpoint.startswith('tcp://'):
+        return f"tcp://*:{endpoint.rsplit(':', 1)[1]}"
+    if endpoint.startswith('ipc://'):
+        os.makedirs(os.path.dirname(endpoint[len('ipc://'):]), exist_ok=True)
+    return endpoint
+
+
+def make_member(node_id, publish=None, transfer=None, host=None, observer=False):
+    node_id = str(node_id)
+    return {
+        'id': node_id,
+        'publish': publish or publish_endpoint(node_id, host),
+        'transfer': transfer or transfer_endpoint(node_id, host),
+        'observer': bool(observer)
+    }
+
+
+def load_members(path):
+    with open(path) as f:
+        entries = json.load(f)
+    return [make_member(entry['id'], entry.get('publish'), entry.get('transfer'), entry.get('host'),
+                        entry.get('observer', False)) for entry in entries]
+
+
+class Membership:
+    """The nodes this node talks to, kept current as they join and leave"""
+
+    def __init__(self, node_id, members=(), path=None):
+        self.node_id = str(node_id)
+        self.path = path
+        self.members = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        # Entries the file held when last read, and its modification time then
+        self.file_members = {}
+        self.file_mtime = None
+        for member in members:
+            self.members[member['id']] = member
+        if path:
+            self.reload()
+        # A node that is not listed (a tool with explicit peers) still needs its own endpoints
+        self.listed = self.node_id in self.members
+        if not self.listed:
+            self.members[self.node_id] = make_member(self.node_id)
+
+    def on_change(self, listener):
+        """Call listener(event, member) with 'join' or 'leave' for every change"""
+        self.listeners.append(listener)
+
+    def _notify(self, changes):
+        for event, member in changes:
+            for listener in self.listeners:
+                try:
+                    listener(event, member)
+                except Exception as e:
+                    print(f"Error in membership listener: {e}")
+
+    def add(self, member):
+        """Add or update a member; True if anything changed"""
+        changes = []
+        with self.lock:
+            current = self.members.get(member['id'])
+            if current == member:
+                return False
+            if current is not None:
+                # Moved endpoints: the old ones are left before the new ones are joined
+                changes.append(('leave', current))
+            self.members[member['id']] = member
+            changes.append(('join', member))
+        self._notify(changes)
+        return True
+
+    def remove(self, node_id):
+        """Remove a member (never this node); True if it was one"""
+        node_id = str(node_id)
+        if node_id == self.node_id:
+            return False
+        with self.lock:
+            member = self.members.pop(node_id, None)
+        if member is None:
+            return False
+        self._notify([('leave', member)])
+        return True
+
+    def get(self, node_id):
+        with self.lock:
+            return self.members.get(str(node_id))
+
+    def local(self):
+        return self.get(self.node_id)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.members.values())
+
+    def peers(self):
+        """Names of the other cluster nodes, in the order they became members"""
+        with self.lock:
+            return [node_name(node_id) for node_id, member in self.members.items()
+                    if node_id != self.node_id and not member['observer']]
+
+    def observers(self):
+        with self.lock:
+            return [node_name(node_id) for node_id, member in self.members.items()
+                    if node_id != self.node_id and member['observer']]
+
+    def publish_endpoint(self, node_id):
+        member = self.get(node_id)
+        return member['publish'] if member else publish_endpoint(node_id)
+
+    def transfer_endpoint(self, node_id):
+        member = self.get(node_id)
+        return member['transfer'] if member else transfer_endpoint(node_id)
+
+    def reload(self):
+        """Apply the entries added to, changed in or removed from the file since it was last read"""
+        if not self.path:
+            return []
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.file_mtime:
+                return []
+            entries = {member['id']: member for member in load_members(self.path)}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading membership file {self.path}: {e}")
+            return []
+        previous, self.file_members, self.file_mtime = self.file_members, entries, mtime
+        added = [member for node_id, member in entries.items() if previous.get(node_id) != member]
+        for member in added:
+            self.add(member)
+        for node_id in previous:
+            if node_id not in entries:
+                self.remove(node_id)
+        return added
+
+
+def load_membership(node_id, peers=None, observers=None):
+    """Membership from explicit peer names, else MEMBERSHIP_FILE, else CLUSTER_NODES/OBSERVER_NODES"""
+    if observers is None:
+        observers = [node_name(i) for i in observer_node_ids()]
+    path = None
+    if peers is not None:
+        members = [make_member(node_id_of(name)) for name in peers]
+    elif os.environ.get('MEMBERSHIP_FILE'):
+        members, path = [], os.environ['MEMBERSHIP_FILE']
+    else:
+        members = [make_member(i) for i in cluster_node_ids()]
+    listed = {member['id'] for member in members} | {str(node_id)}
+    members += [make_member(node_id_of(name), observer=True) for name in observers
+                if node_id_of(name) not in listed]
+    return Membership(node_id, members, path)
@@ -1 +1,374 @@
- 
\ No newline at end of file
+import os
+import json
+import time
+import threading
+import argparse
+from collections import deque
+import numpy as np
+import psutil
+from numpy_model import NumpyModel
+
+# Streaming fault detector.
+#
+# Runs inside the recovery manager. Every tick it turns the ResourceSampler's
+# readings into one feature vector per supervised process plus one for the
+# node itself, appends them to preallocated ring buffers, and scores every
+# full window with a single batched model call. A PID whose fault probability
+# stays above the threshold for `consecutive` scored ticks is handed to the
+# recovery manager's handle_preventive_migration on a background thread.
+#
+# The model sees WINDOW timesteps of FEATURES, each divided by FEATURE_SCALE,
+# SAMPLE_INTERVAL seconds apart: Telegraf collects every 10s and
+# training_data.py exports on that grid, so the detector ticks at the same
+# interval and never stretches it. The interval a model was trained at is
+# recorded next to it (<model>.json) and overrides the default.
+
+MODEL_PATH = '/app/my_model.keras'
+WINDOW = 24
+FEATURES = ('proc_cpu', 'proc_mem', 'proc_threads', 'proc_ctx_rate',
+            'node_cpu', 'node_mem', 'node_swap', 'node_load')
+FEATURE_SCALE = np.array([100.0, 100.0, 64.0, 1000.0, 100.0, 100.0, 100.0, 1.0], dtype=np.float32)
+FEATURE_CLIP = 4.0
+NODE_KEY = 'node'
+
+SAMPLE_INTERVAL = 10.0
+THRESHOLD = 0.8
+CONSECUTIVE_TICKS = 3
+MIGRATION_COOLDOWN = 60.0
+MAX_SLOTS = 64
+
+# Per-tick budgets; while over either one the detector still records every
+# row but scores only every `score_every` ticks, so rows stay SAMPLE_INTERVAL apart
+TICK_BUDGET = 0.1
+CPU_BUDGET = 0.05
+MAX_SCORE_EVERY = 8
+
+
+class FeatureWindows:
+    """Sliding windows for up to `capacity` keys in one preallocated ring buffer.
+
+    Each sample is written twice, at head and head + window, so the latest
+    window of a key is always the contiguous slice [head + 1, head + 1 + window)
+    and reading it needs no reordering.
+    """
+
+    def __init__(self, capacity, window, features):
+        self.window = window
+        self.buffer = np.zeros((capacity, 2 * window, features), dtype=np.float32)
+        self.heads = np.full(capacity, window - 1, dtype=np.int64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.slots = {}
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def push(self, key, values):
+        """Append one sample; returns False when every slot is taken"""
+        slot = self.slots.get(key)
+        if slot is None:
+            if not self.free:
+                return False
+            slot = self.slots[key] = self.free.pop()
+            self.heads[slot] = self.window - 1
+            self.counts[slot] = 0
+        head = (self.heads[slot] + 1) % self.window
+        self.buffer[slot, head] = values
+        self.buffer[slot, head + self.window] = values
+        self.heads[slot] = head
+        self.counts[slot] += 1
+        return True
+
+    def window_of(self, slot):
+        start = self.heads[slot] + 1
+        return self.buffer[slot, start:start + self.window]
+
+    def latest(self, key):
+        slot = self.slots[key]
+        return self.buffer[slot, self.heads[slot]]
+
+    def ready(self):
+        """(key, slot) for every key with a full window"""
+        return [(key, slot) for key, slot in self.slots.items() if self.counts[slot] >= self.window]
+
+    def release(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.free.append(slot)
+
+    def keys(self):
+        return list(self.slots)
+
+
+def load_model(path, engine=None):
+    """Load the model once and return predict(batch) -> fault probabilities.
+
+    The NumPy engine is used by default, reading an exported .npz next to the
+    .keras file when there is one; TensorFlow is only imported when asked for
+    or when the NumPy engine cannot run the model.
+    """
+    engine = engine or os.environ.get('ML_ENGINE', 'numpy')
+    if engine == 'numpy':
+        exported = os.path.splitext(path)[0] + '.npz'
+        try:
+            model = NumpyModel.load(exported if os.path.exists(exported) else path)
+        except (ImportError, ValueError, KeyError) as e:
+            print(f"NumPy engine cannot load {path} ({e}), falling back to TensorFlow")
+        else:
+            return lambda batch: model(batch).reshape(-1)
+    return _load_tensorflow_model(path)
+
+
+def _load_tensorflow_model(path):
+    import tensorflow as tf
+
+    # One thread each keeps inference from competing with the services it watches
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = tf.keras.models.load_model(path, compile=False)
+
+    def predict(batch):
+        # Calling the model directly avoids predict()'s per-call dataset setup
+        return np.asarray(model(batch, training=False)).reshape(-1)
+    return predict
+
+
+def classify_fault(features):
+    """Name the resource most likely behind a predicted fault from the latest feature row"""
+    proc_cpu, proc_mem = features[0], features[1]
+    node_mem, node_swap = features[5], features[6]
+    if proc_mem >= proc_cpu or node_mem > 0.9 or node_swap > 0.5:
+        return 'memory'
+    return 'cpu'
+
+
+class FaultDetector:
+    """Scores every supervised process each tick and migrates the ones predicted to fail"""
+
+    def __init__(self, manager, predict, interval=SAMPLE_INTERVAL, threshold=THRESHOLD,
+                 consecutive=CONSECUTIVE_TICKS, cooldown=MIGRATION_COOLDOWN, capacity=MAX_SLOTS):
+        self.manager = manager
+        self.predict = predict
+        self.interval = interval
+        self.score_every = 1
+        self.threshold = threshold
+        self.consecutive = consecutive
+        self.cooldown = cooldown
+        self.windows = FeatureWindows(capacity, WINDOW, len(FEATURES))
+        self.batch = np.zeros((capacity, WINDOW, len(FEATURES)), dtype=np.float32)
+        self.row = np.zeros(len(FEATURES), dtype=np.float32)
+        self.prev_ctx = {}
+        self.streaks = {}
+        self.cooldowns = {}
+        self.migrating = set()
+        self.scores = {}
+        self.lock = threading.Lock()
+        self.tick_times = deque(maxlen=100)
+        self.ticks = 0
+        self.cpu_fraction = 0.0
+        self.running = False
+        self.detector_thread = None
+        psutil.cpu_percent(None)
+
+    def start(self):
+        self.running = True
+        self.detector_thread = threading.Thread(target=self._run, name='fault-detector')
+        self.detector_thread.daemon = True
+        self.detector_thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            started = time.perf_counter()
+            cpu_started = time.thread_time()
+            scored = False
+            try:
+                scored = self.tick()
+            except Exception as e:
+                print(f"Error in fault detector: {e}")
+            if scored:
+                self._account(time.perf_counter() - started, time.thread_time() - cpu_started)
+
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    def _account(self, elapsed, cpu):
+        self.tick_times.append(elapsed)
+        self.cpu_fraction = cpu / (self.interval * self.score_every)
+        if elapsed > TICK_BUDGET or self.cpu_fraction > CPU_BUDGET:
+            if self.score_every < MAX_SCORE_EVERY:
+                self.score_every *= 2
+                print(f"Fault detector over budget (tick {elapsed * 1000:.1f}ms, "
+                      f"CPU {self.cpu_fraction:.1%}), scoring every {self.score_every} ticks")
+        elif self.score_every > 1 and elapsed < TICK_BUDGET / 2 and self.cpu_fraction < CPU_BUDGET / 2:
+            self.score_every //= 2
+
+    def _is_service(self, pid):
+        # Standby workers and undeclared processes are not migrated
+        handle = self.manager.registry.get(pid)
+        return handle is not None and handle.name in self.manager.services
+
+    def _push(self, key, proc_cpu, proc_mem, threads, ctx_rate, node):
+        row = self.row
+        row[0], row[1], row[2], row[3] = proc_cpu, proc_mem, threads, ctx_rate
+        row[4:] = node
+        np.divide(row, FEATURE_SCALE, out=row)
+        np.clip(row, 0.0, FEATURE_CLIP, out=row)
+        self.windows.push(key, row)
+
+    def tick(self):
+        """Record one row per key and score the full windows; returns whether it scored"""
+        now = time.monotonic()
+        node = (psutil.cpu_percent(None), psutil.virtual_memory().percent,
+                psutil.swap_memory().percent, os.getloadavg()[0] / (os.cpu_count() or 1))
+        usage = {pid: stats for pid, stats in self.manager.sampler.snapshot().items() if self._is_service(pid)}
+
+        # Processes that are gone free their window
+        for key in self.windows.keys():
+            if key != NODE_KEY and key not in usage:
+                self.windows.release(key)
+                self.prev_ctx.pop(key, None)
+                self.streaks.pop(key, None)
+
+        totals = [0.0, 0.0, 0.0, 0.0]
+        for pid, stats in usage.items():
+            previous = self.prev_ctx.get(pid)
+            ctx_rate = 0.0
+            if previous and stats['updated'] > previous[1]:
+                ctx_rate = (stats['ctx_switches'] - previous[0]) / (stats['updated'] - previous[1])
+            self.prev_ctx[pid] = (stats['ctx_switches'], stats['updated'])
+            self._push(pid, stats['cpu'], stats['mem'], stats['threads'], ctx_rate, node)
+            for i, value in enumerate((stats['cpu'], stats['mem'], stats['threads'], ctx_rate)):
+                totals[i] += value
+        self._push(NODE_KEY, *totals, node)
+        self.ticks += 1
+
+        ready = self.windows.ready()
+        if not ready or self.ticks % self.score_every:
+            return False
+        for i, (_, slot) in enumerate(ready):
+            self.batch[i] = self.windows.window_of(slot)
+        probabilities = self.predict(self.batch[:len(ready)])
+
+        self.scores = {key: float(p) for (key, _), p in zip(ready, probabilities)}
+        for key, probability in self.scores.items():
+            self._evaluate(key, probability, now)
+        return True
+
+    def _evaluate(self, key, probability, now):
+        if probability < self.threshold:
+            self.streaks.pop(key, None)
+            return
+        streak = self.streaks[key] = self.streaks.get(key, 0) + 1
+        if streak < self.consecutive:
+            return
+
+        if key == NODE_KEY:
+            if streak == self.consecutive:
+                print(f"Node fault predicted (p={probability:.4f})")
+                self.manager.communicator.broadcast_message('FAULT', {
+                    'action': 'fault_predicted',
+                    'scope': 'node',
+                    'prediction': probability
+                })
+            return
+
+        with self.lock:
+            if key in self.migrating or self.cooldowns.get(key, 0) > now:
+                return
+            self.migrating.add(key)
+        fault_type = classify_fault(self.windows.latest(key))
+        migration = threading.Thread(target=self._migrate, args=(key, probability, fault_type))
+        migration.daemon = True
+        migration.start()
+
+    def _migrate(self, pid, probability, fault_type):
+        try:
+            self.manager.handle_preventive_migration(pid, probability, fault_type)
+        finally:
+            with self.lock:
+                self.migrating.discard(pid)
+                self.cooldowns[pid] = time.monotonic() + self.cooldown
+            self.streaks.pop(pid, None)
+
+    def stats(self):
+        times = sorted(self.tick_times)
+        return {
+            'ticks': self.ticks,
+            'interval': self.interval,
+            'score_every': self.score_every,
+            'tracked': len(self.windows.slots),
+            'tick_ms_p50': times[len(times) // 2] * 1000 if times else 0.0,
+            'tick_ms_max': times[-1] * 1000 if times else 0.0,
+            'cpu_fraction': self.cpu_fraction,
+            'migrating': len(self.migrating)
+        }
+
+    def stop(self):
+        self.running = False
+        if self.detector_thread:
+            self.detector_thread.join(timeout=self.interval * 2)
+
+
+def model_info_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def load_model_info(path):
+    """The training manifest's window, features and interval saved next to a model, or {}"""
+    try:
+        with open(model_info_path(path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def create_fault_detector(manager):
+    """Start a detector for the recovery manager, or return None if no model can be loaded"""
+    if os.environ.get('FAULT_DETECTOR', '1') == '0':
+        return None
+    path = os.environ.get('ML_MODEL_PATH', MODEL_PATH)
+    if not os.path.exists(path):
+        print(f"No fault prediction model at {path}, fault prediction disabled")
+        return None
+    info = load_model_info(path)
+    if info.get('window', WINDOW) != WINDOW or tuple(info.get('features', FEATURES)) != FEATURES:
+        print(f"Fault prediction model {path} was trained on other features, fault prediction disabled")
+        return None
+    try:
+        predict = load_model(path)
+    except Exception as e:
+        print(f"Could not load fault prediction model {path}: {e}")
+        return None
+
+    # Windows must be sampled at the interval the model was trained on
+    interval = float(info.get('interval', SAMPLE_INTERVAL))
+    detector = FaultDetector(manager, predict, interval=interval,
+                             threshold=float(os.environ.get('FAULT_THRESHOLD', str(THRESHOLD))))
+    detector.start()
+    print(f"Fault detector running with model {path}, sampling every {interval:.0f}s")
+    return detector
+
+
+if __name__ == "__main__":
+    # The detector runs inside the recovery manager; this measures inference cost
+    parser = argparse.ArgumentParser(description='Fault detector inference benchmark')
+    parser.add_argument('--model', type=str, default=os.environ.get('ML_MODEL_PATH', MODEL_PATH))
+    parser.add_argument('--engine', choices=('numpy', 'tensorflow'), default=None)
+    parser.add_argument('--rows', type=int, default=16, help='Windows scored per call')
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    predict = load_model(args.model, args.engine)
+    batch = np.random.default_rng(0).random((args.rows, WINDOW, len(FEATURES)), dtype=np.float32)
+    predict(batch)
+
+    times = []
+    for _ in range(args.calls):
+        started = time.perf_counter()
+        predict(batch)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    print(f"{args.rows} windows per call: p50 {times[len(times) // 2] * 1000:.2f}ms, "
+          f"p99 {times[int(len(times) * 0.99)] * 1000:.2f}ms")
@@ -0,0 +1,224 @@
+import os
+import io
+import json
+import time
+import zipfile
+import argparse
+import re
+import numpy as np
+
+# Pure-NumPy inference for the fault prediction model.
+#
+# The Keras model is a small LSTM -> Dense stack, so scoring it needs a few
+# matrix products per timestep, not TensorFlow. export() turns my_model.keras
+# into an .npz holding the layer list and weights, optionally stored as
+# float16 or as int8 with one float32 scale per output column. Stored weights
+# are widened back to float32 when loaded: the quantized formats shrink the
+# file, while the arithmetic stays in BLAS-backed float32.
+#
+# Reading a .keras file needs h5py; loading an exported .npz needs only NumPy.
+
+PRECISIONS = ('float32', 'float16', 'int8')
+SUPPORTED_LAYERS = ('InputLayer', 'LSTM', 'Dense', 'Dropout')
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0, out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'sigmoid': lambda x: _sigmoid(x, x)
+}
+
+
+def _sigmoid(x, out):
+    # 0.5 * (1 + tanh(x / 2)) is the logistic function without exp overflow
+    np.multiply(x, 0.5, out=out)
+    np.tanh(out, out=out)
+    out += 1.0
+    out *= 0.5
+    return out
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def read_keras(path):
+    """Return (layers, weights) from a Keras 3 .keras archive.
+
+    `layers` is a list of {'type', 'units', 'activation', ...} dicts in model
+    order and `weights` a list of per-layer arrays.
+    """
+    import h5py
+
+    with zipfile.ZipFile(path) as archive:
+        config = json.loads(archive.read('config.json'))
+        weights_file = io.BytesIO(archive.read('model.weights.h5'))
+
+    layers = []
+    for layer in config['config']['layers']:
+        kind = layer['class_name']
+        if kind not in SUPPORTED_LAYERS:
+            raise ValueError(f"Layer type {kind} is not supported by the NumPy engine")
+        settings = layer['config']
+        if kind == 'InputLayer':
+            continue
+        if kind == 'LSTM' and (settings.get('return_sequences') or settings.get('go_backwards')
+                               or settings.get('activation') != 'tanh'
+                               or settings.get('recurrent_activation') != 'sigmoid'):
+            raise ValueError(f"LSTM configuration of {settings['name']} is not supported by the NumPy engine")
+        layers.append({'type': kind, 'units': settings.get('units'), 'activation': settings.get('activation')})
+
+    # Weight groups are named after the layer class in creation order (dense, dense_1, ...)
+    weights = []
+    with h5py.File(weights_file, 'r') as f:
+        groups = {}
+        for name in sorted(f['layers'], key=_natural_key):
+            prefix = re.sub(r'_\d+$', '', name)
+            groups.setdefault(prefix, []).append(f['layers'][name])
+        for layer in layers:
+            if layer['type'] == 'Dropout':
+                weights.append([])
+                continue
+            group = groups[layer['type'].lower()].pop(0)
+            variables = group['cell']['vars'] if layer['type'] == 'LSTM' else group['vars']
+            weights.append([np.asarray(variables[str(i)], dtype=np.float32) for i in range(len(variables))])
+    return layers, weights
+
+
+def _quantize(array, precision):
+    if precision == 'float16':
+        return {'': array.astype(np.float16)}
+    if precision == 'int8' and array.ndim == 2:
+        scale = np.abs(array).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        return {'.q': np.round(array / scale).astype(np.int8), '.scale': scale.astype(np.float32)}
+    # Biases are tiny; int8 models keep them in float32
+    return {'': array}
+
+
+def export(keras_path, npz_path, precision='float32'):
+    """Convert a .keras model to the NumPy engine's .npz format"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    layers, weights = read_keras(keras_path)
+    arrays = {'config': np.frombuffer(json.dumps({'layers': layers, 'precision': precision}).encode(), dtype=np.uint8)}
+    for i, layer_weights in enumerate(weights):
+        for j, array in enumerate(layer_weights):
+            for suffix, stored in _quantize(array, precision).items():
+                arrays[f"{i}.{j}{suffix}"] = stored
+    np.savez_compressed(npz_path, **arrays)
+    return npz_path
+
+
+def _load_npz(path):
+    with np.load(path, allow_pickle=False) as data:
+        config = json.loads(data['config'].tobytes())
+        weights = []
+        for i in range(len(config['layers'])):
+            layer_weights = []
+            j = 0
+            while True:
+                key = f"{i}.{j}"
+                if key in data:
+                    layer_weights.append(data[key].astype(np.float32))
+                elif f"{key}.q" in data:
+                    layer_weights.append(data[f"{key}.q"].astype(np.float32) * data[f"{key}.scale"])
+                else:
+                    break
+                j += 1
+            weights.append(layer_weights)
+    return config['layers'], weights
+
+
+class NumpyModel:
+    """Forward pass of an LSTM/Dense stack on float32 NumPy arrays"""
+
+    def __init__(self, layers, weights):
+        self.layers = []
+        for layer, layer_weights in zip(layers, weights):
+            if layer['type'] == 'Dropout':
+                continue
+            if layer['type'] == 'LSTM':
+                layer_weights = [self._sigmoid_gates_first(w) for w in layer_weights]
+            self.layers.append((layer, [np.ascontiguousarray(w, dtype=np.float32) for w in layer_weights]))
+
+    @staticmethod
+    def _sigmoid_gates_first(w):
+        # Keras orders gates input, forget, cell, output; moving the cell gate
+        # last lets one sigmoid call cover the other three
+        i, f, c, o = np.split(w, 4, axis=-1)
+        return np.concatenate([i, f, o, c], axis=-1)
+
+    @classmethod
+    def load(cls, path):
+        """Load an exported .npz, or read a .keras file directly"""
+        if path.endswith('.keras'):
+            return cls(*read_keras(path))
+        return cls(*_load_npz(path))
+
+    def _lstm(self, x, kernel, recurrent, bias):
+        batch, steps, _ = x.shape
+        units = recurrent.shape[0]
+
+        # Input projections for every timestep in one product
+        projected = (x.reshape(batch * steps, -1) @ kernel).reshape(batch, steps, 4 * units)
+        projected += bias
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        z = np.empty((batch, 4 * units), dtype=np.float32)
+        sigmoid_gates = z[:, :3 * units]
+        input_gate, forget_gate, output_gate = (z[:, k * units:(k + 1) * units] for k in range(3))
+        candidate = z[:, 3 * units:]
+
+        for t in range(steps):
+            np.matmul(h, recurrent, out=z)
+            z += projected[:, t]
+            _sigmoid(sigmoid_gates, sigmoid_gates)
+            np.tanh(candidate, out=candidate)
+            c *= forget_gate
+            candidate *= input_gate
+            c += candidate
+            np.tanh(c, out=h)
+            h *= output_gate
+        return h
+
+    def __call__(self, batch):
+        x = np.asarray(batch, dtype=np.float32)
+        for layer, weights in self.layers:
+            if layer['type'] == 'LSTM':
+                x = self._lstm(x, *weights)
+            else:
+                x = x @ weights[0]
+                if len(weights) > 1:
+                    x += weights[1]
+                x = ACTIVATIONS[layer['activation'] or 'linear'](x)
+        return x
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NumPy inference engine for the fault prediction model')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Convert a .keras model to .npz')
+    export_parser.add_argument('keras_path')
+    export_parser.add_argument('npz_path')
+    export_parser.add_argument('--precision', choices=PRECISIONS, default='float32')
+    check_parser = subparsers.add_parser('check', help='Compare an exported model with the .keras original')
+    check_parser.add_argument('keras_path')
+    check_parser.add_argument('npz_path')
+    check_parser.add_argument('--rows', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args.keras_path, args.npz_path, args.precision)
+        print(f"Exported {args.keras_path} to {args.npz_path} ({args.precision}, "
+              f"{os.path.getsize(args.npz_path)} bytes)")
+    else:
+        reference = NumpyModel.load(args.keras_path)
+        model = NumpyModel.load(args.npz_path)
+        batch = np.random.default_rng(0).random((args.rows, 24, 8), dtype=np.float32)
+        error = np.abs(model(batch) - reference(batch)).max()
+        started = time.perf_counter()
+        for _ in range(100):
+            model(batch)
+        elapsed = (time.perf_counter() - started) / 100
+        print(f"Max difference from the .keras weights: {error:.6f}, "
+              f"{args.rows} windows in {elapsed * 1000:.3f}ms")
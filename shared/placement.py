@@ -0,0 +1,90 @@
+import time
+import random
+import threading
+
+# Load-aware placement.
+#
+# Every node periodically broadcasts a small LOAD summary; peers keep the
+# latest summary per node in a LoadTable and drop it once it is older than the
+# TTL. A PlacementPolicy orders the live candidates so migrations spread out
+# instead of always landing on the first peer.
+
+LOAD_REPORT_INTERVAL = 2.0
+LOAD_TTL = 3 * LOAD_REPORT_INTERVAL
+
+# Each in-flight migration counts as this many points of extra load on a node
+MIGRATION_PENALTY = 15.0
+SERVICE_PENALTY = 2.0
+
+
+def load_score(summary):
+    """Lower is better"""
+    return (max(summary.get('cpu', 0.0), summary.get('mem', 0.0))
+            + SERVICE_PENALTY * summary.get('services', 0)
+            + MIGRATION_PENALTY * summary.get('migrations', 0))
+
+
+class LoadTable:
+    """Latest load summary per node, expiring entries older than the TTL"""
+
+    def __init__(self, ttl=LOAD_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def update(self, node, summary):
+        with self.lock:
+            self.entries[node] = (summary, time.monotonic())
+
+    def remove(self, node):
+        with self.lock:
+            self.entries.pop(node, None)
+
+    def get(self, node):
+        return self.live().get(node)
+
+    def live(self):
+        cutoff = time.monotonic() - self.ttl
+        with self.lock:
+            for node in [node for node, (_, received) in self.entries.items() if received < cutoff]:
+                del self.entries[node]
+            return {node: summary for node, (summary, _) in self.entries.items()}
+
+
+class LeastLoadedPolicy:
+    """Order candidates by load score"""
+
+    def order(self, candidates):
+        return sorted(candidates, key=lambda node: load_score(candidates[node]))
+
+
+class PowerOfTwoChoicesPolicy:
+    """Pick the better of two random candidates.
+
+    Avoids every node herding onto the same least-loaded peer when they all
+    act on the same gossip round.
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+
+    def order(self, candidates):
+        ranked = sorted(candidates, key=lambda node: load_score(candidates[node]))
+        if len(ranked) < 2:
+            return ranked
+        first, second = self.rng.sample(ranked, 2)
+        choice = min(first, second, key=lambda node: load_score(candidates[node]))
+        return [choice] + [node for node in ranked if node != choice]
+
+
+PLACEMENT_POLICIES = {
+    'least_loaded': LeastLoadedPolicy,
+    'power_of_two': PowerOfTwoChoicesPolicy
+}
+
+
+def get_placement_policy(name):
+    try:
+        return PLACEMENT_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown placement policy {name!r}, expected one of {sorted(PLACEMENT_POLICIES)}")
@@ -1,42 +1,112 @@
 import os
-import subprocess
 import psutil
 import zmq
 import json
 import tarfile
-import io
-import base64
+import signal
 import shutil
-from comm import NodeCommunicator
+from comm import NodeCommunicator, node_name, node_id_of, bind_endpoint
+from transfer import CheckpointSender, CheckpointReceiver, TransferServer
+from checkpoint_store import CheckpointStore
+from registry import ServiceRegistry
+from sampler import ResourceSampler
+from services import load_service_policies
+from standby import StandbyPool
+from ml_fault_detector import create_fault_detector
+from placement import LoadTable, get_placement_policy, LOAD_REPORT_INTERVAL
+from tracing import create_tracer, span, record, annotate
+from simulate_faults import create_fault_agent
+from admission import create_admission_controller, new_reservation_id
+from journal import journal_path
 import time
 import threading
 import argparse
 
+SERVICE_NAME = 'dummy_service'
+# How long a checkpoint waits for a service to flush its state file
+STATE_FLUSH_TIMEOUT = 0.5
+# Readings needed before the smoothed values are trusted for a migration decision
+MIN_SAMPLES = 3
+
 class RecoveryManager:
     def __init__(self):
         self.node_id = os.environ.get('NODE_ID', '1')
         self.communicator = NodeCommunicator(self.node_id)
         self.context = zmq.Context()
         
-        # Socket for direct file transfers
-        self.transfer_socket = self.context.socket(zmq.REP)
-        self.transfer_socket.bind(f"tcp://*:666{self.node_id}")
+        # Declared services and their policies (SERVICES_CONFIG)
+        self.services = load_service_policies()
+        
+        # Held while a service's instances are counted and replaced, so a crash
+        # that both the exit callback and the monitor notice is replaced once
+        self.restart_locks = {name: threading.Lock() for name in self.services}
+        
+        # Supervised services; exits are reported as they happen
+        self.registry = ServiceRegistry(self.node_id)
+        self.registry.on_exit(self._on_service_exit)
+        
+        # Warm workers that restores and restarts hand over to instead of cold-starting
+        self.standby = StandbyPool(self.registry, self.services)
+        self.standby.fill()
+        
+        # Background sampler for all supervised PIDs
+        self.sampler = ResourceSampler(self.registry.pids,
+                                       interval=float(os.environ.get('SAMPLE_INTERVAL', '0.25')))
+        self.sampler.start()
+        self.monitor_interval = float(os.environ.get('MONITOR_INTERVAL', '0.5'))
+        
+        # Direct file transfers, received concurrently by a pool of workers
+        self.spool_dir = f"/tmp/checkpoint_spool_{self.node_id}"
+        # Received checkpoints live apart from local ones, so nodes can share a host
+        self.receive_dir = f"/tmp/received_checkpoints_{self.node_id}"
+        self.store = CheckpointStore(f"/tmp/checkpoint_store_{self.node_id}")
+        self.sender = CheckpointSender(self.context)
+        # Gates outgoing migrations and grants reservations for incoming ones
+        self.admission = create_admission_controller(self.node_id)
+        self.last_load = {}
+        self.transfer_server = TransferServer(
+            self.context, bind_endpoint(self.communicator.membership.transfer_endpoint(self.node_id)),
+            self._make_receiver, self._on_checkpoint_received,
+            workers=int(os.environ.get('RECEIVE_WORKERS', '4')),
+            max_active=int(os.environ.get('MAX_INBOUND_TRANSFERS', '4')),
+            on_reserve=self._on_reserve, on_release=self.admission.release)
+        
+        # Gossiped load of the other nodes, used to choose migration targets
+        self.load_table = LoadTable()
+        self.placement_policy = get_placement_policy(os.environ.get('PLACEMENT_POLICY', 'least_loaded'))
+        self.inflight_migrations = 0
+        self.migration_lock = threading.Lock()
+        self.communicator.register_callback('LOAD', self._on_load_report)
+        self.communicator.register_callback('FAULT', self._on_fault)
+        # Services each peer last reported running, restarted here if the peer dies
+        self.peer_services = {}
+        self.communicator.register_callback('NODE_DOWN', self._on_node_down)
         
-        # Start transfer listener thread
-        self.transfer_thread = threading.Thread(target=self._handle_transfers)
-        self.transfer_thread.daemon = True
-        self.transfer_thread.start()
+        # Per-stage migration timings, combined with the spans peers report
+        self.tracer = create_tracer(self.node_id, self.communicator)
+        self.load_thread = threading.Thread(target=self._publish_load)
+        self.load_thread.daemon = True
+        self.load_thread.start()
         
-    def simulate_checkpoint(self, pid):
+        # Streaming fault prediction; acts through handle_preventive_migration
+        self.fault_detector = create_fault_detector(self)
+        # Injects faults on request from a campaign (campaign.py) when FAULT_INJECTION=1
+        self.fault_agent = create_fault_agent(self.node_id, self.communicator, on_migrate=self._start_migration)
+        
+    def simulate_checkpoint(self, pid, trace=None):
         """Simulate creating a checkpoint of the process (no CRIU)"""
+        started = time.monotonic()
+        paused = False
         try:
             checkpoint_dir = f"/tmp/checkpoint_{self.node_id}_{pid}"
             os.makedirs(checkpoint_dir, exist_ok=True)
             
             # Save process info to the checkpoint
             process = psutil.Process(pid)
+            handle = self.registry.get(pid)
             process_info = {
                 'pid': pid,
+                'service': handle.name if handle else SERVICE_NAME,
                 'node_id': self.node_id,
                 'creation_time': process.create_time(),
                 'cpu_percent': process.cpu_percent(),
@@ -45,47 +115,115 @@ class RecoveryManager:
                 'checkpoint_time': time.time()
             }
             
+            # Carry the service's own state, so the restored instance resumes its work
+            policy = self.services.get(process_info['service'])
+            if policy and policy.state_file:
+                with span(trace, 'state_flush'):
+                    # The service stops itself once flushed, so it does no work the checkpoint misses
+                    paused = True
+                    if self._save_service_state(pid, policy, checkpoint_dir):
+                        process_info['state_file'] = 'service_state.json'
+            
             with open(f"{checkpoint_dir}/process_info.json", 'w') as f:
                 json.dump(process_info, f)
             
-            self.communicator.broadcast_message('RECOVERY', {
+            # Record the checkpoint in the content-addressed store for delta transfers
+            manifest = self.store.put_checkpoint(checkpoint_dir, meta={'pid': pid, 'node_id': self.node_id,
+                                                                       'service': process_info['service']})
+            record(trace, 'checkpoint', started)
+            
+            self.communicator.broadcast_message('RECOVERY', annotate({
                 'action': 'checkpoint_created',
                 'pid': pid,
-                'location': checkpoint_dir
-            })
+                'location': checkpoint_dir,
+                'manifest_id': manifest['id']
+            }, trace))
             
             return checkpoint_dir
         except Exception as e:
             print(f"Error creating checkpoint: {e}")
+            if paused:
+                self.resume_service(pid)
             return None
+    
+    def resume_service(self, pid):
+        """Continue a service paused for a checkpoint that is not going ahead"""
+        try:
+            os.kill(pid, signal.SIGCONT)
+        except ProcessLookupError:
+            pass
             
-    def simulate_restore(self, checkpoint_dir):
+    def _save_service_state(self, pid, policy, checkpoint_dir):
+        """Ask the service to flush its state file and copy it and its journal into the checkpoint"""
+        state_path = policy.state_file.format(pid=pid)
+        try:
+            before = os.stat(state_path).st_mtime_ns if os.path.exists(state_path) else None
+            os.kill(pid, signal.SIGUSR1)
+            deadline = time.monotonic() + STATE_FLUSH_TIMEOUT
+            while time.monotonic() < deadline:
+                if os.path.exists(state_path) and os.stat(state_path).st_mtime_ns != before:
+                    break
+                time.sleep(0.01)
+            shutil.copyfile(state_path, f"{checkpoint_dir}/service_state.json")
+            # Empty after a flush; holds the records since the last snapshot if the flush timed out
+            if os.path.exists(journal_path(state_path)):
+                shutil.copyfile(journal_path(state_path), journal_path(f"{checkpoint_dir}/service_state.json"))
+            return True
+        except OSError as e:
+            print(f"Could not save state of {policy.name} PID {pid}: {e}")
+            return False
+    
+    def simulate_restore(self, checkpoint_dir, trace=None):
         """Simulate restoring a process from checkpoint (no CRIU)"""
+        started = time.monotonic()
         try:
             # Read the process info
             with open(f"{checkpoint_dir}/process_info.json", 'r') as f:
                 process_info = json.load(f)
             
-            # Start a new dummy service process
-            subprocess.Popen(['python3', '/app/shared/dummy_service.py'])
+            # Hand the checkpointed service and its state to a new process
+            state_file = process_info.get('state_file')
+            if state_file:
+                state_file = os.path.join(checkpoint_dir, state_file)
+            with span(trace, 'spawn'):
+                self._spawn_service(process_info.get('service', SERVICE_NAME), process_info.get('cmdline'), state_file)
+            record(trace, 'restore', started)
             
-            self.communicator.broadcast_message('RECOVERY', {
+            self.communicator.broadcast_message('RECOVERY', annotate({
                 'action': 'service_restored',
                 'checkpoint_dir': checkpoint_dir
-            })
+            }, trace))
             
             return True
         except Exception as e:
             print(f"Error restoring service: {e}")
             return False
             
-    def restart_service(self):
-        """Restart the dummy service"""
+    def _spawn_service(self, name, cmdline=None, state_file=None):
+        """Start one instance of a service, falling back to its recorded cmdline if undeclared here"""
+        # A warm standby worker skips interpreter startup and imports
+        pid = self.standby.activate(name, state_file)
+        if pid:
+            return pid
+        
+        policy = self.services.get(name)
+        if policy:
+            cmd = policy.cmd
+            if state_file and policy.state_file:
+                cmd = cmd + ['--restore', state_file]
+            return self.registry.spawn(name, cmd, env=policy.spawn_env())
+        return self.registry.spawn(name, cmdline)
+    
+    def restart_service(self, name=SERVICE_NAME, replaces=None):
+        """Restart a supervised service (`replaces` is the PID of the instance that died)"""
         try:
-            subprocess.Popen(['python3', '/app/shared/dummy_service.py'])
+            pid = self._spawn_service(name, state_file=self._local_state(name, replaces))
             
             self.communicator.broadcast_message('RECOVERY', {
-                'action': 'service_restarted'
+                'action': 'service_restarted',
+                'service': name,
+                'pid': pid,
+                'replaces': replaces
             })
             
             return True
@@ -93,199 +231,461 @@ class RecoveryManager:
             print(f"Error restarting service: {e}")
             return False
     
-    def transfer_checkpoint_to_node(self, checkpoint_dir, target_node):
+    def _local_state(self, name, pid):
+        """The state file a dead instance left on this node, so its replacement replays the journal"""
+        policy = self.services.get(name)
+        if pid is None or not policy or not policy.state_file:
+            return None
+        state_file = policy.state_file.format(pid=pid)
+        return state_file if os.path.exists(state_file) else None
+    
+    def _on_service_exit(self, handle, returncode):
+        """Restart a supervised service the moment it dies unexpectedly"""
+        if self.standby.owns(handle):
+            self.standby.on_exit(handle)
+            return
+        self.admission.forget(handle.pid)
+        if handle.expected_exit or not self.registry.running:
+            return
+        policy = self.services.get(handle.name)
+        if policy and not policy.restart_on_exit:
+            return
+        print(f"Service {handle.name} (PID {handle.pid}) exited with code {returncode}, restarting...")
+        self._report_exit(handle, returncode)
+        self.replace_instances(handle.name, replaces=handle.pid)
+    
+    def replace_instances(self, name, replaces=None):
+        """Start instances of a service until the policy's count are running.
+
+        Both the exit callback and the monitor restart services through here,
+        so whichever comes second finds the count already made up.
+        """
+        policy = self.services.get(name)
+        wanted = policy.instances if policy else 1
+        with self.restart_locks.setdefault(name, threading.Lock()):
+            missing = wanted - len(self.registry.pids(name))
+            if missing > 0 and replaces is None:
+                print(f"Service {name} has {wanted - missing}/{wanted} instances running, starting {missing}")
+            for _ in range(missing):
+                self.restart_service(name, replaces=replaces)
+                replaces = None
+    
+    def _report_exit(self, handle, returncode):
+        self.communicator.broadcast_message('RECOVERY', {
+            'action': 'service_exited',
+            'service': handle.name,
+            'pid': handle.pid,
+            'returncode': returncode
+        })
+    
+    def _on_fault(self, message):
+        """Act on a forced migration requested for a service on this node"""
+        data = message['data']
+        if data.get('type') != 'force_migration' or str(data.get('node_id')) != self.node_id:
+            return
+        pid = data.get('pid')
+        if self.registry.get(pid) is None:
+            print(f"Forced migration of PID {pid} requested, but it is not supervised here")
+            return
+        self._start_migration(pid)
+    
+    def _start_migration(self, pid):
+        handle = self.registry.get(pid)
+        if not self._admit(pid, handle.name if handle else SERVICE_NAME, forced=True):
+            return
+        self._dispatch_migration(pid, forced=True)
+    
+    def _dispatch_migration(self, pid, forced=False):
+        """Run an admitted migration on its own thread.
+
+        Migrations block for the whole transfer, so they are kept off the
+        dispatch workers and the monitor loop, as the fault detector's are.
+        """
+        migration = threading.Thread(target=self.migrate_overloaded_service, args=(pid, forced))
+        migration.daemon = True
+        migration.start()
+    
+    def _adopt_running_services(self):
+        """Take over supervision of services started before the recovery manager"""
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            if 'python' not in proc.info['name']:
+                continue
+            if '--standby' in (proc.info['cmdline'] or []):
+                # Idle workers of an earlier manager are not running the service
+                continue
+            for policy in self.services.values():
+                if policy.script in str(proc.info['cmdline']):
+                    self.registry.adopt(policy.name, proc.info['pid'])
+                    break
+    
+    def transfer_checkpoint_to_node(self, checkpoint_dir, target_node, trace=None, reservation_id=None):
         """Transfer a checkpoint to another node"""
+        archive_path = None
         try:
-            # Create a tarfile of the checkpoint directory
-            tar_buffer = io.BytesIO()
-            with tarfile.open(fileobj=tar_buffer, mode='w:gz') as tar:
-                tar.add(checkpoint_dir, arcname=os.path.basename(checkpoint_dir))
-            
-            # Connect to the target node's transfer socket
-            socket = self.context.socket(zmq.REQ)
-            socket.connect(f"tcp://{target_node}:666{target_node[-1]}")
-            
-            # Send the tarfile
-            tar_data = tar_buffer.getvalue()
-            encoded_data = base64.b64encode(tar_data).decode('utf-8')
-            
-            socket.send_json({
-                'action': 'transfer_checkpoint',
-                'source_node': self.node_id,
-                'checkpoint_name': os.path.basename(checkpoint_dir),
-                'data': encoded_data
-            })
-            
-            # Wait for response
-            response = socket.recv_json()
-            socket.close()
-            
-            self.communicator.broadcast_message('RECOVERY', {
-                'action': 'checkpoint_transferred',
-                'source_node': self.node_id,
-                'target_node': target_node,
-                'checkpoint_dir': checkpoint_dir,
-                'success': response.get('success', False)
-            })
+            endpoint, meta, manifest = self._prepare_transfer(checkpoint_dir, target_node, trace, reservation_id)
+            if manifest:
+                # Only the chunks the target does not already hold are sent
+                with span(trace, 'transfer'):
+                    response = self.sender.send_manifest(endpoint, self.store, manifest, meta)
+            else:
+                # The store no longer has the manifest: gc dropped it once newer
+                # checkpoints of the service were stored, or the store was cleared
+                with span(trace, 'archive'):
+                    archive_path = self._spool_archive(checkpoint_dir)
+                with span(trace, 'transfer'):
+                    response = self.sender.send_file(endpoint, archive_path, meta)
             
-            return response.get('success', False)
+            return self._report_transfer(checkpoint_dir, target_node, response, trace)
         except Exception as e:
             print(f"Error transferring checkpoint: {e}")
             return False
+        finally:
+            if archive_path and os.path.exists(archive_path):
+                os.remove(archive_path)
     
-    def _handle_transfers(self):
-        """Handle incoming checkpoint transfers"""
-        while True:
+    def _prepare_transfer(self, checkpoint_dir, target_node, trace=None, reservation_id=None):
+        """Return (endpoint, offer metadata, manifest or None) for a checkpoint transfer"""
+        endpoint = self.communicator.membership.transfer_endpoint(node_id_of(target_node))
+        checkpoint_name = os.path.basename(checkpoint_dir)
+        meta = {
+            'action': 'transfer_checkpoint',
+            'source_node': self.node_id,
+            'checkpoint_name': checkpoint_name
+        }
+        if trace is not None:
+            # The target records its extract and restore spans under the same trace
+            meta['trace_id'] = trace.trace_id
+            meta['trace_kind'] = trace.kind
+        if reservation_id:
+            # Releases the capacity the target reserved for this migration
+            meta['reservation_id'] = reservation_id
+        return endpoint, meta, self.store.latest_manifest(checkpoint_name)
+    
+    def _spool_archive(self, checkpoint_dir):
+        """Spool the archive to disk so it is streamed rather than buffered.
+
+        The archive is not compressed: its chunks are, on the wire, with a codec
+        chosen for the link to the target (checkpoint_codecs.py).
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        checkpoint_name = os.path.basename(checkpoint_dir)
+        archive_path = os.path.join(self.spool_dir, f"{checkpoint_name}.tar")
+        with tarfile.open(archive_path, mode='w') as tar:
+            tar.add(checkpoint_dir, arcname=checkpoint_name)
+        return archive_path
+    
+    def _report_transfer(self, checkpoint_dir, target_node, response, trace=None):
+        self.communicator.broadcast_message('RECOVERY', annotate({
+            'action': 'checkpoint_transferred',
+            'source_node': self.node_id,
+            'target_node': target_node,
+            'checkpoint_dir': checkpoint_dir,
+            'success': response.get('success', False),
+            'bytes_sent': response.get('bytes_sent', 0),
+            'bytes_raw': response.get('bytes_raw', 0),
+            'codec': response.get('codec')
+        }, trace))
+        
+        if not response.get('success', False):
+            print(f"Checkpoint transfer rejected: {response.get('error')}")
+        return response.get('success', False)
+    
+    def _extract_checkpoint(self, archive_path, offer):
+        """Extract a received checkpoint archive into the receive directory"""
+        checkpoint_dir = os.path.join(self.receive_dir, os.path.basename(offer['checkpoint_name']))
+        with span(self._offer_trace(offer), 'extract'):
+            with tarfile.open(archive_path, mode='r:*') as tar:
+                # The archive comes from the network; refuse links out of the receive directory,
+                # device files and absolute paths
+                tar.extractall(path=self.receive_dir, filter='data')
+        return checkpoint_dir
+    
+    def _materialize_checkpoint(self, manifest, offer):
+        """Rebuild a checkpoint received as a manifest from the local chunk store"""
+        checkpoint_dir = os.path.join(self.receive_dir, os.path.basename(manifest['name']))
+        with span(self._offer_trace(offer), 'extract'):
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            return self.store.materialize(manifest, checkpoint_dir)
+    
+    def _offer_trace(self, offer):
+        """The local part of the migration trace a checkpoint offer belongs to"""
+        return self.tracer.resume(offer.get('trace_id'), offer.get('trace_kind', 'migration'))
+    
+    def _make_receiver(self, socket):
+        """Receiver for one transfer worker"""
+        return CheckpointReceiver(socket, self.spool_dir, self._extract_checkpoint,
+                                  store=self.store, materialize=self._materialize_checkpoint)
+    
+    def _on_checkpoint_received(self, checkpoint_dir, offer):
+        """Restore a received checkpoint; the sender already has its reply"""
+        print(f"Received checkpoint {offer['checkpoint_name']} from node {offer.get('source_node')}")
+        trace = self._offer_trace(offer)
+        self.simulate_restore(checkpoint_dir, trace)
+        self.admission.note_arrival(offer.get('reservation_id'))
+        self.tracer.finish(trace)
+    
+    def _on_reserve(self, request):
+        """Grant a migration target reservation if this node stays under its load limit"""
+        return self.admission.reserve(request, self.last_load, psutil.cpu_count() or 1,
+                                      psutil.virtual_memory().total / (1 << 20))
+    
+    def _reserve_target(self, pid, service, forced=False):
+        """Reserve room for a service on the best-placed node that grants it; (None, None) if none does"""
+        usage = self.sampler.get(pid) or {}
+        request = {
+            'reservation_id': new_reservation_id(),
+            'service': service,
+            'source_node': self.node_id,
+            'cpu': usage.get('cpu', 0.0),
+            'mem_mb': usage.get('mem', 0.0) / 100 * psutil.virtual_memory().total / (1 << 20)
+        }
+        candidates = self.get_available_nodes()
+        for node in candidates:
+            reply = self.sender.reserve(self.communicator.membership.transfer_endpoint(node_id_of(node)), request)
+            if reply.get('granted'):
+                return node, request['reservation_id']
+            print(f"{node} declined {service} PID {pid}: {reply.get('reason')}")
+        if forced and candidates:
+            # A forced migration goes ahead, to the best-placed node
+            return candidates[0], None
+        return None, None
+    
+    def _release_target(self, target_node, reservation_id):
+        """Hand back a target's reservation for a migration that did not move the service.
+
+        Sent from a background thread: a target that is down would otherwise
+        hold up the local restore for the whole reply timeout.
+        """
+        endpoint = self.communicator.membership.transfer_endpoint(node_id_of(target_node))
+        
+        def release():
+            if not self.sender.release(endpoint, reservation_id):
+                print(f"{target_node} did not answer the release of reservation {reservation_id}")
+        
+        releaser = threading.Thread(target=release)
+        releaser.daemon = True
+        releaser.start()
+    
+    def _admit(self, pid, service, **kwargs):
+        """Ask admission control for a migration slot, logging why a migration is held back"""
+        admitted, reason = self.admission.admit(pid, service, self._cluster_migrations(), self._migration_cost(),
+                                                **kwargs)
+        if not admitted and self.admission.should_log(pid, reason):
+            print(f"Migration of {service} PID {pid} held back: {reason}")
+        return admitted
+    
+    def _cluster_migrations(self):
+        return sum(summary.get('outbound', 0) for summary in self.load_table.live().values())
+    
+    def _migration_cost(self):
+        """Seconds a migration from this node usually takes (p90), or None before the first"""
+        ms = self.tracer.percentile('migration', 90)
+        return ms / 1000 if ms is not None else None
+    
+    def get_available_nodes(self):
+        """Get a list of available nodes, best placement target first"""
+        live = self.load_table.live()
+        # Peers the failure detector suspects would only fail the transfer
+        peers = [node for node in self.communicator.peers if node_id_of(node) not in self._suspected_nodes()]
+        candidates = {node: live[node] for node in peers if node in live}
+        ordered = self.placement_policy.order(candidates)
+        
+        # Peers we have no fresh load report from go last, in their configured order
+        return ordered + [node for node in peers if node not in candidates]
+    
+    def _suspected_nodes(self):
+        detector = self.communicator.failure_detector
+        return detector.suspected() if detector else set()
+    
+    def collect_load_summary(self):
+        """Compact summary of this node's load for gossip"""
+        with self.migration_lock:
+            migrations = self.inflight_migrations
+        handles = [self.registry.get(pid) for pid in self.registry.pids()]
+        return {
+            'cpu': psutil.cpu_percent(None),
+            'mem': psutil.virtual_memory().percent,
+            # Idle standby workers run nothing, so they do not count against placement
+            'services': sum(1 for handle in handles if handle is not None and not self.standby.owns(handle)),
+            'running': {name: len(self.registry.pids(name)) for name in self.services},
+            'migrations': migrations + self.transfer_server.active_count(),
+            'outbound': self.admission.outbound()
+        }
+    
+    def _publish_load(self):
+        """Periodically broadcast this node's load summary"""
+        while self.registry.running:
             try:
-                message = self.transfer_socket.recv_json()
-                
-                if message.get('action') == 'transfer_checkpoint':
-                    # Extract the checkpoint data
-                    encoded_data = message.get('data', '')
-                    checkpoint_name = message.get('checkpoint_name', '')
-                    source_node = message.get('source_node', '')
-                    
-                    # Decode the data
-                    tar_data = base64.b64decode(encoded_data)
-                    tar_buffer = io.BytesIO(tar_data)
-                    
-                    # Extract to local directory
-                    checkpoint_dir = f"/tmp/{checkpoint_name}"
-                    os.makedirs(checkpoint_dir, exist_ok=True)
-                    with tarfile.open(fileobj=tar_buffer, mode='r:gz') as tar:
-                        tar.extractall(path="/tmp")
-                    
-                    self.transfer_socket.send_json({
-                        'success': True,
-                        'checkpoint_dir': checkpoint_dir
-                    })
-                    
-                    # Automatically restore the service
-                    self.simulate_restore(checkpoint_dir)
-                else:
-                    self.transfer_socket.send_json({'success': False, 'error': 'Unknown action'})
+                # Reservation requests are judged against the latest summary
+                self.last_load = self.collect_load_summary()
+                self.communicator.broadcast_message('LOAD', self.last_load)
             except Exception as e:
-                print(f"Error in transfer handler: {e}")
-                try:
-                    self.transfer_socket.send_json({'success': False, 'error': str(e)})
-                except:
-                    pass
+                print(f"Error publishing load: {e}")
+            time.sleep(LOAD_REPORT_INTERVAL)
     
-    def get_available_nodes(self):
-        """Get a list of available nodes based on resource usage"""
-        available_nodes = []
+    def _on_load_report(self, message):
+        self.load_table.update(node_name(message['source']), message['data'])
+        self.peer_services[message['source']] = message['data'].get('running', {})
+    
+    def _on_node_down(self, message):
+        """Restart a dead peer's services; the lowest-numbered surviving node takes them over"""
+        failed = message['data']['node_id']
+        self.load_table.remove(node_name(failed))
+        survivors = [self.node_id] + [node_id_of(node) for node in self.communicator.peers]
+        survivors = sorted((node for node in survivors if node not in self._suspected_nodes()), key=int)
+        if survivors[0] != self.node_id:
+            return
         
-        # Check each node except this one
-        for i in range(1, 4):
-            if str(i) == self.node_id:
-                continue
-                
-            node_name = f"node{i}"
-            # We could implement a more sophisticated check here, but for now we'll
-            # just assume all other nodes are available
-            available_nodes.append(node_name)
-            
-        return available_nodes
+        services = {name: count for name, count in self.peer_services.get(failed, {}).items()
+                    if count and name in self.services}
+        print(f"Node {failed} is down, taking over its services: {services}")
+        # Without a checkpoint from the dead node its services start from scratch
+        for name, count in services.items():
+            for _ in range(count):
+                self.restart_service(name)
+        self.communicator.broadcast_message('RECOVERY', {
+            'action': 'node_takeover',
+            'failed_node': failed,
+            'services': services,
+            'phi': message['data']['phi']
+        })
+    
+    def _track_migration(self, delta):
+        with self.migration_lock:
+            self.inflight_migrations += delta
             
     def monitor_and_recover(self):
         """Monitor the dummy service and recover if needed"""
+        self._adopt_running_services()
+        
         while True:
             try:
-                # Find dummy service process
-                dummy_service_pid = None
-                for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                    if 'python' in proc.info['name'] and 'dummy_service.py' in str(proc.info['cmdline']):
-                        dummy_service_pid = proc.info['pid']
-                        break
+                # Crashes are handled by _on_service_exit; this catches instances it could not replace
+                for policy in self.services.values():
+                    if policy.restart_on_exit:
+                        self.replace_instances(policy.name)
                 
-                if not dummy_service_pid:
-                    print("Dummy service not found, restarting...")
-                    self.restart_service()
-                else:
-                    # Check resource usage
-                    process = psutil.Process(dummy_service_pid)
-                    cpu_percent = process.cpu_percent(interval=1)
-                    mem_percent = process.memory_percent()
+                for pid in self.registry.pids():
+                    # Smoothed readings from the background sampler; never blocks
+                    usage = self.sampler.get(pid)
+                    handle = self.registry.get(pid)
+                    policy = self.services.get(handle.name) if handle else None
+                    if usage is None or policy is None or usage['samples'] < MIN_SAMPLES:
+                        continue
                     
-                    if cpu_percent > 90 or mem_percent > 90:
-                        print(f"High resource usage detected: CPU={cpu_percent}%, MEM={mem_percent}%")
-                        
-                        # Create a simulated checkpoint of the current process
-                        checkpoint_dir = self.simulate_checkpoint(dummy_service_pid)
-                        
-                        if checkpoint_dir:
-                            # Find an available node to transfer the process to
-                            available_nodes = self.get_available_nodes()
-                            
-                            if available_nodes:
-                                # Transfer the checkpoint to the first available node
-                                target_node = available_nodes[0]
-                                print(f"Transferring process to {target_node}...")
-                                
-                                # Kill the process on this node
-                                process.kill()
-                                
-                                # Transfer the checkpoint
-                                success = self.transfer_checkpoint_to_node(checkpoint_dir, target_node)
-                                
-                                if success:
-                                    print(f"Successfully transferred process to {target_node}")
-                                else:
-                                    print(f"Failed to transfer process, restoring locally")
-                                    self.simulate_restore(checkpoint_dir)
-                            else:
-                                print("No available nodes found, restoring locally")
-                                self.simulate_restore(checkpoint_dir)
+                    cpu_percent = usage['cpu']
+                    mem_percent = usage['mem']
+                    # A breach only leads to a migration once admission control agrees it is worth one
+                    breach = self.admission.observe(pid, usage, policy)
+                    if breach is not None and self._admit(pid, handle.name, breach=breach, usage=usage, policy=policy):
+                        print(f"High resource usage detected for PID {pid} for {breach:.1f}s: CPU={cpu_percent:.1f}% "
+                              f"(max {usage['cpu_max']:.1f}%), MEM={mem_percent:.1f}% (max {usage['mem_max']:.1f}%)")
+                        self._dispatch_migration(pid)
                 
             except Exception as e:
                 print(f"Error in monitor_and_recover: {e}")
             
-            time.sleep(5)
+            time.sleep(self.monitor_interval)
+    
+    def migrate_overloaded_service(self, pid, forced=False):
+        """Checkpoint an admitted service and move it to another node"""
+        self._track_migration(1)
+        trace = self.tracer.start('migration')
+        started = time.monotonic()
+        handle = self.registry.get(pid)
+        service = handle.name if handle else SERVICE_NAME
+        moved = False
+        target_node = reservation_id = None
+        try:
+            self.communicator.broadcast_message('RECOVERY', annotate({
+                'action': 'migration_started',
+                'source_node': self.node_id,
+                'pid': pid
+            }, trace))
+            
+            # Reserve room on a target first, so a busy cluster leaves the service running
+            with span(trace, 'placement'):
+                target_node, reservation_id = self._reserve_target(pid, service, forced)
+            if not target_node:
+                print(f"No node can take {service} PID {pid} without overloading, leaving it in place")
+                return
+            
+            # Create a simulated checkpoint of the current process
+            checkpoint_dir = self.simulate_checkpoint(pid, trace)
+            
+            if checkpoint_dir:
+                print(f"Transferring process to {target_node}...")
+                
+                # Kill the process on this node
+                with span(trace, 'stop'):
+                    self.registry.kill(pid)
+                
+                # Transfer the checkpoint
+                moved = self.transfer_checkpoint_to_node(checkpoint_dir, target_node, trace, reservation_id)
+                
+                if moved:
+                    print(f"Successfully transferred process to {target_node}")
+                else:
+                    print(f"Failed to transfer process, restoring locally")
+                    self.simulate_restore(checkpoint_dir, trace)
+        finally:
+            if reservation_id and not moved:
+                self._release_target(target_node, reservation_id)
+            self.admission.finish(pid, service, moved)
+            self._track_migration(-1)
+            record(trace, 'migration', started)
+            self.tracer.finish(trace)
     
     def handle_preventive_migration(self, pid, prediction, fault_type):
         """Handle preventive migration triggered by ML predictions"""
+        handle = self.registry.get(pid)
+        service = handle.name if handle else SERVICE_NAME
+        if not self._admit(pid, service, prediction=prediction, policy=self.services.get(service)):
+            return False
+        self._track_migration(1)
+        trace = self.tracer.start('preventive')
+        started = time.monotonic()
+        moved = False
+        target_node = reservation_id = None
         try:
             print(f"Initiating preventive migration for PID {pid} due to predicted {fault_type} fault (p={prediction:.4f})")
             
+            # Reserve room on a target before paying for the checkpoint
+            with span(trace, 'placement'):
+                target_node, reservation_id = self._reserve_target(pid, service)
+            if not target_node:
+                print(f"No node can take {service} PID {pid} without overloading, leaving it in place")
+                return False
+            
             # Create a checkpoint of the process
-            checkpoint_dir = self.simulate_checkpoint(pid)
+            checkpoint_dir = self.simulate_checkpoint(pid, trace)
             
             if checkpoint_dir:
-                # Find an available node to transfer the process to
-                available_nodes = self.get_available_nodes()
+                print(f"Preventively transferring process to {target_node}...")
                 
-                if available_nodes:
-                    # Transfer the checkpoint to the first available node
-                    target_node = available_nodes[0]
-                    print(f"Preventively transferring process to {target_node}...")
-                    
-                    # Log the preventive migration
-                    self.communicator.broadcast_message('RECOVERY', {
-                        'action': 'preventive_migration',
-                        'source_node': self.node_id,
-                        'target_node': target_node,
-                        'pid': pid,
-                        'fault_type': fault_type,
-                        'prediction': prediction
-                    })
-                    
-                    # Kill the process on this node
-                    process = psutil.Process(pid)
-                    process.kill()
-                    
-                    # Transfer the checkpoint
-                    success = self.transfer_checkpoint_to_node(checkpoint_dir, target_node)
-                    
-                    if success:
-                        print(f"Successfully transferred process to {target_node}")
-                        return True
-                    else:
-                        print(f"Failed to transfer process, restoring locally")
-                        self.simulate_restore(checkpoint_dir)
-                        return False
+                # Log the preventive migration
+                self.communicator.broadcast_message('RECOVERY', annotate({
+                    'action': 'preventive_migration',
+                    'source_node': self.node_id,
+                    'target_node': target_node,
+                    'pid': pid,
+                    'fault_type': fault_type,
+                    'prediction': prediction
+                }, trace))
+                
+                # Kill the process on this node
+                with span(trace, 'stop'):
+                    self.registry.kill(pid)
+                
+                # Transfer the checkpoint
+                moved = self.transfer_checkpoint_to_node(checkpoint_dir, target_node, trace, reservation_id)
+                
+                if moved:
+                    print(f"Successfully transferred process to {target_node}")
+                    return True
                 else:
-                    print("No available nodes found, restoring locally")
-                    self.simulate_restore(checkpoint_dir)
+                    print(f"Failed to transfer process, restoring locally")
+                    self.simulate_restore(checkpoint_dir, trace)
                     return False
             else:
                 print(f"Failed to create checkpoint for PID {pid}")
@@ -294,11 +694,24 @@ class RecoveryManager:
         except Exception as e:
             print(f"Error in preventive migration: {e}")
             return False
+        finally:
+            if reservation_id and not moved:
+                self._release_target(target_node, reservation_id)
+            self.admission.finish(pid, service, moved)
+            self._track_migration(-1)
+            record(trace, 'migration', started)
+            self.tracer.finish(trace)
     
     def cleanup(self):
         """Clean up resources"""
+        if self.fault_detector:
+            self.fault_detector.stop()
+        self.sampler.stop()
+        self.standby.close()
+        self.registry.close()
+        self.tracer.close()
         self.communicator.close()
-        self.transfer_socket.close()
+        self.transfer_server.close()
         self.context.term()
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import select
+import signal
+import threading
+import subprocess
+import psutil
+
+# Supervised-service registry.
+#
+# Services spawned (or adopted) through the registry are watched with a pidfd
+# per process, so an exit wakes the watcher thread immediately instead of being
+# found by the next process_iter scan. The current name -> PIDs table is also
+# written to a small JSON file so other tools on the node can look services up
+# without scanning the process table.
+
+REGISTRY_FILE = "/tmp/service_registry_{node_id}.json"
+FALLBACK_POLL_INTERVAL = 0.5
+
+
+class ServiceHandle:
+    def __init__(self, name, pid, popen=None, cmd=None):
+        self.name = name
+        self.pid = pid
+        self.popen = popen
+        self.cmd = cmd
+        self.started = time.time()
+        self.expected_exit = False
+        self.pidfd = None
+
+
+class ServiceRegistry:
+    """Owns the service processes on this node and reports their exits as they happen"""
+
+    def __init__(self, node_id, registry_file=None):
+        self.node_id = str(node_id)
+        self.registry_file = registry_file or REGISTRY_FILE.format(node_id=self.node_id)
+        self.services = {}
+        self.exit_callbacks = []
+        self.lock = threading.Lock()
+        self.running = True
+
+        # The watcher blocks in poll(); writing to this pipe wakes it to pick up new pidfds
+        self._wake_r, self._wake_w = os.pipe()
+        self._poller = select.poll()
+        self._poller.register(self._wake_r, select.POLLIN)
+        self._fd_to_pid = {}
+        self._pending_fds = []
+        self.watcher_thread = threading.Thread(target=self._watch)
+        self.watcher_thread.daemon = True
+        self.watcher_thread.start()
+        self._persist()
+
+    def on_exit(self, callback_func):
+        """Register callback(handle, returncode) to run when a service exits"""
+        self.exit_callbacks.append(callback_func)
+
+    def spawn(self, name, cmd, **popen_kwargs):
+        """Start a service process and supervise it"""
+        popen = subprocess.Popen(cmd, **popen_kwargs)
+        self._add(ServiceHandle(name, popen.pid, popen=popen, cmd=cmd))
+        return popen.pid
+
+    def adopt(self, name, pid):
+        """Supervise a service process this registry did not start"""
+        try:
+            cmd = psutil.Process(pid).cmdline()
+        except psutil.Error:
+            return False
+        self._add(ServiceHandle(name, pid, cmd=cmd))
+        return True
+
+    def _add(self, handle):
+        with self.lock:
+            self.services[handle.pid] = handle
+        self._watch_handle(handle)
+        self._persist()
+        print(f"Supervising {handle.name} with PID {handle.pid}")
+
+    def _watch_handle(self, handle):
+        try:
+            handle.pidfd = os.pidfd_open(handle.pid)
+        except (AttributeError, OSError):
+            handle.pidfd = None
+
+        if handle.pidfd is not None:
+            with self.lock:
+                self._fd_to_pid[handle.pidfd] = handle.pid
+                self._pending_fds.append(handle.pidfd)
+            os.write(self._wake_w, b'x')
+        elif handle.popen is not None:
+            # No pidfd support: a blocking waitpid per child still reports the exit at once
+            waiter = threading.Thread(target=self._wait_child, args=(handle,))
+            waiter.daemon = True
+            waiter.start()
+        else:
+            waiter = threading.Thread(target=self._poll_foreign, args=(handle,))
+            waiter.daemon = True
+            waiter.start()
+
+    def _watch(self):
+        while self.running:
+            try:
+                events = self._poller.poll()
+            except InterruptedError:
+                continue
+            for fd, _ in events:
+                if fd == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                    with self.lock:
+                        pending, self._pending_fds = self._pending_fds, []
+                    for pidfd in pending:
+                        self._poller.register(pidfd, select.POLLIN)
+                    continue
+                with self.lock:
+                    pid = self._fd_to_pid.pop(fd, None)
+                self._poller.unregister(fd)
+                os.close(fd)
+                if pid is not None:
+                    self._reap(pid)
+
+    def _wait_child(self, handle):
+        handle.popen.wait()
+        self._reap(handle.pid)
+
+    def _poll_foreign(self, handle):
+        while self.running and psutil.pid_exists(handle.pid):
+            time.sleep(FALLBACK_POLL_INTERVAL)
+        self._reap(handle.pid)
+
+    def _reap(self, pid):
+        with self.lock:
+            handle = self.services.pop(pid, None)
+        if handle is None:
+            return
+
+        returncode = None
+        if handle.popen is not None:
+            returncode = handle.popen.wait()
+        self._persist()
+
+        for callback in self.exit_callbacks:
+            try:
+                callback(handle, returncode)
+            except Exception as e:
+                print(f"Error in exit callback: {e}")
+
+    def kill(self, pid, sig=signal.SIGKILL):
+        """Kill a supervised service on purpose; its exit is reported with expected_exit set"""
+        with self.lock:
+            handle = self.services.get(pid)
+            if handle is not None:
+                handle.expected_exit = True
+        try:
+            os.kill(pid, sig)
+            return True
+        except ProcessLookupError:
+            return False
+
+    def get(self, pid):
+        with self.lock:
+            return self.services.get(pid)
+
+    def rename(self, pid, name):
+        """Move a supervised process under another service name (a standby taking over)"""
+        with self.lock:
+            handle = self.services.get(pid)
+            if handle is None:
+                return False
+            handle.name = name
+        self._persist()
+        return True
+
+    def pids(self, name=None):
+        with self.lock:
+            return [pid for pid, handle in self.services.items() if name is None or handle.name == name]
+
+    def lookup(self, name):
+        """Return the oldest supervised PID for a service name, or None"""
+        with self.lock:
+            handles = [handle for handle in self.services.values() if handle.name == name]
+        if not handles:
+            return None
+        return min(handles, key=lambda handle: handle.started).pid
+
+    def _persist(self):
+        with self.lock:
+            table = {}
+            for pid, handle in self.services.items():
+                table.setdefault(handle.name, []).append(pid)
+        try:
+            tmp_path = f"{self.registry_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'node_id': self.node_id, 'owner': os.getpid(), 'services': table}, f)
+            os.replace(tmp_path, self.registry_file)
+        except OSError as e:
+            print(f"Error writing service registry: {e}")
+
+    def close(self):
+        self.running = False
+        os.write(self._wake_w, b'x')
+        self.watcher_thread.join(timeout=1)
+        if os.path.exists(self.registry_file):
+            os.remove(self.registry_file)
+
+
+def find_service_pids(node_id, name, script=None):
+    """Look up service PIDs from the node's registry file.
+
+    Falls back to scanning the process table for `script` when no registry
+    owner is running on this node.
+    """
+    try:
+        with open(REGISTRY_FILE.format(node_id=node_id), 'r') as f:
+            registry = json.load(f)
+        if psutil.pid_exists(registry['owner']):
+            return [pid for pid in registry['services'].get(name, []) if psutil.pid_exists(pid)]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if script is None:
+        return []
+    pids = []
+    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+        if 'python' in proc.info['name'] and script in str(proc.info['cmdline']):
+            pids.append(proc.info['pid'])
+    return pids
@@ -0,0 +1,142 @@
+import time
+import threading
+from collections import deque
+import psutil
+
+SAMPLE_INTERVAL = 0.25
+EWMA_ALPHA = 0.3
+MAX_WINDOW = 8
+
+
+class ProcessStats:
+    """Smoothed CPU and memory readings for one process"""
+
+    def __init__(self, alpha, window):
+        self.alpha = alpha
+        self.cpu = 0.0
+        self.mem = 0.0
+        self.cpu_window = deque(maxlen=window)
+        self.mem_window = deque(maxlen=window)
+        self.threads = 0
+        self.ctx_switches = 0
+        self.samples = 0
+        self.updated = 0.0
+
+    def update(self, cpu, mem, now, threads=0, ctx_switches=0):
+        if self.samples == 0:
+            self.cpu, self.mem = cpu, mem
+        else:
+            self.cpu += self.alpha * (cpu - self.cpu)
+            self.mem += self.alpha * (mem - self.mem)
+        self.cpu_window.append(cpu)
+        self.mem_window.append(mem)
+        self.threads = threads
+        self.ctx_switches = ctx_switches
+        self.samples += 1
+        self.updated = now
+
+    def snapshot(self):
+        return {
+            'cpu': self.cpu,
+            'mem': self.mem,
+            'cpu_max': max(self.cpu_window, default=0.0),
+            'mem_max': max(self.mem_window, default=0.0),
+            'threads': self.threads,
+            'ctx_switches': self.ctx_switches,
+            'samples': self.samples,
+            'updated': self.updated
+        }
+
+
+class ResourceSampler:
+    """Samples every supervised PID in one pass on a background thread.
+
+    `pid_source` is called each pass to get the PIDs to watch, so services
+    started or stopped through the registry are picked up automatically.
+    Readers call get()/snapshot() and never block on psutil.
+    """
+
+    def __init__(self, pid_source, interval=SAMPLE_INTERVAL, alpha=EWMA_ALPHA, window=MAX_WINDOW):
+        self.pid_source = pid_source
+        self.interval = interval
+        self.alpha = alpha
+        self.window = window
+        self.handles = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.sampler_thread = None
+
+    def start(self):
+        self.running = True
+        self.sampler_thread = threading.Thread(target=self._run)
+        self.sampler_thread.daemon = True
+        self.sampler_thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"Error in resource sampler: {e}")
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    def sample_once(self):
+        pids = set(self.pid_source())
+
+        # Drop handles for processes that are no longer supervised
+        for pid in list(self.handles):
+            if pid not in pids:
+                del self.handles[pid]
+
+        readings = {}
+        for pid in pids:
+            process = self.handles.get(pid)
+            if process is None:
+                try:
+                    process = psutil.Process(pid)
+                    # The first cpu_percent(None) call only primes the counters
+                    process.cpu_percent(None)
+                except psutil.Error:
+                    continue
+                self.handles[pid] = process
+                continue
+            try:
+                with process.oneshot():
+                    ctx = process.num_ctx_switches()
+                    readings[pid] = (process.cpu_percent(None), process.memory_percent(),
+                                     process.num_threads(), ctx.voluntary + ctx.involuntary)
+            except psutil.Error:
+                del self.handles[pid]
+
+        now = time.monotonic()
+        with self.lock:
+            for pid in list(self.stats):
+                if pid not in self.handles:
+                    del self.stats[pid]
+            for pid, (cpu, mem, threads, ctx_switches) in readings.items():
+                stats = self.stats.get(pid)
+                if stats is None:
+                    stats = self.stats[pid] = ProcessStats(self.alpha, self.window)
+                stats.update(cpu, mem, now, threads, ctx_switches)
+
+    def get(self, pid):
+        """Return the latest smoothed readings for a PID, or None if not sampled yet"""
+        with self.lock:
+            stats = self.stats.get(pid)
+            return stats.snapshot() if stats else None
+
+    def snapshot(self):
+        with self.lock:
+            return {pid: stats.snapshot() for pid, stats in self.stats.items()}
+
+    def stop(self):
+        self.running = False
+        if self.sampler_thread:
+            self.sampler_thread.join(timeout=self.interval * 2)
@@ -0,0 +1,75 @@
+import os
+import json
+
+# Services a node supervises, loaded from the JSON file named by SERVICES_CONFIG:
+#
+#   [{"name": "dummy_service", "cmd": ["python3", "/app/shared/dummy_service.py"],
+#     "instances": 2, "cpu_threshold": 85, "transfer_timeout": 30}, ...]
+#
+# Every key except name and cmd is optional.
+#
+# "standby" keeps that many pre-warmed workers (see standby.py) for fast
+# restores. "state_file" is where an instance saves its state, with {pid} for
+# the instance's PID; a service that declares it flushes the file on SIGUSR1,
+# then stops itself (SIGSTOP) until it is killed or continued, and accepts
+# --restore <path>, and its state travels with checkpoints.
+# "sustain_seconds" and "cooldown_seconds" override the admission control
+# defaults (see admission.py) for the service.
+
+DEFAULT_SERVICES = [
+    {'name': 'dummy_service', 'cmd': ['python3', '/app/shared/dummy_service.py'],
+     'standby': 1, 'state_file': '/tmp/dummy_service_state_{pid}.json'}
+]
+
+
+class ServicePolicy:
+    """How one declared service is run, judged overloaded, and migrated"""
+
+    def __init__(self, name, cmd, instances=1, cpu_threshold=90, mem_threshold=90,
+                 check_interval=0.5, checkpoint_timeout=10, transfer_timeout=60,
+                 restore_timeout=10, restart_on_exit=True, env=None, standby=0, state_file=None,
+                 sustain_seconds=None, cooldown_seconds=None):
+        self.name = name
+        self.cmd = list(cmd)
+        self.instances = instances
+        self.cpu_threshold = cpu_threshold
+        self.mem_threshold = mem_threshold
+        self.check_interval = check_interval
+        self.checkpoint_timeout = checkpoint_timeout
+        self.transfer_timeout = transfer_timeout
+        self.restore_timeout = restore_timeout
+        self.restart_on_exit = restart_on_exit
+        self.env = env or {}
+        self.standby = standby
+        self.state_file = state_file
+        self.sustain_seconds = sustain_seconds
+        self.cooldown_seconds = cooldown_seconds
+
+    @classmethod
+    def from_dict(cls, config):
+        return cls(**config)
+
+    @property
+    def script(self):
+        """The script name used to recognise instances started outside the registry"""
+        return os.path.basename(self.cmd[-1])
+
+    def is_overloaded(self, usage):
+        return usage['cpu'] > self.cpu_threshold or usage['mem'] > self.mem_threshold
+
+    def spawn_env(self):
+        if not self.env:
+            return None
+        env = dict(os.environ)
+        env.update({key: str(value) for key, value in self.env.items()})
+        return env
+
+
+def load_service_policies(path=None):
+    """Return {name: ServicePolicy} from SERVICES_CONFIG, or the default dummy service"""
+    path = path or os.environ.get('SERVICES_CONFIG')
+    configs = DEFAULT_SERVICES
+    if path:
+        with open(path, 'r') as f:
+            configs = json.load(f)
+    return {config['name']: ServicePolicy.from_dict(config) for config in configs}
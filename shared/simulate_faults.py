@@ -4,65 +4,105 @@ import subprocess
 import psutil
 import json
 import sys
+import signal
+import shutil
+import argparse
+import threading
 from comm import NodeCommunicator
+from registry import find_service_pids
 import time
 
+# Faults a node's FaultAgent injects on request (node_failure would take the
+# agent down with the node, so it stays a manual, local fault)
+INJECTABLE_FAULTS = ('cpu', 'memory', 'kill', 'migration')
+
+
+def burn_cpu(duration):
+    """Keep one core busy for `duration` seconds"""
+    deadline = time.monotonic() + duration
+    x = 0
+    while time.monotonic() < deadline:
+        for _ in range(10000):
+            x = (x * 31 + 7) % 1000003
+
+
+def leak_memory(size_mb, duration):
+    """Grow to size_mb in ten steps over `duration` seconds, then let it all go"""
+    chunk_size = size_mb * 1024 * 1024 // 10
+    data = []
+    for _ in range(10):
+        # Filled rather than zeroed, so the pages are really resident
+        data.append(bytearray(b'\x01') * chunk_size)
+        time.sleep(duration / 10)
+    del data
+
+
 class FaultSimulator:
-    def __init__(self):
-        self.node_id = os.environ.get('NODE_ID', '1')
-        self.communicator = NodeCommunicator(self.node_id)
+    def __init__(self, node_id=None, communicator=None):
+        # A harness injecting faults into several nodes passes its own communicator
+        self.node_id = str(node_id or os.environ.get('NODE_ID', '1'))
+        self.communicator = communicator or NodeCommunicator(self.node_id)
         
-    def simulate_cpu_stress(self, duration=30):
-        """Simulate high CPU usage using stress-ng"""
+    def _report_fault(self, data, fault_id=None):
+        # Campaigns match the FAULT message to the injection by its fault_id
+        if fault_id is not None:
+            data['fault_id'] = fault_id
+        self.communicator.broadcast_message('FAULT', data)
+    
+    def simulate_cpu_stress(self, duration=30, fault_id=None):
+        """Simulate high CPU usage on every core with stress-ng (or Python burners without it)"""
         try:
             cores = psutil.cpu_count()
-            subprocess.Popen(['stress-ng', '--cpu', str(cores), '--timeout', str(duration)])
-            self.communicator.broadcast_message('FAULT', {
+            if shutil.which('stress-ng'):
+                processes = [subprocess.Popen(['stress-ng', '--cpu', str(cores), '--timeout', str(duration)])]
+            else:
+                processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--burn', str(duration)])
+                             for _ in range(cores)]
+            self._report_fault({
                 'type': 'cpu_stress',
                 'cores': cores,
                 'duration': duration
-            })
+            }, fault_id)
             print(f"Simulating CPU stress on node {self.node_id} for {duration} seconds")
+            return [process.pid for process in processes]
         except Exception as e:
             print(f"Error simulating CPU stress: {e}")
             
-    def simulate_memory_leak(self, size_mb=500, duration=30):
-        """Simulate memory leak"""
+    def simulate_memory_leak(self, size_mb=500, duration=30, fault_id=None):
+        """Simulate a memory leak in a separate process, so the caller carries on"""
         try:
-            # Allocate memory in chunks
-            chunk_size = size_mb * 1024 * 1024 // 10  # Convert to bytes
-            data = []
-            
-            self.communicator.broadcast_message('FAULT', {
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--leak',
+                                        str(size_mb), str(duration)])
+            self._report_fault({
                 'type': 'memory_leak',
                 'size_mb': size_mb,
-                'duration': duration
-            })
+                'duration': duration,
+                'pid': process.pid
+            }, fault_id)
             
             print(f"Simulating memory leak on node {self.node_id}: {size_mb}MB over {duration} seconds")
-            for _ in range(10):
-                data.append(bytearray(chunk_size))
-                time.sleep(duration / 10)
-                
-            # Clean up
-            del data
-            
+            return process.pid
         except Exception as e:
             print(f"Error simulating memory leak: {e}")
             
-    def kill_dummy_service(self):
+    def _find_dummy_services(self):
+        """Look up dummy service PIDs from the recovery manager's registry"""
+        return find_service_pids(self.node_id, 'dummy_service', script='dummy_service.py')
+    
+    def kill_dummy_service(self, fault_id=None):
         """Kill the dummy service process"""
         try:
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if 'python' in proc.info['name'] and 'dummy_service.py' in str(proc.info['cmdline']):
-                    pid = proc.info['pid']
-                    proc.kill()
-                    self.communicator.broadcast_message('FAULT', {
-                        'type': 'process_kill',
-                        'pid': pid
-                    })
-                    print(f"Killed dummy service process {pid} on node {self.node_id}")
-                    break
+            for pid in self._find_dummy_services():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    continue
+                self._report_fault({
+                    'type': 'process_kill',
+                    'pid': pid
+                }, fault_id)
+                print(f"Killed dummy service process {pid} on node {self.node_id}")
+                return pid
             else:
                 print("No dummy service process found to kill")
         except Exception as e:
@@ -72,10 +112,7 @@ class FaultSimulator:
         """Simulate a node failure (without actually crashing the container)"""
         try:
             # First, capture the current state to help with verification
-            service_pids = []
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if 'python' in proc.info['name'] and 'dummy_service.py' in str(proc.info['cmdline']):
-                    service_pids.append(proc.info['pid'])
+            service_pids = self._find_dummy_services()
             
             self.communicator.broadcast_message('FAULT', {
                 'type': 'node_failure',
@@ -98,32 +135,43 @@ class FaultSimulator:
         except Exception as e:
             print(f"Error simulating node failure: {e}")
     
-    def force_service_migration(self):
+    def force_service_migration(self, fault_id=None):
         """Force a service migration"""
         try:
             # Find the dummy service
-            dummy_service_pid = None
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if 'python' in proc.info['name'] and 'dummy_service.py' in str(proc.info['cmdline']):
-                    dummy_service_pid = proc.info['pid']
-                    break
+            service_pids = self._find_dummy_services()
+            dummy_service_pid = service_pids[0] if service_pids else None
             
             if not dummy_service_pid:
                 print("No dummy service found to migrate")
                 return
             
             # Tell the recovery manager to migrate this service
-            self.communicator.broadcast_message('FAULT', {
+            self._report_fault({
                 'type': 'force_migration',
                 'pid': dummy_service_pid,
                 'node_id': self.node_id
-            })
+            }, fault_id)
             
             print(f"Requested migration of service with PID {dummy_service_pid} from node {self.node_id}")
+            return dummy_service_pid
             
         except Exception as e:
             print(f"Error forcing service migration: {e}")
             
+    def inject(self, kind, fault_id=None, **params):
+        """Inject one of INJECTABLE_FAULTS; returns the affected PID(s), or None if nothing was injected"""
+        if kind == 'cpu':
+            return self.simulate_cpu_stress(duration=params.get('duration', 30), fault_id=fault_id)
+        if kind == 'memory':
+            return self.simulate_memory_leak(size_mb=params.get('size_mb', 500), duration=params.get('duration', 30),
+                                             fault_id=fault_id)
+        if kind == 'kill':
+            return self.kill_dummy_service(fault_id=fault_id)
+        if kind == 'migration':
+            return self.force_service_migration(fault_id=fault_id)
+        raise ValueError(f"Unknown fault {kind!r}, expected one of {INJECTABLE_FAULTS}")
+    
     def simulate_random_fault(self):
         """Simulate a random fault"""
         fault_type = random.choice(['cpu', 'memory', 'kill', 'node_failure', 'migration'])
@@ -185,10 +233,68 @@ class FaultSimulator:
         """Clean up resources"""
         self.communicator.close()
 
+class FaultAgent:
+    """Injects faults on this node when a campaign (campaign.py) asks for them.
+
+    Requests arrive as INJECT_FAULT messages naming a node, a fault kind and
+    its parameters. Each runs on its own thread, so overlapping faults do not
+    wait for one another. A 'ping' is answered so a campaign knows the agent
+    is listening before its timeline starts.
+    """
+    
+    def __init__(self, node_id, communicator, on_migrate=None):
+        self.node_id = str(node_id)
+        self.communicator = communicator
+        self.simulator = FaultSimulator(node_id, communicator)
+        # A node does not receive its own FAULT messages, so forced migrations are started directly
+        self.on_migrate = on_migrate
+        communicator.register_callback('INJECT_FAULT', self._on_inject)
+    
+    def _on_inject(self, message):
+        data = message['data']
+        if 'kind' not in data or str(data.get('node_id')) != self.node_id:
+            return
+        if data['kind'] == 'ping':
+            self.communicator.broadcast_message('INJECT_FAULT', {'reply': 'pong', 'fault_id': data.get('fault_id')})
+            return
+        injection = threading.Thread(target=self._inject, args=(data,))
+        injection.daemon = True
+        injection.start()
+    
+    def _inject(self, data):
+        try:
+            result = self.simulator.inject(data['kind'], data.get('fault_id'), **data.get('params', {}))
+            if data['kind'] == 'migration' and result and self.on_migrate:
+                self.on_migrate(result)
+        except Exception as e:
+            print(f"Error injecting {data['kind']} fault {data.get('fault_id')}: {e}")
+
+
+def create_fault_agent(node_id, communicator, on_migrate=None):
+    """FaultAgent for this node if FAULT_INJECTION=1"""
+    if os.environ.get('FAULT_INJECTION', '0') != '1':
+        return None
+    return FaultAgent(node_id, communicator, on_migrate)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fault simulator')
+    parser.add_argument('--interactive', action='store_true', help='Choose faults from a menu')
+    parser.add_argument('--leak', nargs=2, type=float, metavar=('SIZE_MB', 'DURATION'), help=argparse.SUPPRESS)
+    parser.add_argument('--burn', type=float, metavar='DURATION', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    # Worker modes used by simulate_memory_leak and simulate_cpu_stress
+    if args.leak:
+        leak_memory(int(args.leak[0]), args.leak[1])
+        sys.exit(0)
+    if args.burn:
+        burn_cpu(args.burn)
+        sys.exit(0)
+    
     simulator = FaultSimulator()
     try:
-        if len(sys.argv) > 1 and sys.argv[1] == '--interactive':
+        if args.interactive:
             simulator.interactive_mode()
         else:
             simulator.simulate_random_fault()
@@ -0,0 +1,135 @@
+import json
+import subprocess
+import threading
+import time
+
+# Pre-warmed standby workers.
+#
+# A service that supports standby mode is started with --standby: it does its
+# imports and then blocks reading one JSON line from stdin. Handing over a
+# checkpoint is a single write of {"state_file": path} to a warm worker, which
+# loads the state and starts working at once, so a restore costs a pipe write
+# instead of an interpreter start. Closing stdin without a line tells an idle
+# worker to exit.
+
+STANDBY_FLAG = '--standby'
+STANDBY_PREFIX = 'standby:'
+# A worker that dies sooner than this after starting is not replaced, so a
+# service that does not understand --standby cannot spin in a respawn loop
+MIN_STANDBY_LIFETIME = 1.0
+
+
+def standby_name(name):
+    """Registry name of the idle workers kept for a service"""
+    return f"{STANDBY_PREFIX}{name}"
+
+
+class StandbyPool:
+    """Keeps policy.standby idle workers per service in the ServiceRegistry"""
+
+    def __init__(self, registry, policies):
+        self.registry = registry
+        self.policies = {name: policy for name, policy in policies.items() if policy.standby > 0}
+        self.idle = {name: [] for name in self.policies}
+        # Workers being spawned count towards the standby count, so concurrent refills
+        # (from activate and on_exit) never start more than it between them
+        self.starting = {name: 0 for name in self.policies}
+        self.lock = threading.Lock()
+        self.running = True
+
+    def fill(self, name=None):
+        """Start workers until every service (or just `name`) has its standby count"""
+        for policy in list(self.policies.values()):
+            if name is not None and policy.name != name:
+                continue
+            while self.running:
+                with self.lock:
+                    idle = self.idle.get(policy.name)
+                    if idle is None or len(idle) + self.starting.get(policy.name, 0) >= policy.standby:
+                        break
+                    self.starting[policy.name] = self.starting.get(policy.name, 0) + 1
+                pid = None
+                try:
+                    pid = self.registry.spawn(standby_name(policy.name), policy.cmd + [STANDBY_FLAG],
+                                              stdin=subprocess.PIPE, env=policy.spawn_env())
+                except OSError as e:
+                    print(f"Error starting standby worker for {policy.name}: {e}")
+                finally:
+                    with self.lock:
+                        self.starting[policy.name] -= 1
+                        if pid is not None:
+                            self.idle.setdefault(policy.name, []).append(pid)
+                if pid is None:
+                    break
+
+    def _refill(self, name):
+        refill = threading.Thread(target=self.fill, args=(name,))
+        refill.daemon = True
+        refill.start()
+
+    def activate(self, name, state_file=None):
+        """Hand a service (and optionally its saved state) to a warm worker.
+
+        Returns the worker's PID, now registered under `name`, or None when no
+        worker is ready and the caller should cold-start the service.
+        """
+        while True:
+            with self.lock:
+                if not self.idle.get(name):
+                    break
+                pid = self.idle[name].pop(0)
+            handle = self.registry.get(pid)
+            if handle is None or handle.popen is None or handle.popen.poll() is not None:
+                continue
+
+            started = time.perf_counter()
+            try:
+                handle.popen.stdin.write((json.dumps({'state_file': state_file}) + '\n').encode())
+                handle.popen.stdin.close()
+            except OSError:
+                continue
+            self.registry.rename(pid, name)
+            print(f"Activated standby worker {pid} for {name} "
+                  f"in {(time.perf_counter() - started) * 1000:.2f}ms")
+            self._refill(name)
+            return pid
+
+        if name in self.policies:
+            self._refill(name)
+        return None
+
+    def owns(self, handle):
+        return handle.name.startswith(STANDBY_PREFIX)
+
+    def on_exit(self, handle):
+        """An idle worker died; forget it and start a replacement"""
+        name = handle.name[len(STANDBY_PREFIX):]
+        with self.lock:
+            if name in self.idle and handle.pid in self.idle[name]:
+                self.idle[name].remove(handle.pid)
+        if not self.running or handle.expected_exit:
+            return
+        if time.time() - handle.started < MIN_STANDBY_LIFETIME:
+            print(f"Standby worker for {name} exited right after starting, disabling standby for it")
+            with self.lock:
+                self.policies.pop(name, None)
+                self.idle.pop(name, None)
+            return
+        self._refill(name)
+
+    def close(self):
+        """Tell idle workers to exit by closing their stdin"""
+        self.running = False
+        with self.lock:
+            pids = [pid for pids in self.idle.values() for pid in pids]
+            for pids in self.idle.values():
+                pids.clear()
+        for pid in pids:
+            handle = self.registry.get(pid)
+            if handle is None or handle.popen is None:
+                continue
+            handle.expected_exit = True
+            try:
+                handle.popen.stdin.close()
+            except OSError:
+                pass
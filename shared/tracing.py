@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import uuid
+import bisect
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager, nullcontext
+
+# Per-stage tracing of migrations.
+#
+# A migration gets a trace ID when it starts. Every stage is timed as a span
+# on the monotonic clock of the node that runs it. The ID travels with the
+# checkpoint offer, so the target's extract and restore spans join the same
+# trace. Spans ride along in the RECOVERY messages of the migration as
+#
+#   'trace': {'id': '3f2a...', 'spans': [['checkpoint', 41.2], ['transfer', 88.0]]}
+#
+# (milliseconds). Each node folds its own spans and those it hears about into
+# per-stage histograms, so any node's histograms cover both ends of a
+# migration. They are written to a JSON file every TRACE_DUMP_INTERVAL
+# seconds; `python3 tracing.py <file>` prints one.
+#
+# Stages: migration (whole source side), checkpoint, state_flush, placement,
+# stop, archive, transfer, extract, restore, spawn.
+
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+PERCENTILES = (50, 90, 99)
+# Raw samples kept per stage for percentiles; buckets count everything
+RECENT_SAMPLES = 1024
+MAX_TRACES = 256
+DUMP_INTERVAL = 10.0
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def span(trace, stage):
+    """trace.span(stage), or a no-op for untraced work"""
+    return trace.span(stage) if trace is not None else nullcontext()
+
+
+def record(trace, stage, started):
+    """Record a span that began at time.monotonic() `started`, for blocks too long for a with"""
+    if trace is not None:
+        trace.record(stage, time.monotonic() - started)
+
+
+def annotate(data, trace):
+    """Attach the trace ID and unreported spans to a RECOVERY message payload"""
+    if trace is not None:
+        data['trace'] = trace.context()
+    return data
+
+
+class Histogram:
+    """Bucketed durations with the most recent raw samples for percentiles"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, ms):
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.recent.append(ms)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+        summary = {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max, 3)
+        }
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(recent[min(len(recent) - 1, len(recent) * p // 100)], 3) if recent else 0.0
+        labels = [f"le_{bound}" for bound in BUCKETS_MS] + ['le_inf']
+        summary['buckets'] = {label: n for label, n in zip(labels, self.buckets) if n}
+        return summary
+
+
+class Trace:
+    """The spans of one migration recorded on this node"""
+
+    def __init__(self, tracer, trace_id, kind):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.kind = kind
+        self.pending = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage):
+        started = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.record(stage, time.monotonic() - started)
+
+    def record(self, stage, seconds):
+        ms = round(seconds * 1000, 3)
+        self.tracer.add_span(self.trace_id, self.tracer.node_id, stage, ms, self.kind)
+        with self.lock:
+            self.pending.append([stage, ms])
+
+    def context(self):
+        """The trace ID plus the spans not yet carried by a message"""
+        with self.lock:
+            spans, self.pending = self.pending, []
+        return {'id': self.trace_id, 'kind': self.kind, 'spans': spans}
+
+
+class Tracer:
+    """Creates traces and keeps per-stage histograms for this node and its peers"""
+
+    def __init__(self, node_id, communicator=None, dump_path=None, dump_interval=DUMP_INTERVAL):
+        self.node_id = str(node_id)
+        self.communicator = communicator
+        self.stages = {}
+        self.traces = OrderedDict()
+        self.active = {}
+        self.lock = threading.Lock()
+        if communicator is not None:
+            communicator.register_callback('RECOVERY', self._on_recovery)
+
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.running = True
+        self.dump_thread = None
+        if dump_path and dump_interval > 0:
+            self.dump_thread = threading.Thread(target=self._dump_loop, name='trace-dump')
+            self.dump_thread.daemon = True
+            self.dump_thread.start()
+
+    def start(self, kind='migration'):
+        return self.resume(new_trace_id(), kind)
+
+    def resume(self, trace_id, kind='migration'):
+        """The local part of a trace started elsewhere (or None for untraced work)"""
+        if not trace_id:
+            return None
+        with self.lock:
+            trace = self.active.get(trace_id)
+            if trace is None:
+                trace = self.active[trace_id] = Trace(self, trace_id, kind)
+            return trace
+
+    def finish(self, trace):
+        """Close the local part of a trace, reporting spans no message carried yet"""
+        if trace is None:
+            return
+        with self.lock:
+            self.active.pop(trace.trace_id, None)
+        if trace.pending and self.communicator is not None:
+            self.communicator.broadcast_message('RECOVERY', annotate({'action': 'trace_spans'}, trace))
+
+    def add_span(self, trace_id, node_id, stage, ms, kind=None):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.add(ms)
+
+            entry = self.traces.get(trace_id)
+            if entry is None:
+                entry = self.traces[trace_id] = {'kind': kind, 'started': time.time(), 'spans': []}
+                while len(self.traces) > MAX_TRACES:
+                    self.traces.popitem(last=False)
+            entry['spans'].append([str(node_id), stage, ms])
+
+    def percentile(self, stage, p):
+        """The p-th percentile (ms) of a stage's recent spans, or None before the first"""
+        with self.lock:
+            histogram = self.stages.get(stage)
+            recent = sorted(histogram.recent) if histogram else []
+        return recent[min(len(recent) - 1, len(recent) * p // 100)] if recent else None
+
+    def _on_recovery(self, message):
+        trace = message['data'].get('trace')
+        if not trace or message['source'] == self.node_id:
+            return
+        for stage, ms in trace.get('spans', []):
+            self.add_span(trace['id'], message['source'], stage, ms, trace.get('kind'))
+
+    def snapshot(self, traces=20):
+        with self.lock:
+            return {
+                'node': self.node_id,
+                'timestamp': time.time(),
+                'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                'traces': {trace_id: dict(entry, spans=list(entry['spans']))
+                           for trace_id, entry in list(self.traces.items())[-traces:]}
+            }
+
+    def dump(self, path=None):
+        """Write the snapshot atomically so readers never see a partial file"""
+        path = path or self.dump_path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _dump_loop(self):
+        while self.running:
+            time.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"Could not write migration traces: {e}")
+
+    def close(self):
+        self.running = False
+        if self.dump_path:
+            try:
+                self.dump()
+            except OSError:
+                pass
+
+
+def create_tracer(node_id, communicator):
+    """Tracer dumping to TRACE_DUMP (default /tmp/migration_traces_<node>.json) unless TRACE_DUMP_INTERVAL=0"""
+    dump_path = os.environ.get('TRACE_DUMP', f"/tmp/migration_traces_{node_id}.json")
+    interval = float(os.environ.get('TRACE_DUMP_INTERVAL', DUMP_INTERVAL))
+    return Tracer(node_id, communicator, dump_path if interval > 0 else None, interval)
+
+
+def format_snapshot(snapshot):
+    lines = [f"Migration stages seen by node {snapshot['node']}:",
+             f"  {'stage':<12}{'count':>7}{'mean':>10}" + ''.join(f"{f'p{p}':>10}" for p in PERCENTILES) + f"{'max':>10}"]
+    for stage, summary in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['mean_ms']):
+        lines.append(f"  {stage:<12}{summary['count']:>7}{summary['mean_ms']:>10.1f}"
+                     + ''.join(f"{summary[f'p{p}_ms']:>10.1f}" for p in PERCENTILES) + f"{summary['max_ms']:>10.1f}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else f"/tmp/migration_traces_{os.environ.get('NODE_ID', '1')}.json"
+    with open(path, 'r') as f:
+        print(format_snapshot(json.load(f)))
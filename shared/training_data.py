@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import argparse
+import base64
+import urllib.parse
+import urllib.request
+from datetime import datetime
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from ml_fault_detector import WINDOW, FEATURES, FEATURE_SCALE, FEATURE_CLIP, SAMPLE_INTERVAL, model_info_path
+
+# Training data for the fault prediction model, built from InfluxDB.
+#
+# Telegraf writes node metrics (cpu, mem, system) and per-process metrics
+# (procstat) to the telegraf database; recorded FAULT and RECOVERY messages
+# live in the events measurement. The export walks the requested time range
+# one span at a time with chunked InfluxQL queries, puts every series on a
+# regular grid, and writes each process's feature rows to columnar shards:
+#
+#   shard_00000/features.npy   float16 [rows, len(FEATURES)], scaled
+#   shard_00000/starts.npy     int64   first row of each training window
+#   shard_00000/labels.npy     int8    1 if a fault followed the window
+#   shard_00000/end_times.npy  int64   epoch seconds of each window's last row
+#   manifest.json              shard list, window size, interval, features, counts
+#
+# Windows are never materialized on disk: a reader memory-maps features.npy
+# and gathers windows from a sliding view of it, so shards are about WINDOW
+# times smaller than stored windows and nothing needs the whole set in RAM.
+
+INFLUX_URL = os.environ.get('INFLUX_URL', 'http://influxdb:8086')
+INFLUX_DB = os.environ.get('INFLUX_DB', 'telegraf')
+INFLUX_USER = os.environ.get('INFLUX_USER', 'admin')
+INFLUX_PASSWORD = os.environ.get('INFLUX_PASSWORD', 'adminpassword')
+
+QUERY_SPAN = 6 * 3600
+QUERY_CHUNK_SIZE = 10000
+HORIZON = 60
+RECOVERY_TIMEOUT = 120
+SHARD_WINDOWS = 1 << 18
+
+EVENTS_MEASUREMENT = 'events'
+FAULT_KINDS = ('cpu_stress', 'memory_leak', 'process_kill', 'node_failure')
+# Only these faults hit the process their pid names; the pid of any other
+# fault (the memory_leak helper, say) is not a supervised process, so those
+# count against every process on the host
+PROCESS_FAULT_KINDS = ('process_kill', 'force_migration')
+RECOVERY_KINDS = ('service_restored', 'service_restarted', 'checkpoint_transferred')
+
+NODE_QUERIES = [
+    'SELECT 100 - mean("usage_idle") AS "node_cpu" FROM "cpu" '
+    'WHERE "cpu" = \'cpu-total\' AND {where} GROUP BY time({interval}s), "host" fill(previous)',
+    'SELECT mean("used_percent") AS "node_mem", '
+    '100 * (1 - mean("swap_free") / mean("swap_total")) AS "node_swap" FROM "mem" '
+    'WHERE {where} GROUP BY time({interval}s), "host" fill(previous)',
+    'SELECT mean("load1") / last("n_cpus") AS "node_load" FROM "system" '
+    'WHERE {where} GROUP BY time({interval}s), "host" fill(previous)'
+]
+PROCESS_QUERY = (
+    'SELECT mean("cpu_usage") AS "proc_cpu", mean("memory_usage") AS "proc_mem", '
+    'mean("num_threads") AS "proc_threads", '
+    'max("voluntary_context_switches") + max("involuntary_context_switches") AS "proc_ctx" '
+    'FROM "procstat" WHERE {where} GROUP BY time({interval}s), "host", "pid" fill(previous)'
+)
+# InfluxQL drops points whose selected fields are all null, so the
+# always-present payload field keeps events that carry no pid
+EVENTS_QUERY = 'SELECT "payload", "pid", "kind", "type", "node" FROM "{measurement}" WHERE {where}'
+
+
+def parse_time(value):
+    """Epoch seconds from an RFC 3339 timestamp"""
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+def _where(start, end):
+    return f"time >= {start}s AND time < {end}s"
+
+
+class InfluxQLClient:
+    """Streams InfluxQL results from the InfluxDB 1.x /query endpoint"""
+
+    def __init__(self, url=INFLUX_URL, database=INFLUX_DB, user=INFLUX_USER, password=INFLUX_PASSWORD,
+                 chunk_size=QUERY_CHUNK_SIZE, timeout=60):
+        self.url = url.rstrip('/')
+        self.database = database
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.headers = {}
+        if user:
+            token = base64.b64encode(f"{user}:{password}".encode()).decode()
+            self.headers['Authorization'] = f"Basic {token}"
+
+    def query(self, statement):
+        """Yield (name, tags, columns, values) for every partial series in the response"""
+        params = urllib.parse.urlencode({
+            'db': self.database,
+            'q': statement,
+            'epoch': 's',
+            'chunked': 'true',
+            'chunk_size': self.chunk_size
+        })
+        request = urllib.request.Request(f"{self.url}/query?{params}", headers=self.headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            # Chunked responses are one JSON document per line
+            for line in response:
+                if not line.strip():
+                    continue
+                for result in json.loads(line).get('results', []):
+                    if 'error' in result:
+                        raise RuntimeError(f"InfluxDB query failed: {result['error']}")
+                    for series in result.get('series', []):
+                        yield series['name'], series.get('tags', {}), series['columns'], series['values']
+
+
+def _to_grid(columns, values, start, count, interval, names):
+    """Scatter query rows onto a grid of `count` slots starting at `start`"""
+    grid = np.full((count, len(names)), np.nan, dtype=np.float64)
+    if not values:
+        return grid
+    # NumPy turns the nulls of fill(previous) gaps into NaN
+    rows = np.array(values, dtype=np.float64)
+    slots = ((rows[:, 0] - start) // interval).astype(np.int64)
+    keep = (slots >= 0) & (slots < count)
+    for i, name in enumerate(names):
+        grid[slots[keep], i] = rows[keep, columns.index(name)]
+    return grid
+
+
+def _forward_fill(values):
+    """Fill NaNs down each column with the last valid value above them"""
+    valid = ~np.isnan(values)
+    index = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    filled = values[index, np.arange(values.shape[1])]
+    # Leading NaNs have nothing to copy from
+    filled[~np.maximum.accumulate(valid, axis=0)] = np.nan
+    return filled
+
+
+class EventTimeline:
+    """Fault times and fault-to-recovery intervals per host, for labelling windows"""
+
+    def __init__(self, events, horizon=HORIZON, recovery_timeout=RECOVERY_TIMEOUT):
+        self.horizon = horizon
+        self.faults = {}
+        self.outages = {}
+        by_host = {}
+        for event in sorted(events, key=lambda event: event['time']):
+            by_host.setdefault(event['host'], []).append(event)
+
+        for host, host_events in by_host.items():
+            faults = [event for event in host_events if event['kind'] in FAULT_KINDS]
+            recoveries = np.array([event['time'] for event in host_events if event['kind'] in RECOVERY_KINDS],
+                                  dtype=np.int64)
+            self.faults[host] = faults
+
+            # A fault lasts until the next recovery on the host, or the timeout
+            starts = np.array([event['time'] for event in faults], dtype=np.int64)
+            following = np.searchsorted(recoveries, starts, side='right')
+            ends = starts + recovery_timeout
+            has_recovery = following < len(recoveries)
+            ends[has_recovery] = np.minimum(ends[has_recovery], recoveries[following[has_recovery]])
+            self.outages[host] = (starts, ends)
+
+    def _fault_times(self, host, pid):
+        # Process faults naming another process are not this process's fault
+        return np.array([event['time'] for event in self.faults.get(host, [])
+                         if event['kind'] not in PROCESS_FAULT_KINDS or event['pid'] == pid], dtype=np.int64)
+
+    def label(self, host, pid, end_times):
+        """Return (labels, usable) for windows ending at `end_times`.
+
+        A window is labelled 1 when a fault hits its process or host within
+        the horizon after it ends. Windows ending during an outage describe a
+        system that already failed and are left out.
+        """
+        faults = self._fault_times(host, pid)
+        labels = np.zeros(len(end_times), dtype=np.int8)
+        if len(faults):
+            following = np.searchsorted(faults, end_times, side='right')
+            in_range = following < len(faults)
+            labels[in_range] = faults[following[in_range]] <= end_times[in_range] + self.horizon
+
+        usable = np.ones(len(end_times), dtype=bool)
+        starts, ends = self.outages.get(host, (np.empty(0, np.int64), np.empty(0, np.int64)))
+        if len(starts):
+            latest = np.searchsorted(starts, end_times, side='right') - 1
+            started = latest >= 0
+            # Outages can overlap, so compare against the furthest end so far
+            furthest = np.maximum.accumulate(ends)
+            usable[started] = end_times[started] >= furthest[latest[started]]
+        return labels, usable
+
+
+class ShardWriter:
+    """Appends per-series feature blocks and their windows to columnar shards"""
+
+    def __init__(self, out_dir, shard_windows=SHARD_WINDOWS):
+        self.out_dir = out_dir
+        self.shard_windows = shard_windows
+        self.shards = []
+        self.total_windows = 0
+        self.positives = 0
+        self._reset()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _reset(self):
+        self.features = []
+        self.starts = []
+        self.labels = []
+        self.end_times = []
+        self.rows = 0
+        self.windows = 0
+
+    def add(self, features, starts, labels, end_times):
+        """Add a block of feature rows and the windows (by start row) to train on"""
+        if not len(starts):
+            return
+        self.features.append(features.astype(np.float16))
+        self.starts.append(starts + self.rows)
+        self.labels.append(labels)
+        self.end_times.append(end_times)
+        self.rows += len(features)
+        self.windows += len(starts)
+        if self.windows >= self.shard_windows:
+            self.flush()
+
+    def flush(self):
+        if not self.windows:
+            return
+        name = f"shard_{len(self.shards):05d}"
+        shard_dir = os.path.join(self.out_dir, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        labels = np.concatenate(self.labels)
+        np.save(os.path.join(shard_dir, 'features.npy'), np.concatenate(self.features))
+        np.save(os.path.join(shard_dir, 'starts.npy'), np.concatenate(self.starts))
+        np.save(os.path.join(shard_dir, 'labels.npy'), labels)
+        np.save(os.path.join(shard_dir, 'end_times.npy'), np.concatenate(self.end_times))
+        self.shards.append({'name': name, 'rows': self.rows, 'windows': self.windows,
+                            'positives': int(labels.sum())})
+        self.total_windows += self.windows
+        self.positives += int(labels.sum())
+        self._reset()
+
+    def close(self, metadata):
+        self.flush()
+        manifest = dict(metadata, window=WINDOW, features=list(FEATURES),
+                        feature_scale=FEATURE_SCALE.tolist(), shards=self.shards,
+                        windows=self.total_windows, positives=self.positives)
+        with open(os.path.join(self.out_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def _scale(features):
+    features = features.astype(np.float32)
+    np.divide(features, FEATURE_SCALE, out=features)
+    np.clip(features, 0.0, FEATURE_CLIP, out=features)
+    return features
+
+
+def read_events(client, start, end):
+    """Recorded FAULT and RECOVERY events as {'time', 'host', 'kind', 'pid'} dicts"""
+    events = []
+    for _, _, columns, values in client.query(EVENTS_QUERY.format(measurement=EVENTS_MEASUREMENT,
+                                                                  where=_where(start, end))):
+        for row in values:
+            event = dict(zip(columns, row))
+            events.append({
+                'time': int(event['time']),
+                'host': event['node'],
+                'kind': event['kind'],
+                'pid': int(event['pid']) if event.get('pid') is not None else None
+            })
+    return events
+
+
+def export_training_data(client, start, end, out_dir, interval=SAMPLE_INTERVAL, span=QUERY_SPAN,
+                         stride=1, horizon=HORIZON, shard_windows=SHARD_WINDOWS):
+    """Export [start, end) to columnar shards in out_dir and return the manifest"""
+    start -= start % interval
+    timeline = EventTimeline(read_events(client, start, end + horizon), horizon)
+    writer = ShardWriter(out_dir, shard_windows)
+
+    # The last WINDOW - 1 rows (and the context-switch counter) of every
+    # process carry into the next span, so windows cross span boundaries
+    carry = {}
+    node_names = ['node_cpu', 'node_mem', 'node_swap', 'node_load']
+    process_names = ['proc_cpu', 'proc_mem', 'proc_threads', 'proc_ctx']
+
+    for span_start in range(start, end, span):
+        span_end = min(span_start + span, end)
+        count = (span_end - span_start) // interval
+        if count <= 0:
+            continue
+        times = span_start + interval * np.arange(count, dtype=np.int64)
+
+        nodes = {}
+        for query in NODE_QUERIES:
+            for _, tags, columns, values in client.query(query.format(where=_where(span_start, span_end),
+                                                                       interval=interval)):
+                grid = nodes.setdefault(tags['host'], np.full((count, 4), np.nan))
+                names = [name for name in node_names if name in columns]
+                part = _to_grid(columns, values, span_start, count, interval, names)
+                for i, name in enumerate(names):
+                    filled = ~np.isnan(part[:, i])
+                    grid[filled, node_names.index(name)] = part[filled, i]
+
+        processes = {}
+        for _, tags, columns, values in client.query(PROCESS_QUERY.format(where=_where(span_start, span_end),
+                                                                          interval=interval)):
+            key = (tags['host'], int(tags['pid']))
+            part = _to_grid(columns, values, span_start, count, interval, process_names)
+            if key in processes:
+                filled = ~np.isnan(part)
+                processes[key][filled] = part[filled]
+            else:
+                processes[key] = part
+
+        for (host, pid), process in processes.items():
+            node = nodes.get(host)
+            if node is None:
+                continue
+            node = _forward_fill(node)
+            # Hosts without swap report NaN for it
+            node[:, 2] = np.nan_to_num(node[:, 2])
+
+            previous_ctx, previous_rows, previous_times = carry.get((host, pid), (np.nan, None, None))
+            if previous_times is not None and previous_times[-1] != times[0] - interval:
+                previous_ctx = np.nan
+            process = _forward_fill(process)
+            counters = np.concatenate([[previous_ctx], process[:, 3]])
+            process[:, 3] = np.clip(np.diff(counters) / interval, 0.0, None)
+
+            rows = _scale(np.hstack([process, node]))
+            row_times = times
+            if previous_rows is not None and previous_times[-1] == times[0] - interval:
+                rows = np.vstack([previous_rows, rows])
+                row_times = np.concatenate([previous_times, times])
+            if len(rows) >= WINDOW:
+                carry[(host, pid)] = (counters[-1], rows[-(WINDOW - 1):], row_times[-(WINDOW - 1):])
+            else:
+                carry[(host, pid)] = (counters[-1], rows, row_times)
+                continue
+
+            # Windows containing a gap are dropped; NaN rows are kept so row
+            # indices stay aligned with the sliding view readers build
+            complete = ~np.isnan(rows).any(axis=1)
+            whole = sliding_window_view(complete, WINDOW).all(axis=1)
+            starts = np.arange(0, len(rows) - WINDOW + 1, stride, dtype=np.int64)
+            starts = starts[whole[starts]]
+            end_times = row_times[starts + WINDOW - 1]
+            labels, usable = timeline.label(host, pid, end_times)
+            writer.add(np.nan_to_num(rows), starts[usable], labels[usable], end_times[usable])
+
+    return writer.close({'start': start, 'end': end, 'interval': interval, 'horizon': horizon, 'stride': stride})
+
+
+class TrainingShards:
+    """Reads exported shards as memory-mapped windows"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        with open(os.path.join(data_dir, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        self.window = self.manifest['window']
+
+    def __len__(self):
+        return self.manifest['windows']
+
+    def _open(self, shard):
+        shard_dir = os.path.join(self.data_dir, shard['name'])
+        features = np.load(os.path.join(shard_dir, 'features.npy'), mmap_mode='r')
+        # [windows, window, features] view over the memory-mapped rows; nothing is copied yet
+        windows = sliding_window_view(features, self.window, axis=0).transpose(0, 2, 1)
+        return windows, np.load(os.path.join(shard_dir, 'starts.npy')), np.load(os.path.join(shard_dir, 'labels.npy'))
+
+    def batches(self, batch_size=256, shuffle=True, seed=None):
+        """Yield (X float32 [batch, window, features], y float32 [batch]) one shard at a time"""
+        rng = np.random.default_rng(seed)
+        shards = list(self.manifest['shards'])
+        if shuffle:
+            rng.shuffle(shards)
+        for shard in shards:
+            windows, starts, labels = self._open(shard)
+            order = rng.permutation(len(starts)) if shuffle else np.arange(len(starts))
+            for offset in range(0, len(order), batch_size):
+                picked = order[offset:offset + batch_size]
+                yield windows[starts[picked]].astype(np.float32), labels[picked].astype(np.float32)
+
+
+def train(data_dir, model_path, epochs=5, batch_size=256):
+    """Train the fault model on exported shards, streaming one batch at a time"""
+    import tensorflow as tf
+
+    shards = TrainingShards(data_dir)
+    manifest = shards.manifest
+    positives = max(manifest['positives'], 1)
+    negatives = max(len(shards) - manifest['positives'], 1)
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(shards.window, len(FEATURES))),
+        tf.keras.layers.LSTM(64),
+        tf.keras.layers.Dropout(0.3),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.Dense(1, activation='sigmoid')
+    ])
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['AUC'])
+
+    signature = (tf.TensorSpec((None, shards.window, len(FEATURES)), tf.float32), tf.TensorSpec((None,), tf.float32))
+    dataset = tf.data.Dataset.from_generator(lambda: shards.batches(batch_size), output_signature=signature)
+    # Faults are rare; weight the classes so the model does not learn "never"
+    model.fit(dataset.prefetch(2), epochs=epochs,
+              class_weight={0: len(shards) / (2 * negatives), 1: len(shards) / (2 * positives)})
+    model.save(model_path)
+    # The detector samples at the interval recorded here
+    with open(model_info_path(model_path), 'w') as f:
+        json.dump({key: manifest[key] for key in ('interval', 'window', 'features', 'feature_scale')}, f, indent=2)
+    return model_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fault model training data')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Export InfluxDB history to training shards')
+    export_parser.add_argument('--start', type=str, help='RFC 3339 start time (default: --days ago)')
+    export_parser.add_argument('--end', type=str, help='RFC 3339 end time (default: now)')
+    export_parser.add_argument('--days', type=float, default=7)
+    export_parser.add_argument('--out', type=str, required=True)
+    export_parser.add_argument('--stride', type=int, default=1, help='Rows between consecutive windows')
+    export_parser.add_argument('--horizon', type=int, default=HORIZON, help='Seconds after a window a fault counts')
+    export_parser.add_argument('--span', type=int, default=QUERY_SPAN, help='Seconds of history per query')
+    train_parser = subparsers.add_parser('train', help='Train the fault model on exported shards')
+    train_parser.add_argument('--data', type=str, required=True)
+    train_parser.add_argument('--model', type=str, default='my_model.keras')
+    train_parser.add_argument('--epochs', type=int, default=5)
+    train_parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        end = parse_time(args.end) if args.end else int(time.time())
+        start = parse_time(args.start) if args.start else end - int(args.days * 86400)
+        started = time.monotonic()
+        manifest = export_training_data(InfluxQLClient(), start, end, args.out, span=args.span,
+                                        stride=args.stride, horizon=args.horizon)
+        print(f"Exported {manifest['windows']} windows ({manifest['positives']} positive) in "
+              f"{len(manifest['shards'])} shards to {args.out} in {time.monotonic() - started:.1f}s")
+    else:
+        train(args.data, args.model, args.epochs, args.batch_size)
+        print(f"Saved model to {args.model}")
@@ -0,0 +1,873 @@
+import os
+import json
+import time
+import struct
+import zlib
+import hashlib
+import asyncio
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import zmq
+from checkpoint_codecs import (CODECS, PROBE_BYTES, CodecSelector, RawCodec, available_codecs, compress_chunk,
+                               decompress_chunk)
+
+# Streaming checkpoint transfer protocol.
+#
+# The sender (DEALER) offers a spooled archive, the receiver (ROUTER) answers
+# with the first chunk it still needs and an initial credit window. Chunks are
+# sent as binary multipart frames [CHUNK, transfer_id, seq+codec+crc32, payload]
+# and every chunk is answered with exactly one ACK or NACK, each of which returns a
+# credit to the sender. The receiver writes chunks straight to a .part file, so
+# neither side holds more than `window` chunks in memory, and a re-sent OFFER
+# for the same transfer resumes after the last chunk that reached the disk.
+# A chunk that fails its crc32 is NACKed and re-sent, at most max_retries
+# times; one that arrives intact but cannot be decoded or stored (it does not
+# decompress, or does not match its content hash) ends the transfer with ERROR.
+#
+# Incremental transfers replace the OFFER with a HAVE carrying a checkpoint
+# manifest. The receiver answers WANT with the chunk hashes missing from its
+# CheckpointStore, and the CHUNK sequence numbers index into that list. Chunks
+# land in the store as they arrive, so a re-sent HAVE only wants what is left.
+#
+# ACCEPT and WANT list the codecs the receiver can decode; the sender picks
+# one per transfer and compresses each chunk with it, or sends it raw (see
+# checkpoint_codecs.py). The crc32 covers the payload as sent, and the
+# decompressed chunk goes on to the .part file or the store.
+#
+# OFFER, HAVE, CHUNK, DONE and ABORT all carry the transfer ID as their second
+# frame, so a TransferServer can route every frame of a transfer to the same
+# worker and turn away new transfers with BUSY when it is at capacity.
+#
+# Before a migration the source asks the target to RESERVE capacity for the
+# service ([RESERVE, reservation_id, request]); the target answers RESERVED
+# with whether it granted it (see admission.py). A source whose migration
+# does not go ahead hands the capacity back with [RELEASE, reservation_id],
+# answered by RELEASED, instead of leaving it held until it expires.
+#
+# A sender that gives up on a transfer (its caller timed out) sends
+# [ABORT, transfer_id]. The receiver drops the transfer if it is still in
+# progress and answers ABORTED with whether it had already completed it, so
+# the source only restores the service locally when the target will not.
+
+CHUNK_SIZE = 256 * 1024
+CREDIT_WINDOW = 8
+REPLY_TIMEOUT_MS = 5000
+COMPLETE_TIMEOUT_MS = 30000
+MAX_RETRIES = 3
+BUSY_TIMEOUT = 30.0
+RESERVE_TIMEOUT_MS = 2000
+# An aborting caller has already timed out, so it waits only this long to
+# learn whether the receiver committed the transfer
+ABORT_TIMEOUT_MS = 2000
+
+# Receiving side
+RECEIVE_WORKERS = 4
+MAX_INBOUND_TRANSFERS = 4
+TRANSFER_IDLE_TIMEOUT = 60.0
+BUSY_RETRY_AFTER = 0.5
+# Completed transfers each worker remembers, to answer a late ABORT
+COMPLETED_MEMORY = 256
+
+OFFER = b'OFFER'
+ACCEPT = b'ACCEPT'
+HAVE = b'HAVE'
+WANT = b'WANT'
+CHUNK = b'CHUNK'
+ACK = b'ACK'
+NACK = b'NACK'
+DONE = b'DONE'
+COMPLETE = b'COMPLETE'
+ERROR = b'ERROR'
+BUSY = b'BUSY'
+RESERVE = b'RESERVE'
+RESERVED = b'RESERVED'
+RELEASE = b'RELEASE'
+RELEASED = b'RELEASED'
+ABORT = b'ABORT'
+ABORTED = b'ABORTED'
+
+_CHUNK_HEADER = struct.Struct('!QBI')  # sequence number, codec id, crc32 of payload
+_NACK_BODY = struct.Struct('!QQ')     # next expected sequence, sequence received
+_SEQ = struct.Struct('!Q')
+
+
+def file_digest(path, block_size=CHUNK_SIZE):
+    """Return (size, sha256 hex digest) of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def make_transfer_id(source_node, name, digest):
+    """Transfer IDs are derived from the content so a retried offer resumes the same transfer"""
+    return hashlib.sha256(f"{source_node}:{name}:{digest}".encode()).hexdigest()[:32]
+
+
+class TransferTimeout(Exception):
+    pass
+
+
+class TransferCancelled(Exception):
+    """An async transfer was cancelled and aborted on the receiver.
+
+    `committed` is True if the receiver had already completed the transfer
+    (and will restore the checkpoint), False if it dropped it, and None if it
+    did not answer the ABORT.
+    """
+
+    def __init__(self, transfer_id, committed):
+        super().__init__(f"Transfer {transfer_id} cancelled")
+        self.transfer_id = transfer_id
+        self.committed = committed
+
+
+class CheckpointSender:
+    """Streams archives or stored checkpoints to a CheckpointReceiver with credit-based flow control"""
+
+    def __init__(self, context, chunk_size=CHUNK_SIZE, window=CREDIT_WINDOW,
+                 timeout_ms=REPLY_TIMEOUT_MS, complete_timeout_ms=COMPLETE_TIMEOUT_MS,
+                 max_retries=MAX_RETRIES, selector=None):
+        self.context = context
+        self.chunk_size = chunk_size
+        self.window = window
+        self.timeout_ms = timeout_ms
+        self.complete_timeout_ms = complete_timeout_ms
+        self.max_retries = max_retries
+        # Chooses each transfer's chunk codec and learns the throughput to each peer
+        self.selector = selector or CodecSelector()
+
+    def send_file(self, endpoint, path, meta):
+        """Send a file to the receiver at endpoint, resuming on timeouts.
+
+        Returns the receiver's completion reply as a dict.
+        """
+        offer = self._file_offer(path, meta)
+        with open(path, 'rb') as f:
+            return self._send(endpoint, OFFER, ACCEPT, offer, self._file_plan(f, offer))
+
+    def reserve(self, endpoint, request):
+        """Ask a TransferServer to reserve capacity; returns its reply, denied if it does not answer"""
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint)
+        try:
+            socket.send_multipart([RESERVE, request['reservation_id'].encode(), json.dumps(request).encode()])
+            if not socket.poll(RESERVE_TIMEOUT_MS, zmq.POLLIN):
+                return {'granted': False, 'reason': f"no reply within {RESERVE_TIMEOUT_MS}ms"}
+            command, *frames = socket.recv_multipart()
+            if command != RESERVED:
+                return {'granted': False, 'reason': f"unexpected reply {command.decode()}"}
+            return json.loads(frames[0])
+        finally:
+            socket.close()
+
+    def release(self, endpoint, reservation_id):
+        """Hand back a reservation the migration will not use; False if the target does not answer"""
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint)
+        try:
+            socket.send_multipart([RELEASE, reservation_id.encode()])
+            if not socket.poll(RESERVE_TIMEOUT_MS, zmq.POLLIN):
+                return False
+            command, *_ = socket.recv_multipart()
+            return command == RELEASED
+        finally:
+            socket.close()
+
+    def send_manifest(self, endpoint, store, manifest, meta):
+        """Send the chunks of a stored checkpoint that the receiver does not already have"""
+        return self._send(endpoint, HAVE, WANT, self._manifest_offer(manifest, meta), self._manifest_plan(store))
+
+    def _file_offer(self, path, meta):
+        size, digest = file_digest(path, self.chunk_size)
+        offer = dict(meta)
+        offer.update({
+            'transfer_id': make_transfer_id(meta.get('source_node', ''), meta.get('checkpoint_name', ''), digest),
+            'size': size,
+            'sha256': digest,
+            'chunk_size': self.chunk_size,
+            'total_chunks': (size + self.chunk_size - 1) // self.chunk_size
+        })
+        return offer
+
+    def _file_plan(self, f, offer):
+        def read_chunk(seq):
+            f.seek(seq * self.chunk_size)
+            return f.read(self.chunk_size)
+        return lambda accepted: (accepted['next_seq'], offer['total_chunks'], read_chunk)
+
+    def _manifest_offer(self, manifest, meta):
+        manifest_digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+        offer = dict(meta)
+        offer.update({
+            'transfer_id': make_transfer_id(meta.get('source_node', ''), manifest['id'], manifest_digest),
+            'manifest': manifest
+        })
+        return offer
+
+    def _manifest_plan(self, store):
+        def plan(accepted):
+            want = accepted['want']
+            return 0, len(want), lambda seq: store.read_chunk(want[seq])
+        return plan
+
+    def _send(self, endpoint, offer_command, accept_command, offer, plan):
+        busy_deadline = time.monotonic() + BUSY_TIMEOUT
+        attempt = 0
+        while attempt <= self.max_retries:
+            socket = self.context.socket(zmq.DEALER)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(endpoint)
+            try:
+                reply = self._drive(socket, self._protocol(offer_command, accept_command, offer, plan, endpoint))
+            except TransferTimeout as e:
+                attempt += 1
+                print(f"Transfer {offer['transfer_id']} to {endpoint} stalled ({e}), "
+                      f"retry {attempt}/{self.max_retries}")
+                continue
+            finally:
+                socket.close()
+
+            # The receiver is at its inbound limit; wait for a slot
+            if reply.get('busy') and time.monotonic() < busy_deadline:
+                time.sleep(reply.get('retry_after', BUSY_RETRY_AFTER))
+                continue
+            return reply
+
+        return {'success': False, 'error': 'Transfer timed out'}
+
+    def _drive(self, socket, protocol):
+        """Run the protocol generator against a blocking socket"""
+        try:
+            action, arg = next(protocol)
+            while True:
+                if action == 'send':
+                    socket.send_multipart(arg, copy=False)
+                    result = None
+                else:
+                    if not socket.poll(arg, zmq.POLLIN):
+                        raise TransferTimeout(f"no reply within {arg}ms")
+                    result = socket.recv_multipart()
+                action, arg = protocol.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    def _protocol(self, offer_command, accept_command, offer, plan, endpoint):
+        """Sender side of the protocol as a generator.
+
+        Yields ('send', frames) and ('recv', timeout_ms) actions so the same
+        state machine runs over blocking and asyncio sockets. A 'recv' action
+        is answered with the received frames.
+        """
+        transfer_id = offer['transfer_id'].encode()
+        yield 'send', [offer_command, transfer_id, json.dumps(offer).encode()]
+        command, *frames = yield 'recv', self.timeout_ms
+        if command != accept_command:
+            return _error_reply(command, frames)
+
+        accepted = json.loads(frames[0])
+        next_seq, total, read_chunk = plan(accepted)
+        acked = next_seq
+        credit = accepted['credit']
+        bytes_sent = 0
+        bytes_raw = 0
+        chunks_sent = 0
+        if next_seq:
+            print(f"Resuming transfer {offer['transfer_id']} at chunk {next_seq}/{total}")
+        # An unmeasured link is probed with raw chunks before a codec is chosen for the rest
+        probing = self.selector.needs_probe(endpoint)
+        if probing:
+            codec = CODECS[RawCodec.codec_id]
+            probe_bytes, probe_last = 0, None
+        else:
+            codec = self.selector.choose(endpoint, accepted.get('codecs'), next_seq, total, read_chunk)
+        compress_seconds = 0.0
+        rewinds = {}
+        started = time.perf_counter()
+
+        while acked < total:
+            while credit > 0 and next_seq < total and not (probing and probe_last is not None):
+                chunk = read_chunk(next_seq)
+                compress_started = time.perf_counter()
+                payload, codec_id = compress_chunk(codec, chunk)
+                compress_seconds += time.perf_counter() - compress_started
+                header = _CHUNK_HEADER.pack(next_seq, codec_id, zlib.crc32(payload))
+                yield 'send', [CHUNK, transfer_id, header, payload]
+                bytes_sent += len(payload)
+                bytes_raw += len(chunk)
+                chunks_sent += 1
+                if probing:
+                    probe_bytes += len(payload)
+                    if probe_bytes >= PROBE_BYTES:
+                        probe_last = next_seq
+                next_seq += 1
+                credit -= 1
+
+            command, *frames = yield 'recv', self.timeout_ms
+            if command == ACK:
+                acked = max(acked, _SEQ.unpack(frames[1])[0])
+                credit += 1
+                if probing and probe_last is not None and acked > probe_last:
+                    self.selector.record_link(endpoint, probe_bytes, time.perf_counter() - started)
+                    probing = False
+                    codec = self.selector.choose(endpoint, accepted.get('codecs'), next_seq, total, read_chunk)
+            elif command == NACK:
+                expected, received = _NACK_BODY.unpack(frames[1])
+                credit += 1
+                # Only a corrupt chunk rewinds the stream; NACKs for the
+                # chunks already in flight behind it just return credit.
+                if received == expected:
+                    rewinds[expected] = rewinds.get(expected, 0) + 1
+                    if rewinds[expected] > self.max_retries:
+                        return {'success': False,
+                                'error': f"Chunk {expected} rejected {rewinds[expected]} times"}
+                    next_seq = expected
+                    # Sending is held at the probe's last chunk; the probe now
+                    # ends at the chunk being re-sent, or nothing would be sent
+                    if probing and probe_last is not None and expected <= probe_last:
+                        probe_last = None
+            else:
+                return _error_reply(command, frames)
+
+        elapsed = time.perf_counter() - started
+        yield 'send', [DONE, transfer_id]
+        command, *frames = yield 'recv', self.complete_timeout_ms
+        if command != COMPLETE:
+            return _error_reply(command, frames)
+        reply = json.loads(frames[1])
+        self.selector.record_link(endpoint, bytes_sent, elapsed,
+                                  max(compress_seconds, reply.get('busy_seconds', 0.0)))
+        reply['bytes_sent'] = bytes_sent
+        reply['bytes_raw'] = bytes_raw
+        reply['chunks_sent'] = chunks_sent
+        reply['codec'] = codec.name
+        return reply
+
+
+class AsyncCheckpointSender(CheckpointSender):
+    """CheckpointSender for asyncio code; `context` must be a zmq.asyncio.Context.
+
+    Hashing the archive and every protocol step (reading, compressing and
+    sampling chunks) run in worker threads, so a large checkpoint never
+    stalls the event loop. A transfer cancelled by its caller is aborted on
+    the receiver and ends in TransferCancelled.
+    """
+
+    async def send_file(self, endpoint, path, meta):
+        offer = await asyncio.to_thread(self._file_offer, path, meta)
+        with open(path, 'rb') as f:
+            return await self._send(endpoint, OFFER, ACCEPT, offer, self._file_plan(f, offer))
+
+    async def send_manifest(self, endpoint, store, manifest, meta):
+        return await self._send(endpoint, HAVE, WANT, self._manifest_offer(manifest, meta), self._manifest_plan(store))
+
+    async def abort(self, endpoint, transfer_id):
+        """Drop a transfer on the receiver; its ABORTED reply, or None if it does not answer"""
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint)
+        try:
+            await socket.send_multipart([ABORT, transfer_id.encode()])
+            # An ABORT queues behind a DONE whose checkpoint is still being unpacked;
+            # a receiver that has not answered within ABORT_TIMEOUT_MS is taken to be down
+            if not await socket.poll(ABORT_TIMEOUT_MS, zmq.POLLIN):
+                return None
+            command, *frames = await socket.recv_multipart()
+            return json.loads(frames[-1]) if command == ABORTED else None
+        finally:
+            socket.close()
+
+    async def _send(self, endpoint, offer_command, accept_command, offer, plan):
+        try:
+            return await self._attempts(endpoint, offer_command, accept_command, offer, plan)
+        except asyncio.CancelledError:
+            # The caller is giving up and may restore the checkpoint itself; find out whether
+            # the receiver already has, and stop it if not
+            reply = await self.abort(endpoint, offer['transfer_id'])
+            raise TransferCancelled(offer['transfer_id'], reply.get('committed') if reply else None)
+
+    async def _attempts(self, endpoint, offer_command, accept_command, offer, plan):
+        busy_deadline = time.monotonic() + BUSY_TIMEOUT
+        attempt = 0
+        while attempt <= self.max_retries:
+            socket = self.context.socket(zmq.DEALER)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(endpoint)
+            try:
+                reply = await self._drive(socket, self._protocol(offer_command, accept_command, offer, plan,
+                                                                 endpoint))
+            except TransferTimeout as e:
+                attempt += 1
+                print(f"Transfer {offer['transfer_id']} to {endpoint} stalled ({e}), "
+                      f"retry {attempt}/{self.max_retries}")
+                continue
+            finally:
+                socket.close()
+
+            if reply.get('busy') and time.monotonic() < busy_deadline:
+                await asyncio.sleep(reply.get('retry_after', BUSY_RETRY_AFTER))
+                continue
+            return reply
+
+        return {'success': False, 'error': 'Transfer timed out'}
+
+    async def _drive(self, socket, protocol):
+        action, arg = await asyncio.to_thread(_advance, protocol, None)
+        while action != 'done':
+            if action == 'send':
+                await socket.send_multipart(arg, copy=False)
+                result = None
+            else:
+                if not await socket.poll(arg, zmq.POLLIN):
+                    raise TransferTimeout(f"no reply within {arg}ms")
+                result = await socket.recv_multipart()
+            action, arg = await asyncio.to_thread(_advance, protocol, result)
+        return arg
+
+
+def _advance(protocol, value):
+    """Run the protocol generator to its next action; ('done', reply) once it returns"""
+    try:
+        return protocol.send(value)
+    except StopIteration as stop:
+        return 'done', stop.value
+
+
+def _error_reply(command, frames):
+    if command in (ERROR, BUSY) and frames:
+        return json.loads(frames[-1])
+    return {'success': False, 'error': f"Unexpected reply {command!r}"}
+
+
+class _InboundFile:
+    """An archive being written chunk by chunk to a .part file"""
+
+    def __init__(self, offer, part_path):
+        self.offer = offer
+        self.part_path = part_path
+        self.chunk_size = offer['chunk_size']
+        self.total = offer['total_chunks']
+
+        # Whole chunks already on disk survive a restart of either side
+        done = 0
+        if os.path.exists(part_path):
+            done = min(os.path.getsize(part_path) // self.chunk_size, self.total)
+        self.file = open(part_path, 'ab+')
+        self.file.truncate(done * self.chunk_size)
+        self.file.seek(0, os.SEEK_END)
+        self.next_seq = done
+        self.last_activity = time.monotonic()
+        self.busy_seconds = 0.0
+
+    def write(self, seq, chunk):
+        self.file.write(chunk)
+
+    def verify(self):
+        self.close()
+        size, digest = file_digest(self.part_path)
+        return self.next_seq == self.total and size == self.offer['size'] and digest == self.offer['sha256']
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class _InboundManifest:
+    """The chunks of a manifest that are missing from the local store"""
+
+    def __init__(self, offer, store):
+        self.offer = offer
+        self.store = store
+        self.manifest = offer['manifest']
+        self.want = store.missing_chunks(
+            digest for entry in self.manifest['files'] for digest in entry['chunks'])
+        self.total = len(self.want)
+        self.next_seq = 0
+        self.last_activity = time.monotonic()
+        self.busy_seconds = 0.0
+
+    def write(self, seq, chunk):
+        self.store.put_chunk(self.want[seq], chunk)
+
+    def verify(self):
+        return self.next_seq == self.total
+
+    def discard(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CheckpointReceiver:
+    """Receiving side of the streaming protocol, driven by frames from a ROUTER socket.
+
+    `extract` is called with (archive_path, offer) once a whole archive has
+    been received and verified, and `materialize` with (manifest, offer) once
+    every chunk of an incremental transfer is in `store`. Both return the local
+    checkpoint directory.
+    """
+
+    def __init__(self, socket, spool_dir, extract, store=None, materialize=None, window=CREDIT_WINDOW):
+        self.socket = socket
+        self.spool_dir = spool_dir
+        self.extract = extract
+        self.store = store
+        self.materialize = materialize
+        self.window = window
+        self.transfers = {}
+        self.completed = deque(maxlen=COMPLETED_MEMORY)
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def handle(self, frames):
+        """Handle one multipart message from the ROUTER socket.
+
+        Returns (checkpoint_dir, offer) when a transfer completed, otherwise None.
+        """
+        identity, command, body = frames[0], frames[1], frames[2:]
+        try:
+            if command == OFFER:
+                self._on_offer(identity, json.loads(body[1]))
+            elif command == HAVE:
+                self._on_have(identity, json.loads(body[1]))
+            elif command == CHUNK:
+                self._on_chunk(identity, body)
+            elif command == DONE:
+                return self._on_done(identity, body[0].decode())
+            elif command == ABORT:
+                self._on_abort(identity, body[0].decode())
+            else:
+                self._reply_error(identity, 'Unknown action')
+        except Exception as e:
+            print(f"Error in transfer handler: {e}")
+            self._reply_error(identity, str(e))
+        return None
+
+    def _start(self, transfer):
+        existing = self.transfers.pop(transfer.offer['transfer_id'], None)
+        if existing:
+            existing.close()
+        self.transfers[transfer.offer['transfer_id']] = transfer
+
+    def _on_offer(self, identity, offer):
+        part_path = os.path.join(self.spool_dir, f"{offer['transfer_id']}.part")
+        transfer = _InboundFile(offer, part_path)
+        self._start(transfer)
+        self.socket.send_multipart([identity, ACCEPT, json.dumps({
+            'next_seq': transfer.next_seq,
+            'credit': self.window,
+            'codecs': available_codecs()
+        }).encode()])
+
+    def _on_have(self, identity, offer):
+        if self.store is None:
+            self._reply_error(identity, 'Incremental transfers not supported')
+            return
+        transfer = _InboundManifest(offer, self.store)
+        self._start(transfer)
+        self.socket.send_multipart([identity, WANT, json.dumps({
+            'want': transfer.want,
+            'credit': self.window,
+            'codecs': available_codecs()
+        }).encode()])
+
+    def _on_chunk(self, identity, body):
+        transfer_id, header, payload = body[0].decode(), body[1], body[2]
+        seq, codec_id, crc = _CHUNK_HEADER.unpack(header)
+        transfer = self.transfers.get(transfer_id)
+        if transfer is None:
+            self._reply_error(identity, f"Unknown transfer {transfer_id}")
+            return
+
+        transfer.last_activity = time.monotonic()
+        if seq < transfer.next_seq:
+            # Duplicate of a chunk we already hold
+            self.socket.send_multipart([identity, ACK, body[0], _SEQ.pack(transfer.next_seq)])
+            return
+
+        if seq == transfer.next_seq and zlib.crc32(payload) == crc:
+            try:
+                started = time.perf_counter()
+                transfer.write(seq, decompress_chunk(codec_id, payload))
+            except ValueError as e:
+                # The chunk arrived as sent, so sending it again cannot fix it
+                print(f"Rejected chunk {seq} of transfer {transfer_id}: {e}")
+                self.transfers.pop(transfer_id, None)
+                transfer.discard()
+                self._reply_error(identity, f"Chunk {seq} rejected: {e}")
+                return
+            transfer.busy_seconds += time.perf_counter() - started
+            transfer.next_seq += 1
+            self.socket.send_multipart([identity, ACK, body[0], _SEQ.pack(transfer.next_seq)])
+            return
+        elif seq == transfer.next_seq:
+            print(f"Checksum mismatch on chunk {seq} of transfer {transfer_id}")
+        self.socket.send_multipart([identity, NACK, body[0], _NACK_BODY.pack(transfer.next_seq, seq)])
+
+    def _on_done(self, identity, transfer_id):
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is None:
+            self._reply_error(identity, f"Unknown transfer {transfer_id}")
+            return None
+
+        if not transfer.verify():
+            transfer.discard()
+            self._reply_error(identity, 'Checkpoint failed verification')
+            return None
+
+        try:
+            if isinstance(transfer, _InboundManifest):
+                self.store.save_manifest(transfer.manifest)
+                checkpoint_dir = self.materialize(transfer.manifest, transfer.offer)
+            else:
+                checkpoint_dir = self.extract(transfer.part_path, transfer.offer)
+        finally:
+            transfer.discard()
+
+        self.socket.send_multipart([identity, COMPLETE, transfer_id.encode(), json.dumps({
+            'success': True,
+            'checkpoint_dir': checkpoint_dir,
+            # Lets the sender tell a slow link from a slow receiver
+            'busy_seconds': transfer.busy_seconds
+        }).encode()])
+        self.completed.append(transfer_id)
+        if isinstance(transfer, _InboundManifest):
+            # After the reply, so the sender does not wait on it
+            self.store.gc()
+        return checkpoint_dir, transfer.offer
+
+    def _on_abort(self, identity, transfer_id):
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer:
+            print(f"Transfer {transfer_id} aborted by the sender")
+            transfer.discard()
+        self.socket.send_multipart([identity, ABORTED, json.dumps({
+            'committed': transfer_id in self.completed
+        }).encode()])
+
+    def _reply_error(self, identity, error):
+        try:
+            self.socket.send_multipart([identity, ERROR, json.dumps({'success': False, 'error': error}).encode()])
+        except zmq.ZMQError:
+            pass
+
+    def close(self):
+        for transfer in self.transfers.values():
+            transfer.close()
+        self.transfers.clear()
+
+    def expire(self, transfer_id):
+        """Forget a stalled transfer; a .part file is kept so a later OFFER resumes it"""
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer:
+            transfer.close()
+
+
+class _WorkerChannel:
+    """Stands in for the ROUTER socket inside a TransferServer worker.
+
+    Replies are pushed to the frontend prefixed with the transfer they belong
+    to, so the frontend can release the transfer's slot on COMPLETE, ERROR or ABORTED.
+    """
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.transfer_id = b''
+
+    def send_multipart(self, frames):
+        self.socket.send_multipart([self.transfer_id] + list(frames))
+
+
+class TransferServer:
+    """Receives checkpoint transfers on a ROUTER socket with a pool of worker threads.
+
+    The frontend thread owns the ROUTER and only routes frames: every frame of
+    a transfer goes to the same worker (sharded by transfer ID), so workers
+    write, verify and extract different transfers in parallel. New transfers
+    beyond `max_active` are answered with BUSY and retried by the sender.
+    COMPLETE is acknowledged as soon as a checkpoint is verified and unpacked;
+    `on_received(checkpoint_dir, offer)` then runs on a separate restore pool,
+    so a slow restore never holds up the sender or other transfers.
+    RESERVE requests are answered by `on_reserve(request)` and RELEASE
+    requests by `on_release(reservation_id)` on the frontend thread (granted
+    when no handler is set), so neither may block.
+    """
+
+    def __init__(self, context, endpoint, receiver_factory, on_received, workers=RECEIVE_WORKERS,
+                 max_active=MAX_INBOUND_TRANSFERS, idle_timeout=TRANSFER_IDLE_TIMEOUT, on_reserve=None,
+                 on_release=None):
+        self.context = context
+        self.receiver_factory = receiver_factory
+        self.on_received = on_received
+        self.on_reserve = on_reserve
+        self.on_release = on_release
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.active = {}
+        self.active_lock = threading.Lock()
+        self.rejected = 0
+        self.running = True
+
+        self.socket = context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(endpoint)
+        self.reply_endpoint = f"inproc://transfer-replies-{id(self)}"
+        self.replies = context.socket(zmq.PULL)
+        self.replies.setsockopt(zmq.LINGER, 0)
+        self.replies.bind(self.reply_endpoint)
+
+        self.restore_pool = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix='restore')
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.workers = []
+        for i, jobs in enumerate(self.queues):
+            worker = threading.Thread(target=self._work, args=(jobs,), name=f"transfer-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.frontend_thread = threading.Thread(target=self._frontend, name='transfer-frontend')
+        self.frontend_thread.daemon = True
+        self.frontend_thread.start()
+
+    def active_count(self):
+        with self.active_lock:
+            return len(self.active)
+
+    def _queue_for(self, transfer_id):
+        return self.queues[zlib.crc32(transfer_id) % len(self.queues)]
+
+    def _frontend(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.replies, zmq.POLLIN)
+        next_sweep = time.monotonic() + 1.0
+
+        while self.running:
+            try:
+                events = dict(poller.poll(100))
+                if self.socket in events:
+                    self._route(self.socket.recv_multipart())
+                if self.replies in events:
+                    transfer_id, *frames = self.replies.recv_multipart()
+                    if frames[1] in (COMPLETE, ERROR, ABORTED):
+                        with self.active_lock:
+                            self.active.pop(transfer_id, None)
+                    self.socket.send_multipart(frames)
+                if time.monotonic() >= next_sweep:
+                    self._sweep()
+                    next_sweep = time.monotonic() + 1.0
+            except zmq.ZMQError as e:
+                if self.running:
+                    print(f"Error in transfer frontend: {e}")
+            except Exception as e:
+                print(f"Error in transfer frontend: {e}")
+
+    def _route(self, frames):
+        if len(frames) < 3:
+            self.socket.send_multipart([frames[0], ERROR, json.dumps({
+                'success': False, 'error': 'Malformed request'}).encode()])
+            return
+
+        command, transfer_id = frames[1], frames[2]
+        if command == RESERVE:
+            self._reserve(frames)
+            return
+        if command == RELEASE:
+            self._release(frames)
+            return
+        with self.active_lock:
+            if transfer_id not in self.active and command in (OFFER, HAVE) and len(self.active) >= self.max_active:
+                self.rejected += 1
+                busy = True
+            else:
+                self.active[transfer_id] = time.monotonic()
+                busy = False
+        if busy:
+            self.socket.send_multipart([frames[0], BUSY, json.dumps({
+                'success': False,
+                'busy': True,
+                'error': 'Receiver at inbound transfer limit',
+                'retry_after': BUSY_RETRY_AFTER
+            }).encode()])
+            return
+        self._queue_for(transfer_id).put(frames)
+
+    def _reserve(self, frames):
+        try:
+            reply = self.on_reserve(json.loads(frames[3])) if self.on_reserve else {'granted': True}
+        except Exception as e:
+            reply = {'granted': False, 'reason': f"Reservation failed: {e}"}
+        self.socket.send_multipart([frames[0], RESERVED, json.dumps(reply).encode()])
+
+    def _release(self, frames):
+        try:
+            if self.on_release:
+                self.on_release(frames[2].decode())
+        except Exception as e:
+            print(f"Error releasing reservation: {e}")
+        self.socket.send_multipart([frames[0], RELEASED])
+
+    def _sweep(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.active_lock:
+            stalled = [transfer_id for transfer_id, seen in self.active.items() if seen < cutoff]
+            for transfer_id in stalled:
+                del self.active[transfer_id]
+        for transfer_id in stalled:
+            print(f"Transfer {transfer_id.decode()} idle for {self.idle_timeout:.0f}s, releasing its slot")
+            self._queue_for(transfer_id).put(('expire', transfer_id))
+
+    def _work(self, jobs):
+        socket = self.context.socket(zmq.PUSH)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self.reply_endpoint)
+        channel = _WorkerChannel(socket)
+        receiver = self.receiver_factory(channel)
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                if isinstance(job, tuple):
+                    receiver.expire(job[1].decode())
+                    continue
+
+                channel.transfer_id = job[2]
+                completed = receiver.handle(job)
+                if completed:
+                    self.restore_pool.submit(self._restore, *completed)
+        finally:
+            receiver.close()
+            socket.close()
+
+    def _restore(self, checkpoint_dir, offer):
+        try:
+            self.on_received(checkpoint_dir, offer)
+        except Exception as e:
+            print(f"Error restoring checkpoint {checkpoint_dir}: {e}")
+
+    def close(self):
+        self.running = False
+        self.frontend_thread.join(timeout=1)
+        for jobs in self.queues:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout=1)
+        self.restore_pool.shutdown(wait=False)
+        self.replies.close()
+        self.socket.close()
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+import numpy as np
+
+# Synthetic workloads for dummy_service.
+#
+# A profile describes the load one service instance generates:
+#
+#   kind     cpu     vectorized NumPy arithmetic for work_ms per unit
+#            memory  allocate, touch and release mem_mb per unit
+#            io      write, fsync, read back and delete io_kb per unit
+#   workers  units run in parallel per task (0 = one per core)
+#   pool     thread (NumPy releases the GIL inside its kernels) or process
+#   rate     target tasks per second (0 = as fast as the pool allows)
+#   burst_seconds / idle_seconds / idle_rate
+#            alternate `rate` for burst_seconds with idle_rate for idle_seconds
+#
+# A task fans one unit out to every worker and waits for all of them, so a
+# cpu profile with workers=0 and rate=0 keeps every core busy. WORKLOAD picks
+# a profile and WORKLOAD_CONFIG names a JSON file of {name: {field: value}}
+# adding or overriding profiles; WORKLOAD_WORKERS and WORKLOAD_RATE override
+# those two fields. Both can go in a service's "env" in SERVICES_CONFIG.
+
+PROFILES = {
+    # Roughly the original dummy service: part of one core
+    'default': {'kind': 'cpu', 'workers': 1, 'rate': 2.0, 'work_ms': 300},
+    'cpu': {'kind': 'cpu', 'workers': 0, 'rate': 0, 'work_ms': 200},
+    'memory': {'kind': 'memory', 'workers': 0, 'rate': 4.0, 'mem_mb': 256},
+    'io': {'kind': 'io', 'workers': 4, 'rate': 20.0, 'io_kb': 4096},
+    'bursty': {'kind': 'cpu', 'workers': 0, 'rate': 20.0, 'work_ms': 50,
+               'burst_seconds': 5, 'idle_seconds': 15, 'idle_rate': 0.5}
+}
+KINDS = ('cpu', 'memory', 'io')
+POOLS = ('thread', 'process')
+# Completed tasks kept for the achieved-rate window
+RATE_WINDOW = 10.0
+CPU_BLOCK = 1 << 16
+PARENT_CHECK_INTERVAL = 1.0
+
+
+class WorkloadProfile:
+    """The shape of the load one service instance generates"""
+
+    def __init__(self, name, kind='cpu', workers=1, pool='thread', rate=2.0, work_ms=100, mem_mb=64,
+                 io_kb=1024, io_dir=None, burst_seconds=0, idle_seconds=0, idle_rate=0):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown workload kind {kind!r}, expected one of {KINDS}")
+        if pool not in POOLS:
+            raise ValueError(f"Unknown worker pool {pool!r}, expected one of {POOLS}")
+        self.name = name
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = pool
+        self.rate = rate
+        self.work_ms = work_ms
+        self.mem_mb = mem_mb
+        self.io_kb = io_kb
+        self.io_dir = io_dir or tempfile.gettempdir()
+        self.burst_seconds = burst_seconds
+        self.idle_seconds = idle_seconds
+        self.idle_rate = idle_rate
+
+    @classmethod
+    def from_dict(cls, name, config):
+        return cls(name, **config)
+
+    def rate_at(self, elapsed):
+        """Target task rate `elapsed` seconds into the run"""
+        if not self.burst_seconds or not self.idle_seconds:
+            return self.rate
+        in_burst = elapsed % (self.burst_seconds + self.idle_seconds) < self.burst_seconds
+        return self.rate if in_burst else self.idle_rate
+
+    def unit_args(self):
+        if self.kind == 'cpu':
+            return (self.work_ms,)
+        if self.kind == 'memory':
+            return (self.mem_mb,)
+        return (self.io_kb, self.io_dir)
+
+
+def load_profile(name=None, config_path=None):
+    """The profile named by WORKLOAD (default 'default'), with WORKLOAD_* overrides applied"""
+    name = name or os.environ.get('WORKLOAD', 'default')
+    config_path = config_path or os.environ.get('WORKLOAD_CONFIG')
+    profiles = {key: dict(value) for key, value in PROFILES.items()}
+    if config_path:
+        with open(config_path, 'r') as f:
+            for key, value in json.load(f).items():
+                profiles.setdefault(key, {}).update(value)
+    if name not in profiles:
+        raise ValueError(f"Unknown workload profile {name!r}, expected one of {sorted(profiles)}")
+    config = profiles[name]
+    if 'WORKLOAD_WORKERS' in os.environ:
+        config['workers'] = int(os.environ['WORKLOAD_WORKERS'])
+    if 'WORKLOAD_RATE' in os.environ:
+        config['rate'] = float(os.environ['WORKLOAD_RATE'])
+    return WorkloadProfile.from_dict(name, config)
+
+
+def cpu_unit(work_ms):
+    """Elementwise transcendental arithmetic on a float64 block until work_ms has passed"""
+    deadline = time.perf_counter() + work_ms / 1000
+    x = np.linspace(0.1, 1.0, CPU_BLOCK)
+    rounds = 0
+    while time.perf_counter() < deadline:
+        np.sin(x, out=x)
+        np.multiply(x, 1.7, out=x)
+        np.add(x, 0.3, out=x)
+        np.sqrt(np.abs(x, out=x), out=x)
+        rounds += 1
+    return rounds
+
+
+def memory_unit(mem_mb):
+    """Allocate mem_mb, write every page, stride over it, and let it go"""
+    block = np.empty(mem_mb * (1 << 20) // 8, dtype=np.float64)
+    block.fill(1.0)
+    for stride in (4096 // 8, 64 // 8):
+        block[::stride] += 1.0
+    total = float(block[::4096 // 8].sum())
+    del block
+    return total
+
+
+def io_unit(io_kb, io_dir):
+    """Write io_kb to a fresh file, fsync it, read it back and delete it"""
+    data = np.random.default_rng().integers(0, 256, io_kb * 1024, dtype=np.uint8).tobytes()
+    fd, path = tempfile.mkstemp(prefix='workload_', dir=io_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(path, 'rb') as f:
+            return len(f.read())
+    finally:
+        os.remove(path)
+
+
+UNITS = {'cpu': cpu_unit, 'memory': memory_unit, 'io': io_unit}
+
+
+def _watch_parent(parent_pid):
+    # Services are killed by PID alone; pool processes must not outlive them
+    while os.getppid() == parent_pid:
+        time.sleep(PARENT_CHECK_INTERVAL)
+    os._exit(0)
+
+
+def _init_process_worker(parent_pid):
+    watcher = threading.Thread(target=_watch_parent, args=(parent_pid,))
+    watcher.daemon = True
+    watcher.start()
+
+
+def _noop():
+    return None
+
+
+class WorkloadEngine:
+    """Runs a profile's tasks on a worker pool at its target rate"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        if profile.pool == 'process':
+            # Spawned, so a worker never inherits the service's locks or signal handlers
+            self.executor = ProcessPoolExecutor(profile.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_process_worker, initargs=(os.getpid(),))
+        else:
+            self.executor = ThreadPoolExecutor(profile.workers, thread_name_prefix='workload')
+        self.unit = UNITS[profile.kind]
+        self.started = time.monotonic()
+        self.next_start = self.started
+        self.completed = 0
+        self.units = 0
+        self.busy_seconds = 0.0
+        self.recent = deque()
+
+    def warm_up(self):
+        """Start every pool worker now instead of on the first task"""
+        wait([self.executor.submit(_noop) for _ in range(self.profile.workers)])
+
+    def run_task(self):
+        """Run one task: a unit on every worker, in parallel. Returns its duration."""
+        started = time.monotonic()
+        futures = [self.executor.submit(self.unit, *self.profile.unit_args()) for _ in range(self.profile.workers)]
+        for future in futures:
+            future.result()
+        finished = time.monotonic()
+
+        self.completed += 1
+        self.units += len(futures)
+        self.busy_seconds += finished - started
+        self.recent.append(finished)
+        while self.recent and self.recent[0] < finished - RATE_WINDOW:
+            self.recent.popleft()
+        return finished - started
+
+    def pace(self):
+        """Sleep until the next task is due at the profile's current rate"""
+        now = time.monotonic()
+        rate = self.profile.rate_at(now - self.started)
+        if rate <= 0:
+            self.next_start = now
+            return
+        # Late tasks do not build up a backlog to be rushed through later
+        self.next_start = max(self.next_start + 1.0 / rate, now - 1.0 / rate)
+        delay = self.next_start - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def stats(self):
+        now = time.monotonic()
+        elapsed = now - self.started
+        window = min(RATE_WINDOW, elapsed)
+        recent = sum(1 for finished in self.recent if finished >= now - window)
+        return {
+            'profile': self.profile.name,
+            'kind': self.profile.kind,
+            'workers': self.profile.workers,
+            'target_rate': self.profile.rate_at(elapsed),
+            'achieved_rate': recent / window if window > 0 else 0.0,
+            'tasks': self.completed,
+            'units': self.units,
+            'busy_fraction': self.busy_seconds / elapsed if elapsed > 0 else 0.0
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a workload profile on its own and report throughput')
+    parser.add_argument('profile', nargs='?', default=None, help=f"One of {sorted(PROFILES)} or from WORKLOAD_CONFIG")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    engine = WorkloadEngine(load_profile(args.profile))
+    engine.warm_up()
+    deadline = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < deadline:
+            engine.run_task()
+            engine.pace()
+    finally:
+        engine.close()
+    json.dump(engine.stats(), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,31 @@
+import os
+import time
+import checkpoint_store
+from checkpoint_store import CheckpointStore
+
+
+def _checkpoint(tmp_path, pid, payload):
+    checkpoint_dir = tmp_path / f"checkpoint_node1_{pid}"
+    checkpoint_dir.mkdir()
+    (checkpoint_dir / 'service_state.json').write_bytes(payload)
+    return str(checkpoint_dir)
+
+
+def test_gc_keeps_the_newest_checkpoints_of_a_service_across_pids(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint_store, 'GC_GRACE_SECONDS', 0)
+    store = CheckpointStore(str(tmp_path / 'store'), keep_manifests=2)
+    manifests = []
+    for pid in (101, 102, 103, 104):
+        checkpoint_dir = _checkpoint(tmp_path, pid, f"state of {pid}".encode())
+        manifests.append(store.put_checkpoint(checkpoint_dir, meta={'pid': pid, 'service': 'dummy_service'}))
+        time.sleep(0.01)
+    other = store.put_checkpoint(_checkpoint(tmp_path, 200, b'other service'), meta={'service': 'other'})
+
+    kept = sorted(filename[:-5] for filename in os.listdir(store.manifest_dir))
+    assert kept == sorted([manifests[2]['id'], manifests[3]['id'], other['id']])
+    for manifest in manifests[:2]:
+        assert store.latest_manifest(manifest['name']) is None
+        assert not store.has_chunk(manifest['files'][0]['chunks'][0])
+    for manifest in manifests[2:] + [other]:
+        assert store.latest_manifest(manifest['name'])['id'] == manifest['id']
+        assert store.has_chunk(manifest['files'][0]['chunks'][0])
@@ -0,0 +1,25 @@
+from failure_detector import FailureDetector
+
+
+class QuietCommunicator:
+    def register_callback(self, message_type, callback_func):
+        pass
+
+    def broadcast_message(self, message_type, data):
+        pass
+
+    def notify(self, message_type, data):
+        pass
+
+
+def test_heartbeats_are_timed_by_when_they_were_received():
+    detector = FailureDetector(QuietCommunicator(), ['2'])
+    try:
+        # Handled late and out of order by the dispatch workers
+        for received in (100.0, 101.0, 100.5, 102.0):
+            detector._on_heartbeat({'source': '2', 'received': received})
+        window = detector.arrivals['2']
+        assert window.last == 102.0
+        assert window.stats() == (1.0, 0.0)
+    finally:
+        detector.stop()
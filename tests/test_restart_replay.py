@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import signal
+from journal import read_journal, SEQ_KEY
+from recovery import RecoveryManager
+from registry import ServiceRegistry
+from services import ServicePolicy
+from standby import StandbyPool
+
+SHARED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared')
+STATE_FILE = '/tmp/dummy_service_state_{pid}.json'
+
+
+class RecordingCommunicator:
+    def __init__(self):
+        self.messages = []
+
+    def broadcast_message(self, message_type, data):
+        self.messages.append((message_type, data))
+
+
+def _wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError('timed out')
+
+
+def _journal_lines(pid):
+    try:
+        with open(f"{STATE_FILE.format(pid=pid)}.journal", 'r') as f:
+            return len(f.readlines())
+    except OSError:
+        return 0
+
+
+def _snapshot(pid):
+    try:
+        with open(STATE_FILE.format(pid=pid), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def test_restart_after_a_kill_replays_the_journal(tmp_path):
+    profiles = tmp_path / 'profiles.json'
+    profiles.write_text(json.dumps({'quick': {'kind': 'cpu', 'workers': 1, 'rate': 20.0, 'work_ms': 1}}))
+    policy = ServicePolicy('dummy_service', [sys.executable, os.path.join(SHARED, 'dummy_service.py')],
+                           state_file=STATE_FILE,
+                           env={'WORKLOAD': 'quick', 'WORKLOAD_CONFIG': str(profiles), 'NODE_ID': '1'})
+
+    manager = RecoveryManager.__new__(RecoveryManager)
+    manager.services = {policy.name: policy}
+    manager.registry = ServiceRegistry('test', registry_file=str(tmp_path / 'registry.json'))
+    manager.standby = StandbyPool(manager.registry, manager.services)
+    manager.communicator = RecordingCommunicator()
+    pids = []
+    try:
+        pid = manager.registry.spawn(policy.name, policy.cmd, env=policy.spawn_env())
+        pids.append(pid)
+        # Records committed to the journal since the last snapshot are all the crash leaves
+        _wait_for(lambda: _journal_lines(pid) > 0)
+        os.kill(pid, signal.SIGKILL)
+        _wait_for(lambda: manager.registry.get(pid) is None)
+        state, records = read_journal(STATE_FILE.format(pid=pid))
+        assert records
+
+        assert manager.restart_service(policy.name, replaces=pid)
+        new_pid = manager.communicator.messages[-1][1]['pid']
+        pids.append(new_pid)
+        restored = _wait_for(lambda: _snapshot(new_pid))
+        assert restored[SEQ_KEY] >= records[-1]['seq']
+        assert restored['processed_items'] >= state['processed_items'] + len(records)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            for path in (STATE_FILE.format(pid=pid), f"{STATE_FILE.format(pid=pid)}.journal"):
+                if os.path.exists(path):
+                    os.remove(path)
+        manager.registry.close()
@@ -0,0 +1,58 @@
+import re
+import numpy as np
+from events import to_line
+from training_data import EventTimeline, read_events
+
+
+class LineProtocolClient:
+    """Answers the events query from line protocol the way InfluxQL does.
+
+    A point is only returned when at least one selected field is non-null.
+    """
+
+    def __init__(self, lines):
+        self.points = []
+        for line in lines:
+            match = re.match(r'(\S+) (.*?)payload="(.*)" (\d+)$', line)
+            tags = dict(tag.split('=', 1) for tag in match.group(1).split(',')[1:])
+            fields = {'payload': match.group(3)}
+            for field in filter(None, match.group(2).split(',')):
+                name, value = field.split('=', 1)
+                fields[name] = int(value[:-1]) if value.endswith('i') else float(value)
+            self.points.append((int(match.group(4)) // 10 ** 9, tags, fields))
+
+    def query(self, statement):
+        selected = [name.strip('"') for name in statement[len('SELECT '):statement.index(' FROM')].split(', ')]
+        field_names = [name for name in selected if name not in ('kind', 'type', 'node')]
+        columns = ['time'] + selected
+        values = []
+        for timestamp, tags, fields in self.points:
+            if all(fields.get(name) is None for name in field_names):
+                continue
+            values.append([timestamp] + [tags[name] if name in tags else fields.get(name) for name in selected])
+        yield 'events', {}, columns, values
+
+
+def test_events_without_pid_are_read_back():
+    lines = [
+        to_line('node1', 'FAULT', {'type': 'cpu_stress', 'cores': 2}, 100 * 10 ** 9),
+        to_line('node1', 'FAULT', {'type': 'process_kill', 'pid': 42}, 200 * 10 ** 9),
+        to_line('node1', 'RECOVERY', {'action': 'service_restarted', 'service': 'dummy_service'}, 210 * 10 ** 9),
+    ]
+    events = read_events(LineProtocolClient(lines), 0, 1000)
+
+    assert [(event['time'], event['kind'], event['pid']) for event in events] == [
+        (100, 'cpu_stress', None), (200, 'process_kill', 42), (210, 'service_restarted', None)]
+
+
+def test_only_process_faults_are_scoped_to_their_pid():
+    timeline = EventTimeline([
+        {'time': 100, 'host': 'node1', 'kind': 'memory_leak', 'pid': 999},
+        {'time': 300, 'host': 'node1', 'kind': 'process_kill', 'pid': 42},
+    ], horizon=60)
+    end_times = np.array([50, 250], dtype=np.int64)
+
+    labels, _ = timeline.label('node1', 7, end_times)
+    assert labels.tolist() == [1, 0]
+    labels, _ = timeline.label('node1', 42, end_times)
+    assert labels.tolist() == [1, 1]
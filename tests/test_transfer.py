@@ -0,0 +1,103 @@
+import json
+import time
+import zlib
+import asyncio
+import zmq
+import zmq.asyncio
+from admission import AdmissionController, new_reservation_id
+from checkpoint_codecs import CodecSelector, PROBE_BYTES
+from transfer import (AsyncCheckpointSender, CheckpointReceiver, CheckpointSender, TransferServer, ABORT_TIMEOUT_MS, ACK,
+                      COMPLETE, CHUNK, DONE, HAVE, NACK, WANT, _CHUNK_HEADER, _NACK_BODY, _SEQ)
+
+CHUNK_SIZE = 128 * 1024
+
+
+class ScriptedReceiver:
+    """Answers the sender protocol like CheckpointReceiver, failing the checksum of chosen chunks once"""
+
+    def __init__(self, corrupt):
+        self.corrupt = set(corrupt)
+        self.next_seq = 0
+        self.replies = []
+        self.received = []
+
+    def on_send(self, frames):
+        command, transfer_id = frames[0], frames[1]
+        if command == HAVE:
+            self.replies.append([WANT, json.dumps({'want': [], 'credit': 8, 'codecs': ['raw']}).encode()])
+        elif command == CHUNK:
+            seq, _, crc = _CHUNK_HEADER.unpack(bytes(frames[2]))
+            if seq in self.corrupt and seq == self.next_seq:
+                self.corrupt.discard(seq)
+                crc ^= 1
+            if seq < self.next_seq:
+                self.replies.append([ACK, transfer_id, _SEQ.pack(self.next_seq)])
+            elif seq == self.next_seq and zlib.crc32(bytes(frames[3])) == crc:
+                self.received.append(bytes(frames[3]))
+                self.next_seq += 1
+                self.replies.append([ACK, transfer_id, _SEQ.pack(self.next_seq)])
+            else:
+                self.replies.append([NACK, transfer_id, _NACK_BODY.pack(self.next_seq, seq)])
+        elif command == DONE:
+            self.replies.append([COMPLETE, transfer_id, json.dumps({'success': True}).encode()])
+
+    def run(self, protocol):
+        try:
+            action, arg = next(protocol)
+            while True:
+                if action == 'send':
+                    self.on_send(arg)
+                    result = None
+                else:
+                    assert self.replies, 'sender is waiting for a reply that will never come'
+                    result = self.replies.pop(0)
+                action, arg = protocol.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+
+def test_corrupt_chunk_inside_the_probe_is_resent():
+    chunks = [bytes([seq]) * CHUNK_SIZE for seq in range(2 * PROBE_BYTES // CHUNK_SIZE)]
+    sender = CheckpointSender(context=None, selector=CodecSelector(mode='auto'))
+    assert sender.selector.needs_probe('peer')
+    receiver = ScriptedReceiver(corrupt=[3])
+    offer = {'transfer_id': 'probe-rewind'}
+    plan = lambda accepted: (0, len(chunks), lambda seq: chunks[seq])
+
+    reply = receiver.run(sender._protocol(HAVE, WANT, offer, plan, 'peer'))
+
+    assert reply['success']
+    assert receiver.received == chunks
+
+
+def test_released_reservation_frees_the_targets_capacity(tmp_path):
+    context = zmq.Context()
+    admission = AdmissionController('2')
+    endpoint = f"ipc://{tmp_path}/transfer"
+    server = TransferServer(context, endpoint, lambda socket: CheckpointReceiver(socket, str(tmp_path), None),
+                            lambda *args: None,
+                            on_reserve=lambda request: admission.reserve(request, {'cpu': 0.0, 'mem': 0.0}, 4, 4096),
+                            on_release=admission.release)
+    sender = CheckpointSender(context)
+    try:
+        request = {'reservation_id': new_reservation_id(), 'service': 'dummy_service', 'cpu': 50.0, 'mem_mb': 64}
+        assert sender.reserve(endpoint, request)['granted']
+        assert request['reservation_id'] in admission.reservations
+
+        assert sender.release(endpoint, request['reservation_id'])
+        assert not admission.reservations
+    finally:
+        server.close()
+        context.term()
+
+
+def test_abort_gives_up_quickly_on_a_silent_receiver(tmp_path):
+    context = zmq.asyncio.Context()
+    sender = AsyncCheckpointSender(context)
+    try:
+        started = time.monotonic()
+        reply = asyncio.run(sender.abort(f"ipc://{tmp_path}/nobody", 'transfer'))
+        assert reply is None
+        assert time.monotonic() - started < ABORT_TIMEOUT_MS / 1000 + 1
+    finally:
+        context.term()